@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+import argparse
+import importlib
+import os
+import sys
+
+## Subcommands and the script whose main() runs them in this process. A script is only imported when its
+## subcommand is run, so that e.g. pandas or matplotlib are not loaded to print the help of another one.
+SUBCOMMANDS = {
+    "simulate": ("run_read_count_simul", "Simulate the read counts of one condition for each row of a design file"),
+    "merge": ("merge_simul_conditions", "Merge pairs of datasets simulated for one condition into two-condition datasets"),
+    "design": ("create_nbmodel_design_file", "Write the nbmodel_stan2.py design file of one or several datasets"),
+    "fit": ("run_nbmodel_fits", "Fit the Bayesian model to every merged dataset over a pool of workers"),
+    "summarize": ("summarize_posterior_estimates", "Summarize the posterior estimates of the fits"),
+    "plot": ("plot_power", "Plot Type I error and power"),
+}
+
+def getOptions(argv=None):
+    parser = argparse.ArgumentParser(description="Run one step of the BayesASE power analysis. The options of each subcommand are those of its script, "
+                                                 "see <subcommand> --help",
+                                     epilog="\n".join("  {:<10} {} ({}.py)".format(name, description, module)
+                                                      for name, (module, description) in SUBCOMMANDS.items()),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "subcommand",
+        action="store",
+        choices=list(SUBCOMMANDS),
+        help="Step to run",
+    )
+    parser.add_argument(
+        "options",
+        action="store",
+        nargs=argparse.REMAINDER,
+        help="Options of the subcommand",
+    )
+    args = parser.parse_args(argv)
+    return args
+
+
+def run(subcommand, argv):
+    """Function to run a subcommand in the current process
+         Arguments:
+           :param subcommand: Name of the subcommand, a key of SUBCOMMANDS
+           :type subcommand: string
+
+           :param argv: Command line options of the subcommand
+           :type argv: list
+    """
+    module = importlib.import_module(SUBCOMMANDS[subcommand][0])
+    ## The usage and errors of the subcommand are reported as "bayesase_power.py <subcommand>"
+    prog = sys.argv[0]
+    sys.argv[0] = os.path.basename(prog) + " " + subcommand
+    try:
+        module.main(argv)
+    finally:
+        sys.argv[0] = prog
+
+
+def main(argv=None):
+    args = getOptions(argv)
+    run(args.subcommand, args.options)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+from plot_power import build_figures
+from run_nbmodel_fits import fit_dataset
+from summarize_posterior_estimates import compute_prop_hypothesis
+from tasks import benchmark
+from tasks import merge_catalog
+from tasks import simulate_nbmodel
+
+STAGES = ["simulate", "merge", "fit", "summarize", "plot_setup"]
+PLOT_PARAMETERS = ["num_bioreps", "num_allele_specific_reads_per_biorep", "nfeature", "delta_AI"]
+READS_PER_BIOREP = 100
+
+def getOptions():
+    parser = argparse.ArgumentParser(description="Time and measure the peak memory of every pipeline stage on synthetic inputs of several sizes")
+    parser.add_argument(
+        "-o",
+        "--outfile",
+        action="store",
+        default="benchmark_results.json",
+        help="JSON file to which to save the results (default: benchmark_results.json)",
+    )
+    parser.add_argument(
+        "--scale",
+        action="store",
+        choices=list(benchmark.SCALES),
+        default="small",
+        help="Preset of input sizes: 'small', 'medium' or 'large' (simruns up to 1e6 and 5000 .tabular files) (default: small)",
+    )
+    parser.add_argument(
+        "--simruns",
+        action="store",
+        type=int,
+        nargs='*',
+        required=False,
+        help="Optional list of numbers of simulated features of the simulate, merge and fit cases. Default - from --scale",
+    )
+    parser.add_argument(
+        "--nbiorep",
+        action="store",
+        type=int,
+        nargs='*',
+        required=False,
+        help="Optional list of numbers of bioreps of the simulate, merge and fit cases. Default - from --scale",
+    )
+    parser.add_argument(
+        "--tabular",
+        action="store",
+        type=int,
+        nargs='*',
+        required=False,
+        help="Optional list of numbers of .tabular files of the summarize and plot_setup cases. Default - from --scale",
+    )
+    parser.add_argument(
+        "--features",
+        action="store",
+        type=int,
+        default=500,
+        help="Number of features of each synthetic .tabular file (default: 500)",
+    )
+    parser.add_argument(
+        "--formats",
+        action="store",
+        nargs='*',
+        choices=["tsv", "npz"],
+        default=["tsv", "npz"],
+        help="Formats of the simulate and merge cases (default: tsv npz)",
+    )
+    parser.add_argument(
+        "-s",
+        "--stages",
+        action="store",
+        nargs='*',
+        choices=STAGES,
+        default=STAGES,
+        help="Stages to benchmark (default: every stage)",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        action="store",
+        type=int,
+        default=3,
+        help="Number of repetitions of each case, each in a new process (default: 3)",
+    )
+    parser.add_argument(
+        "--workdir",
+        action="store",
+        required=False,
+        help="Optional directory for the synthetic inputs, kept after the run. Default - a temporary directory that is removed",
+    )
+    parser.add_argument(
+        "-c",
+        "--compare",
+        action="store",
+        nargs='+',
+        required=False,
+        help="Baseline JSON file to compare the new results with, or a baseline and a current JSON file to compare without running",
+    )
+    parser.add_argument(
+        "--threshold",
+        action="store",
+        type=float,
+        default=1.2,
+        help="Ratio of wall time or peak memory to the baseline above which a case is reported as a regression (default: 1.2)",
+    )
+    args = parser.parse_args()
+    return args
+
+
+def simulated_pair(workdir, simruns, nbiorep, file_format):
+    """Function to simulate, once, the condition 1 and condition 2 datasets of the merge and fit cases
+         Returns:
+           :return: One row per merged dataset as in merge_catalog.pair_datasets, with the full output path in column outfile
+           :rtype: Pandas DataFrame
+    """
+    simdir = os.path.join(workdir, "simulated", "simruns_{}_nbiorep_{}_{}".format(simruns, nbiorep, file_format))
+    if not os.path.isdir(simdir):
+        os.makedirs(simdir)
+        rng = np.random.default_rng(1)
+        for theta in ["0.5", "0.6"]:
+            simulate_nbmodel.run_simulation(theta, str(simruns), str(nbiorep), str(READS_PER_BIOREP*nbiorep),
+                                            os.path.join(simdir, "out_set_1"), rng, file_format)
+    pairs = merge_catalog.pair_datasets(merge_catalog.build_catalog(simdir, file_format))
+    pairs = pairs[pairs["theta_c1"] != pairs["theta_c2"]].reset_index(drop=True)
+    pairs["outfile"] = [os.path.join(simdir, filename) for filename in pairs["filename"]]
+    return pairs
+
+
+def stub_command(workdir):
+    """Function to write an executable that runs the nbmodel_stan2.py stand-in with this Python
+         Returns:
+           :return: Path of the executable
+           :rtype: string
+    """
+    command = os.path.join(workdir, "nbmodel_stub")
+    with open(command, "w") as output:
+        output.write("#!/bin/sh\nexec '{}' '{}' \"$@\"\n".format(sys.executable,
+                     os.path.join(os.path.dirname(os.path.abspath(__file__)), "tasks", "nbmodel_stub.py")))
+    os.chmod(command, os.stat(command).st_mode | stat.S_IXUSR)
+    return command
+
+
+def plot_setup(df_summary, param, outdir):
+    """Function to build the figures of one parameter from a summary, as plot_power.py does before drawing them
+         Returns:
+           :return: Number of figures
+           :rtype: int
+    """
+    return len(build_figures(param, df_summary, outdir))
+
+
+def benchmark_cases(args, workdir):
+    """Function to list the benchmark cases, creating the inputs they need
+         Arguments:
+           :param args: Command line arguments with the stages and sizes
+           :type args: argparse Namespace
+
+           :param workdir: Directory for the synthetic inputs
+           :type workdir: string
+
+         Returns:
+           :return: Stage, parameters, function and arguments of each case
+           :rtype: list
+    """
+    scale = benchmark.SCALES[args.scale]
+    simruns_list = args.simruns if args.simruns else scale["simruns"]
+    nbiorep_list = args.nbiorep if args.nbiorep else scale["nbiorep"]
+    tabular_list = args.tabular if args.tabular else scale["tabular"]
+    cases = []
+    for simruns in simruns_list:
+        for nbiorep in nbiorep_list:
+            for file_format in args.formats:
+                params = {"simruns": simruns, "nbiorep": nbiorep, "format": file_format}
+                if "simulate" in args.stages:
+                    outprefix = os.path.join(workdir, "simulate", "out_set_1")
+                    os.makedirs(os.path.dirname(outprefix), exist_ok=True)
+                    cases.append(("simulate", params, simulate_nbmodel.run_simulation,
+                                  ("0.6", str(simruns), str(nbiorep), str(READS_PER_BIOREP*nbiorep), outprefix,
+                                   np.random.default_rng(1), file_format)))
+                if "merge" in args.stages:
+                    cases.append(("merge", params, merge_catalog.merge_group, (simulated_pair(workdir, simruns, nbiorep, file_format),)))
+                if "fit" in args.stages:
+                    pairs = simulated_pair(workdir, simruns, nbiorep, file_format)
+                    merge_catalog.merge_group(pairs)
+                    compID = os.path.splitext(pairs["filename"].iloc[0])[0]
+                    fitdir = os.path.join(workdir, "fit")
+                    os.makedirs(fitdir, exist_ok=True)
+                    options = argparse.Namespace(engine="stan", nbmodel=stub_command(workdir), chains=2, iterations=6000, warmup=3000)
+                    cases.append(("fit", params, fit_dataset, (compID, pairs["outfile"].iloc[0], options, fitdir, fitdir + "_work")))
+    for nfile in tabular_list:
+        resultdir = os.path.join(workdir, "tabular_{}".format(nfile))
+        if "summarize" in args.stages or "plot_setup" in args.stages:
+            if not os.path.isdir(resultdir):
+                benchmark.synthetic_results(resultdir, nfile, args.features)
+        params = {"tabular": nfile, "features": args.features}
+        if "summarize" in args.stages:
+            cases.append(("summarize", params, compute_prop_hypothesis, ([resultdir],)))
+        if "plot_setup" in args.stages:
+            df_summary = compute_prop_hypothesis([resultdir])
+            for param in PLOT_PARAMETERS:
+                cases.append(("plot_setup", dict(params, param=param), plot_setup, (df_summary, param, os.path.join(workdir, "plots"))))
+    return cases
+
+
+def compare(baseline_file, current, threshold):
+    """Function to print the comparison of results with a baseline
+         Returns:
+           :return: Number of regressions
+           :rtype: int
+    """
+    with open(baseline_file) as data:
+        baseline = json.load(data)
+    df_compare = benchmark.compare_results(baseline, current, threshold)
+    print("Baseline: commit " + baseline["environment"]["commit"] + ", " + baseline["environment"]["date"])
+    print("Current: commit " + current["environment"]["commit"] + ", " + current["environment"]["date"])
+    with pd.option_context("display.max_rows", None, "display.max_colwidth", None, "display.width", 200):
+        print(df_compare.to_string(index=False))
+    regressions = int(df_compare["regression"].sum())
+    print(str(regressions) + " regression(s) above a ratio of " + str(threshold) + " in " + str(df_compare.shape[0]) + " shared cases")
+    return regressions
+
+
+def main():
+    args = getOptions()
+    if args.compare and len(args.compare) > 2:
+        raise SystemExit("--compare takes a baseline file and optionally a current file")
+    if args.compare and len(args.compare) == 2:
+        with open(args.compare[1]) as data:
+            current = json.load(data)
+        if compare(args.compare[0], current, args.threshold):
+            raise SystemExit(1)
+        return
+
+    workdir = args.workdir if args.workdir else tempfile.mkdtemp(prefix="bayesase_benchmark_")
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        print("Preparing synthetic inputs in " + workdir)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            cases = benchmark_cases(args, workdir)
+        results = []
+        for stage, params, function, function_args in cases:
+            result = dict({"stage": stage, "params": params}, **benchmark.measure(function, function_args, args.repeat))
+            print("{} {}: {:.3f} s, peak {:.1f} MB".format(stage, json.dumps(params, sort_keys=True), result["wall_s_min"],
+                                                           result["peak_rss_mb"]))
+            results.append(result)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    current = {"environment": benchmark.environment(), "repeat": args.repeat, "results": results}
+    with open(args.outfile, "w") as output:
+        json.dump(current, output, indent=1)
+    print("Results of " + str(len(results)) + " cases saved to " + args.outfile)
+    if args.compare and compare(args.compare[0], current, args.threshold):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
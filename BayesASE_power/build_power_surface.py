@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+import argparse
+import pandas as pd
+from tasks import power_surface
+
+def getOptions():
+    parser = argparse.ArgumentParser(description="Build a power and Type I error lookup surface over num_bioreps, "
+                                                 "num_allele_specific_reads_per_biorep and delta_AI from summary CSV files")
+    parser.add_argument(
+        "-i",
+        "--infile",
+        action="store",
+        nargs='*',
+        help="(List of) CSV file(s) written by summarize_posterior_estimates.py",
+    )
+    parser.add_argument(
+        "-o",
+        "--outfile",
+        action="store",
+        default="power_surface.npz",
+        help="Binary file to which to save the surface (default: power_surface.npz)",
+    )
+    parser.add_argument(
+        "-w",
+        "--where",
+        action="store",
+        required=False,
+        help="Optional selection of the summary rows, as a pandas query, e.g. \"phi_sim == 0.02 and r_g1 == 0.8\". "
+             "Required if the summaries mix several map biases, dispersions or biorep effects. Default - every row",
+    )
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = getOptions()
+    df_summary = pd.concat([pd.read_csv(infile) for infile in args.infile], ignore_index=True)
+    if args.where:
+        df_summary = df_summary.query(args.where)
+    if df_summary.empty:
+        raise SystemExit("No summary rows to build the surface from")
+    try:
+        header, axes, arrays = power_surface.build_surface(df_summary, args.infile, args.where)
+    except ValueError as error:
+        raise SystemExit(str(error))
+    power_surface.save_surface(args.outfile, header, axes, arrays)
+    print("Surface of " + str(header["rows"]) + " summary rows saved to " + args.outfile)
+    for name, values in axes.items():
+        print("  " + name + ": " + " ".join("{:g}".format(value) for value in values))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import argparse
+import pandas as pd
+from summarize_posterior_estimates import compute_prop_hypothesis
+
+SCENARIO_COLUMNS = ["nfeature", "r_g1", "r_g2", "num_bioreps", "num_allele_specific_reads", "theta1_sim", "theta2_sim",
+                    "delta_AI_1", "delta_AI_2", "delta_AI_3"]
+RATE_COLUMNS = {"H1": ("prop_H1_LE05", "delta_AI_1"), "H2": ("prop_H2_LE05", "delta_AI_2"), "H3": ("prop_H3_LE05", "delta_AI_3")}
+
+def getOptions():
+    parser = argparse.ArgumentParser(description="Compare Type I error and power of the approximate model fit with those of the MCMC fit")
+    parser.add_argument(
+        "-m",
+        "--mcmcdirs",
+        action="store",
+        nargs='*',
+        help="(List of) folder(s) with outputs from the Bayesian ASE model fit by nbmodel_stan2.py on the reference grid",
+    )
+    parser.add_argument(
+        "-a",
+        "--approxdirs",
+        action="store",
+        nargs='*',
+        help="(List of) folder(s) with outputs from fit_approx_nbmodel.py on the same datasets",
+    )
+    parser.add_argument(
+        "-o",
+        "--outfile",
+        action="store",
+        required=False,
+        help="Output file name/path. Default - approx_calibration.csv",
+    )
+    args = parser.parse_args()
+    return args
+
+
+def compare_fits(df_mcmc, df_approx):
+    """Function to compare the proportion of features with Bayes evidence < 0.05 between two fits of the same scenarios
+         Arguments:
+           :param df_mcmc: Summary of the MCMC fits, as returned by compute_prop_hypothesis
+           :type df_mcmc: Pandas DataFrame
+
+           :param df_approx: Summary of the approximate fits, as returned by compute_prop_hypothesis
+           :type df_approx: Pandas DataFrame
+
+         Returns:
+           :return: Dataframe with one row per scenario and hypothesis with the rate of each fit, their difference,
+                and whether the rate is a Type I error (delta_AI = 0) or power
+           :rtype: Pandas DataFrame
+    """
+    frames = []
+    for name, df_fit in [("mcmc", df_mcmc), ("approx", df_approx)]:
+        ## Only the scenario and the rates are numeric: recombined fits also have the names of their source sets
+        df_fit = df_fit[SCENARIO_COLUMNS + [rate for rate, delta in RATE_COLUMNS.values()]].apply(pd.to_numeric)
+        rates = [df_fit[SCENARIO_COLUMNS + [rate]].rename(columns={rate: "rate"}).assign(hypothesis=hypothesis)
+                 for hypothesis, (rate, delta) in RATE_COLUMNS.items()]
+        ## Replicated scenarios are averaged before comparing the fits
+        frames.append(pd.concat(rates).groupby(SCENARIO_COLUMNS + ["hypothesis"]).agg(**{name: ("rate", "mean")}))
+    df_compare = frames[0].join(frames[1], how="inner").reset_index()
+    df_compare["error_type"] = "power"
+    for hypothesis, (rate, delta) in RATE_COLUMNS.items():
+        df_compare.loc[(df_compare["hypothesis"] == hypothesis) & (df_compare[delta] == 0), "error_type"] = "type_I_error"
+    df_compare["difference"] = df_compare["approx"] - df_compare["mcmc"]
+    return df_compare
+
+
+def main():
+    args = getOptions()
+    df_compare = compare_fits(compute_prop_hypothesis(args.mcmcdirs), compute_prop_hypothesis(args.approxdirs))
+    outfile = args.outfile if args.outfile else "approx_calibration.csv"
+    df_compare.to_csv(outfile, index=False)
+
+    df_compare["abs_difference"] = df_compare["difference"].abs()
+    print(df_compare.groupby(["error_type", "hypothesis"]).agg(
+            n_scenarios=("difference", "size"), mean_difference=("difference", "mean"),
+            mean_abs_difference=("abs_difference", "mean"), max_abs_difference=("abs_difference", "max")).to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,17 @@
 #!/usr/bin/env python3
 
 import argparse
+import glob
 import os
 
-def getOptions():
+def getOptions(argv=None):
     parser = argparse.ArgumentParser(description="Fit Bayesian model to read count data")
     parser.add_argument(
         "-i",
         "--infile",
         action="store",
-        help="Filename of simulated read count dataset",
+        nargs='*',
+        help="(List of) filename(s) of simulated read count dataset(s), or folder(s) of datasets, listed as one compID row each",
     )
     parser.add_argument(
         "-o",
@@ -18,22 +20,89 @@ def getOptions():
         required=False,
         help="Output design file name/path. Default - condition_design_file.tsv in current working directory",
     )
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     return args
 
 
-def main():
-    args = getOptions()
-    input_filename = os.path.splitext(os.path.basename(args.infile))[0]
+def write_design_file(infile, outfile):
+    """Function to write the design file used by nbmodel_stan2.py to fit one simulated dataset
+         Arguments:
+           :param infile: Filename of simulated read count dataset. The compID is the filename without extension.
+           :type infile: string
+
+           :param outfile: Output design file name/path
+           :type outfile: string
+    """
+    write_batch_design_file([infile], outfile)
+
+
+def write_batch_design_file(infiles, outfile):
+    """Function to write a design file listing several simulated datasets, one compID row each, so that they
+        can be fit in one invocation
+         Arguments:
+           :param infiles: Filenames of simulated read count datasets. The compID is the filename without extension.
+           :type infiles: list
+
+           :param outfile: Output design file name/path
+           :type outfile: string
+
+         Returns:
+           :return: compIDs in the order of the rows
+           :rtype: list
+    """
+    compIDs = []
+    for infile in infiles:
+        input_filename = os.path.splitext(os.path.basename(infile))[0]
+        if input_filename in compIDs:
+            raise ValueError("Several datasets have the compID " + input_filename)
+        compIDs.append(input_filename)
+
+    with open(outfile, "w") as output:
+        output.write('\t'.join(["Comparate_1", "Comparate_2", "compID"]) + "\n")
+        output.write("\n".join('\t'.join(["c1", "c2", input_filename]) for input_filename in compIDs))
+    return compIDs
+
+
+def list_datasets(paths):
+    """Function to expand folders into the simulated datasets they hold
+         Arguments:
+           :param paths: Filenames of datasets, or folders of .tsv and .npz datasets
+           :type paths: list
+
+         Returns:
+           :return: Filenames of the datasets. TSV files are preferred over npz files of the same dataset.
+           :rtype: list
+    """
+    infiles = []
+    for path in paths:
+        if not os.path.isdir(path):
+            infiles.append(path)
+            continue
+        datasets = {}
+        for extension in ["npz", "tsv"]:
+            for infile in sorted(glob.glob(os.path.join(path, "*." + extension))):
+                datasets[os.path.splitext(os.path.basename(infile))[0]] = infile
+        infiles.extend(datasets[compID] for compID in sorted(datasets))
+    return infiles
+
+
+def main(argv=None):
+    args = getOptions(argv)
 
     if not args.outfile:
         outfile = "condition_design_file.tsv"
     else:
         outfile = args.outfile
 
-    with open(outfile, "w") as output:
-        output.write('\t'.join(["Comparate_1", "Comparate_2", "compID"]) + "\n")
-        output.write('\t'.join(["c1", "c2", input_filename]))
+    infiles = list_datasets(args.infile)
+    if not infiles:
+        raise SystemExit("No dataset in " + ", ".join(args.infile))
+    try:
+        compIDs = write_batch_design_file(infiles, outfile)
+    except ValueError as error:
+        raise SystemExit(str(error))
+    if len(compIDs) > 1:
+        print(str(len(compIDs)) + " comparisons listed in " + outfile)
 
 
 if __name__ == "__main__":
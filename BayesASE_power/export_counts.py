@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+from tasks import count_store
+
+def getOptions():
+    parser = argparse.ArgumentParser(description="Convert simulated read count datasets in the binary npz format to the TSV read by nbmodel_stan2.py")
+    parser.add_argument(
+        "-i",
+        "--infiles",
+        action="store",
+        nargs='*',
+        help="(List of) simulated or merged dataset(s) in npz format",
+    )
+    parser.add_argument(
+        "-o",
+        "--outdir",
+        action="store",
+        required=False,
+        help="Directory to which to save the TSV files. Default - directory of each input file",
+    )
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = getOptions()
+    for infile in args.infiles:
+        outdir = args.outdir if args.outdir else os.path.dirname(infile)
+        outfile = os.path.join(outdir, os.path.splitext(os.path.basename(infile))[0] + ".tsv")
+        count_store.export_tsv(infile, outfile)
+        print(outfile)
+
+
+if __name__ == "__main__":
+    main()
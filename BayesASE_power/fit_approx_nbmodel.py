@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+from tasks import count_store
+from tasks import approx_nbmodel
+from tasks import integrity
+from tasks import simulate_nbmodel
+
+def getOptions():
+    parser = argparse.ArgumentParser(description="Fit a fast grid approximation of the Bayesian NB model to simulated read count data")
+    parser.add_argument(
+        "-i",
+        "--infiles",
+        action="store",
+        nargs='*',
+        help="(List of) merged simulated read count dataset(s), in TSV or npz format",
+    )
+    parser.add_argument(
+        "-o",
+        "--outdir",
+        action="store",
+        required=False,
+        help="Directory to which to save the bayesian_out_<compID>.tabular files. Default - current working directory",
+    )
+    parser.add_argument(
+        "--phi",
+        action="store",
+        type=float,
+        default=simulate_nbmodel.TRUE_PHI,
+        help="Optional negative binomial dispersion parameter assumed by the fit (default: 0.02)",
+    )
+    parser.add_argument(
+        "--grid",
+        action="store",
+        type=int,
+        default=approx_nbmodel.GRID_SIZE,
+        help="Optional number of log(alpha) grid points on which the posterior is evaluated (default: 401)",
+    )
+    args = parser.parse_args()
+    return args
+
+
+def fit_file(infile, outdir, phi=simulate_nbmodel.TRUE_PHI, grid_size=approx_nbmodel.GRID_SIZE):
+    """Function to fit the approximate model to one dataset and save the result as nbmodel_stan2.py does
+         Arguments:
+           :param infile: Merged simulated read count dataset, in TSV or npz format
+           :type infile: string
+
+           :param outdir: Directory to which to save the bayesian_out_<compID>.tabular file
+           :type outdir: string
+
+         Returns:
+           :return: Name of the file written
+           :rtype: string
+    """
+    comparison = os.path.splitext(os.path.basename(infile))[0]
+    priors, counts = count_store.load_counts(infile)
+    df_result = approx_nbmodel.fit_dataset(priors, counts, comparison, phi, approx_nbmodel.log_alpha_grid(grid_size))
+    outfile = os.path.join(outdir, "bayesian_out_" + comparison + ".tabular")
+    with integrity.atomic_path(outfile) as temporary:
+        df_result.to_csv(temporary, index=False, sep="\t")
+    return outfile
+
+
+def main():
+    args = getOptions()
+    outdir = args.outdir if args.outdir else os.path.curdir
+    os.makedirs(outdir, exist_ok=True)
+    for infile in args.infiles:
+        print(fit_file(infile, outdir, args.phi, args.grid))
+
+
+if __name__ == "__main__":
+    main()
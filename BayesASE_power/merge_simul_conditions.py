@@ -2,22 +2,29 @@
 
 import argparse
 import os
-import subprocess
-import sys
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from tasks import merge_catalog
+from tasks import scenario_store
+from tasks import simulate_nbmodel
+from tasks import telemetry
 
-def getOptions():
+def getOptions(argv=None):
     parser = argparse.ArgumentParser(description="Merge pairs of read counts datasets simulated for one condition")
     parser.add_argument(
         "-d1",
         "--design_c1",
         action="store",
-        help="Design file name/path under which condition 1 is simulated",
+        required=False,
+        help="Optional design file name/path under which condition 1 is simulated. Default - every simulated dataset",
     )
     parser.add_argument(
         "-d2",
         "--design_c2",
         action="store",
-        help="Design file name/path under which condition 2 is simulated",
+        required=False,
+        help="Optional design file name/path under which condition 2 is simulated. Default - every simulated dataset",
     )
     parser.add_argument(
         "-i",
@@ -32,44 +39,148 @@ def getOptions():
         required=False,
         help="Output directory name/path. Default - $inputdir/H1_<>_H2_<>_H3_<> where <> is null or not_null",
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "-f",
+        "--format",
+        action="store",
+        choices=["tsv", "npz"],
+        required=False,
+        help="Only merge simulated datasets in this format: 'tsv' or the binary 'npz' format. Default - both",
+    )
+    parser.add_argument(
+        "-a",
+        "--all_pairs",
+        action="store_true",
+        help="Merge every pair of levels of AI, including theta1 != theta2 with theta1 != 0.5 (H1_not_null_H2_not_null_H3_not_null). "
+             "By default only pairs with theta1 = 0.5 or theta1 = theta2 are merged",
+    )
+    parser.add_argument(
+        "-k",
+        "--recombine",
+        action="store",
+        type=int,
+        required=False,
+        help="Optional number of merged datasets to build per scenario from distinct pairings of the simulated sets. "
+             "Filenames end in _sets_<set_c1>-<set_c2>. Default - one merged dataset per scenario",
+    )
+    parser.add_argument(
+        "--resample",
+        action="store_true",
+        help="With -k, complete scenarios with fewer than k distinct pairings by resampling the features of the pairings",
+    )
+    parser.add_argument(
+        "--crn",
+        action="store_true",
+        help="The datasets were simulated with run_read_count_simul.py --crn: condition 1 and condition 2 always come "
+             "from different sets, which must be at least 2, so that they stay independent",
+    )
+    parser.add_argument(
+        "--seed",
+        action="store",
+        type=int,
+        required=False,
+        help="Optional master seed of the feature resampling. Default - a random seed that is printed",
+    )
+    parser.add_argument(
+        "--store",
+        action="store",
+        required=False,
+        help="Optional SQLite scenario store (created if needed) in which to record the merged datasets",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        action="store",
+        type=int,
+        default=1,
+        help="Optional number of scenarios to merge at the same time (default: 1)",
+    )
+    parser.add_argument(
+        "--telemetry",
+        action="store",
+        required=False,
+        help="Optional JSON-lines log to which to append the wall time, CPU time, peak memory and I/O of every merged dataset "
+             "(also switched on by the BAYESASE_TELEMETRY environment variable)",
+    )
+    args = parser.parse_args(argv)
     return args
 
 
-def main():
-    args = getOptions()
+def design_scenarios(design_file):
+    """Function to list the scenarios of a design file with the keys of the catalog
+         Arguments:
+           :param design_file: CSV design file given to run_read_count_simul.py
+           :type design_file: string
+
+         Returns:
+           :return: Scenarios with columns theta, nbiorep, allelicreads and simruns
+           :rtype: Pandas DataFrame
+    """
+    df = pd.read_csv(design_file, dtype=str)
+    return df.rename(columns={"n_allele_specific_reads": "allelicreads"})[["theta", "nbiorep", "allelicreads", "simruns"]]
+
 
-    if "not_null" in args.design_c1:
-        if "not_null" in args.design_c2: # Assumes that there is the same level of allelic imbalance for condition 1 and 2
-            print("H1 not null, H2 not null, H3 null")
-            if not args.outdir:
-                output_dir = os.path.join(args.inputdir, "H1_not_null_H2_not_null_H3_null")
-            else:
-                output_dir = args.outdir
-            cmd_args = [args.design_c1, "1", args.design_c2, "2", args.inputdir, output_dir]
+def main(argv=None):
+    args = getOptions(argv)
+    if args.telemetry:
+        telemetry.enable(args.telemetry)
+
+    catalog = merge_catalog.build_catalog(args.inputdir, args.format)
+    if args.recombine:
+        seed = np.random.SeedSequence(args.seed).entropy
+        if args.resample:
+            print("Master seed: " + str(seed))
+        pairs = merge_catalog.recombine_pairs(catalog, args.recombine, args.all_pairs, args.resample, seed, args.crn)
+    else:
+        pairs = merge_catalog.pair_datasets(catalog, args.all_pairs, args.crn)
+    ## Restrict condition 1 and condition 2 to the scenarios of their design files
+    for condition, design_file in [("c1", args.design_c1), ("c2", args.design_c2)]:
+        if design_file:
+            scenarios = design_scenarios(design_file).rename(columns={"theta": "theta_" + condition}).drop_duplicates()
+            pairs = pairs.merge(scenarios, on=list(scenarios.columns), how="inner")
+    if pairs.empty:
+        print("No pairs of simulated datasets to merge in " + args.inputdir)
+        return
+
+    if args.outdir:
+        pairs["outdir"] = args.outdir
     else:
-        if "not_null" in args.design_c2:
-            print("H1 null, H2 not null, H3 not null")
-            if not args.outdir:
-                output_dir = os.path.join(args.inputdir, "H1_null_H2_not_null_H3_not_null")
-            else:
-                output_dir = args.outdir
-            cmd_args = [args.design_c1, "1", args.design_c2, "1", args.inputdir, output_dir]
-        else:
-            print("H1 null, H2 null, H3 null")
-            if not args.outdir:
-                output_dir = os.path.join(args.inputdir, "H1_null_H2_null_H3_null")
-            else:
-                output_dir = args.outdir
-            cmd_args = [args.design_c1, "1", args.design_c2, "2", args.inputdir, output_dir]
+        pairs["outdir"] = [os.path.join(args.inputdir, outdir) for outdir in pairs["outdir"]]
+    pairs["outfile"] = [os.path.join(outdir, filename) for outdir, filename in zip(pairs["outdir"], pairs["filename"])]
+    for outdir, df_dir in pairs.groupby("outdir"):
+        os.makedirs(outdir, exist_ok=True)
+        print(outdir + ": " + str(df_dir.shape[0]) + " merged datasets")
+    if args.recombine:
+        ## Source sets of every merged dataset, next to the H1_<>_H2_<>_H3_<> folders
+        sources_file = os.path.join(args.outdir if args.outdir else args.inputdir, "merged_sources.csv")
+        pairs[merge_catalog.SOURCE_COLUMNS].to_csv(sources_file, index=False)
+        print("Source sets saved to " + sources_file)
 
-    if not os.path.exists(output_dir):
-         os.makedirs(output_dir)
+    ## Each source dataset is read once per group of scenarios sharing everything but theta
+    groups = [df_group for key, df_group in pairs.groupby(merge_catalog.SHARED_KEYS, sort=False)]
+    if args.jobs > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            written = sum(len(files) for files in executor.map(merge_catalog.merge_group, groups))
+    else:
+        written = sum(len(merge_catalog.merge_group(df_group)) for df_group in groups)
+    print(str(written) + " merged datasets written")
 
-    cmd = [sys.executable, os.path.join(sys.path[0],"tasks/merge_2_simul.py")]
-    cmd.extend(cmd_args)
-    print(" ".join(cmd))
-    subprocess.call(cmd)
+    if args.store:
+        hashes = {}
+        for row in pairs.to_dict("records"):
+            for path in [row["path_c1"], row["path_c2"]]:
+                if path not in hashes:
+                    hashes[path] = scenario_store.file_hash(path)
+            params = {"theta1": row["theta_c1"], "theta2": row["theta_c2"], "rsim-g1": row["rsim-g1"], "rsim-g2": row["rsim-g2"],
+                      "nbiorep": row["nbiorep"], "allelicreads": row["allelicreads"], "simruns": row["simruns"],
+                      "set_c1": str(row["set_c1"]), "set_c2": str(row["set_c2"])}
+            if simulate_nbmodel.scenario_suffix(row["phi"], row["biorepsd"]):
+                params.update({"phi": row["phi"], "biorepsd": row["biorepsd"]})
+            seed = "-".join(str(value) for value in row["resample_seed"]) if row["resample"] > 0 else None
+            scenario_store.record(args.store, "merged", row["outfile"], params, seed,
+                                  {"format": row["format"], "resample": int(row["resample"])},
+                                  [hashes[row["path_c1"]], hashes[row["path_c2"]]])
+        print("Merged datasets recorded in " + args.store)
 
 
 if __name__ == "__main__":
@@ -4,11 +4,14 @@ import os
 import argparse
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.ticker import (MultipleLocator, FormatStrFormatter, AutoMinorLocator)
-import seaborn as sns ### To import colorblind color palette
+from concurrent.futures import ProcessPoolExecutor
+from tasks import telemetry
+## matplotlib is imported by the functions that draw, so that --help and callers that only prepare figures
+## do not load it
+## seaborn's "colorblind" palette, cycled when there are more legend values than colors
+COLORBLIND_PALETTE = ["#0173b2", "#de8f05", "#029e73", "#d55e00", "#cc78bc", "#ca9161", "#fbafe4", "#949494", "#ece133", "#56b4e9"]
 
-def getOptions():
+def getOptions(argv=None):
     parser = argparse.ArgumentParser(description="Plot Type I error and power")
     parser.add_argument(
         "-p",
@@ -31,9 +34,35 @@ def getOptions():
         nargs='*',
         help="(List of) CSV file(s)/path(s) of parameters used for simulation and summary statistics of Bayesian model posterior estimates",
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        action="store",
+        type=int,
+        default=1,
+        help="Optional number of figures to draw at the same time (default: 1)",
+    )
+    parser.add_argument(
+        "--telemetry",
+        action="store",
+        required=False,
+        help="Optional JSON-lines log to which to append the wall time, CPU time, peak memory and I/O of the preparation and drawing of the figures "
+             "(also switched on by the BAYESASE_TELEMETRY environment variable)",
+    )
+    args = parser.parse_args(argv)
     return(args)
 
+def load_pyplot():
+    """Function to import matplotlib.pyplot with the non-interactive backend, figures are only saved to files
+         Returns:
+           :return: matplotlib.pyplot module
+           :rtype: module
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return(plt)
+
 def specify_data_to_plot(df_data, xaxis, hypothesis, legend, flag_power, delta_AI = None):
     """Function to create a dataframe of the data that is to be plotted
          Arguments:
@@ -59,41 +88,66 @@ def specify_data_to_plot(df_data, xaxis, hypothesis, legend, flag_power, delta_A
            :return : Dataframe with data in format necessary to use the create_plot function
            :rypte: Pandas DataFrame
     """
-    df_data_w_legend = pd.DataFrame()
-    for index, row in df_data.iterrows():
-        if flag_power == 1:
-            if hypothesis == "H1":
-                if delta_AI:
-                    if row.delta_AI_1 == delta_AI:
-                        df_data_w_legend = df_data_w_legend.append(pd.DataFrame([{xaxis:row[xaxis], "prop_LE05":row.prop_H1_LE05, legend: row[legend]}]))
-                    if row.delta_AI_2 == delta_AI:
-                            df_data_w_legend = df_data_w_legend.append(pd.DataFrame([{xaxis:row[xaxis], "prop_LE05":row.prop_H2_LE05, legend: row[legend]}]))
-                else:
-                    if row.delta_AI_1 != 0:
-                        df_data_w_legend = df_data_w_legend.append(pd.DataFrame([{xaxis:row[xaxis], "prop_LE05":row.prop_H1_LE05, legend: row[legend]}]))
-                    if row.delta_AI_2 != 0:
-                        if legend == "delta_AI_1":
-                            df_data_w_legend = df_data_w_legend.append(pd.DataFrame([{xaxis:row[xaxis], "prop_LE05":row.prop_H2_LE05, legend: row.delta_AI_2}]))
-                        if xaxis == "delta_AI_1":
-                            df_data_w_legend = df_data_w_legend.append(pd.DataFrame([{xaxis:row["delta_AI_2"], "prop_LE05":row.prop_H2_LE05, legend: row[legend]}]))
-            if hypothesis == "H3":
-                if delta_AI: 
-                    if row.delta_AI_3 == delta_AI:
-                        df_data_w_legend = df_data_w_legend.append(pd.DataFrame([{xaxis:row[xaxis], "prop_LE05":row.prop_H3_LE05, legend: row[legend]}]))
-                else:
-                    if row.delta_AI_3 != 0:
-                        df_data_w_legend = df_data_w_legend.append(pd.DataFrame([{xaxis:row[xaxis], "prop_LE05":row.prop_H3_LE05, legend: row[legend]}]))
-        else:
-            if hypothesis == "H1":
-                if row.delta_AI_1 == 0:
-                    df_data_w_legend = df_data_w_legend.append(pd.DataFrame([{xaxis:row[xaxis], "prop_LE05":row.prop_H1_LE05, legend: row[legend]}]))
-                if row.delta_AI_2 == 0:
-                    df_data_w_legend = df_data_w_legend.append(pd.DataFrame([{xaxis:row[xaxis], "prop_LE05":row.prop_H2_LE05, legend: row[legend]}]))
-            if hypothesis == "H3":
-                if row.delta_AI_3 == 0:
-                    df_data_w_legend = df_data_w_legend.append(pd.DataFrame([{xaxis:row[xaxis], "prop_LE05":row.prop_H3_LE05, legend: row[legend]}]))
+    def select(mask, xvalues, yvalues, legendvalues):
+        df_selected = pd.DataFrame({xaxis: xvalues[mask].values, "prop_LE05": yvalues[mask].values, legend: legendvalues[mask].values})
+        ## Source datasets of recombined replicates, for their standard error
+        for column in ["source_c1", "source_c2"]:
+            if column in df_data.columns:
+                df_selected[column] = df_data[column][mask].values
+        return df_selected
+
+    x, leg = df_data[xaxis], df_data[legend]
+    selected = []
+    if flag_power == 1:
+        if hypothesis == "H1":
+            if delta_AI:
+                selected.append(select(df_data.delta_AI_1 == delta_AI, x, df_data.prop_H1_LE05, leg))
+                selected.append(select(df_data.delta_AI_2 == delta_AI, x, df_data.prop_H2_LE05, leg))
+            else:
+                selected.append(select(df_data.delta_AI_1 != 0, x, df_data.prop_H1_LE05, leg))
+                if legend == "delta_AI_1":
+                    selected.append(select(df_data.delta_AI_2 != 0, x, df_data.prop_H2_LE05, df_data.delta_AI_2))
+                if xaxis == "delta_AI_1":
+                    selected.append(select(df_data.delta_AI_2 != 0, df_data.delta_AI_2, df_data.prop_H2_LE05, leg))
+        if hypothesis == "H3":
+            if delta_AI:
+                selected.append(select(df_data.delta_AI_3 == delta_AI, x, df_data.prop_H3_LE05, leg))
+            else:
+                selected.append(select(df_data.delta_AI_3 != 0, x, df_data.prop_H3_LE05, leg))
+    else:
+        if hypothesis == "H1":
+            selected.append(select(df_data.delta_AI_1 == 0, x, df_data.prop_H1_LE05, leg))
+            selected.append(select(df_data.delta_AI_2 == 0, x, df_data.prop_H2_LE05, leg))
+        if hypothesis == "H3":
+            selected.append(select(df_data.delta_AI_3 == 0, x, df_data.prop_H3_LE05, leg))
+    df_data_w_legend = pd.concat(selected, ignore_index=True) if selected else pd.DataFrame()
     return(df_data_w_legend)
 
+def shared_source_sem(df_xvalue):
+    """Function to compute the standard error of the mean of replicates that may share source datasets.
+        Replicates sharing a source dataset (merge_simul_conditions.py -k) are correlated, so their cross
+        products are kept in the variance; without shared sources this is the usual standard error of the mean.
+         Arguments:
+           :param df_xvalue: Replicates of one point of the plot, with columns prop_LE05, source_c1 and source_c2
+           :type df_xvalue: Pandas DataFrame
+
+         Returns:
+           :return: Standard error of the mean of prop_LE05, NaN for a single replicate
+           :rtype: float
+    """
+    values = df_xvalue["prop_LE05"].to_numpy(dtype=float)
+    m = values.size
+    if m < 2:
+        return np.nan
+    sources = df_xvalue[["source_c1", "source_c2"]].to_numpy(dtype=object)
+    shared = np.eye(m, dtype=bool)
+    for i in range(2):
+        known = pd.notna(sources[:, i])[:, np.newaxis]
+        for j in range(2):
+            shared |= known & (sources[:, i][:, np.newaxis] == sources[:, j][np.newaxis, :])
+    residuals = values - values.mean()
+    return np.sqrt(max(residuals @ shared @ residuals, 0)/(m*(m-1)))
+
 def create_plot(df_data_w_legend, hypothesis, colormap, flag_power_plot, ax=None, title=None):
     """Function to create subplots for type I error or power in rejecting H1(/H2) and H3
          Arguments:
@@ -125,11 +179,14 @@ def create_plot(df_data_w_legend, hypothesis, colormap, flag_power_plot, ax=None
     map_colname_to_plt_label = {"nfeature": "Number of Simulations", "num_allele_specific_reads": "# of Allele Specific Reads", 
                                 "num_allele_specific_reads_per_biorep": "# of Allele Specific Reads Per Biorep",
                                 "delta_AI_1": r"$\Delta$$AI_1$", "delta_AI_3": r"$\Delta$$AI_3$", "num_bioreps": "Number of Bioreps"}
-    if ax is None: ax = plt.gca()
+    from matplotlib.ticker import (MultipleLocator, FormatStrFormatter)
+    if ax is None: ax = load_pyplot().gca()
     for grp, df_grp in df_data_w_legend.groupby(df_data_w_legend.columns[2]):
         # print(grp)
         # print(df_grp)
         df_xaxis_grp = df_grp.groupby(df_grp.columns[0]).agg({"prop_LE05": ["mean", "sem"]})
+        if "source_c1" in df_grp.columns and df_grp["source_c1"].notna().any():
+            df_xaxis_grp[("prop_LE05", "sem")] = df_grp.groupby(df_grp.columns[0]).apply(shared_source_sem)
         if df_xaxis_grp["prop_LE05"]["sem"].isnull().all():
             if hypothesis == "H1":
                 df_xaxis_grp["prop_LE05"]["mean"].plot(ax=ax, marker=".", linestyle = "-", color=colormap[grp],  
@@ -171,7 +228,7 @@ def create_plot(df_data_w_legend, hypothesis, colormap, flag_power_plot, ax=None
 
 def setup(param, df_data, t1er_param, power_param, fixed_param, legend_param, color_palette, output, delta_AI=None):
     """Function to setup the parameters needed to run the functions that subset the data for 
-        plotting and create the plots
+        plotting and create the plots. The plots are drawn afterwards by render_figures.
          Arguments:
            :param param: Assess the type I error and power as affected by this simulation parameter
            :type param: string
@@ -203,8 +260,13 @@ def setup(param, df_data, t1er_param, power_param, fixed_param, legend_param, co
            :param delta_AI: If not None, value of delta_AI_1 (delta_AI_2) and delta_AI_3 that should be kept 
                 constant when creating plots of type I error or power in rejecting H1 (H2) or H3, respectively.
            :type delta_AI: float
+
+         Returns:
+           :return: One dictionary per figure with the output "filename" and the arguments of create_plot for each of its two "panels"
+           :rtype: list
     """
    
+    figures = []
     for group, df_group in df_data.groupby(fixed_param, sort=False):
         print(str(fixed_param)+": "+str(group))
         # print(df_group.iloc[:, 0:9])
@@ -216,18 +278,14 @@ def setup(param, df_data, t1er_param, power_param, fixed_param, legend_param, co
                 H1_legend_param = H3_legend_param = legend_param
             df_H1_t1er = specify_data_to_plot(df_group, t1er_param["H1"], "H1", H1_legend_param, 0)
             df_H3_t1er = specify_data_to_plot(df_group, t1er_param["H3"], "H3", H3_legend_param, 0)
-            fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(13,5))
             if param == "num_bioreps":
-                if not df_H1_t1er.empty: create_plot(df_H1_t1er, "H1", color_palette, 0, ax1, r"$\Delta$$AI_1$=0")
-                if not df_H3_t1er.empty: create_plot(df_H3_t1er, "H3", color_palette, 0, ax2, r"$\Delta$$AI_3$=0")
+                titles = [r"$\Delta$$AI_1$=0", r"$\Delta$$AI_3$=0"]
                 filename = ["t1er_BE_LE05_vs", param, fixed_param, str(group), "legend_is", legend_param, "delta_AI", str(0)]
             else:
-                if not df_H1_t1er.empty: create_plot(df_H1_t1er, "H1", color_palette, 0, ax1)
-                if not df_H3_t1er.empty: create_plot(df_H3_t1er, "H3", color_palette, 0, ax2)
+                titles = [None, None]
                 filename = ["t1er_BE_LE05_vs", param, fixed_param[0], str(group[0]), fixed_param[1], str(group[1])]
-            if (df_H1_t1er.empty==False) or (df_H3_t1er.empty==False):
-                plt.savefig(os.path.join(output, "_".join(filename)+".jpg"), bbox_inches = "tight", dpi=100)
-                plt.close(fig)
+            figures.append({"filename": os.path.join(output, "_".join(filename)+".jpg"),
+                            "panels": [(df_H1_t1er, "H1", color_palette, 0, titles[0]), (df_H3_t1er, "H3", color_palette, 0, titles[1])]})
         if (delta_AI is None) or (delta_AI > 0):
             if isinstance(legend_param, dict):
                 H1_legend_param = legend_param["power"]["H1"]
@@ -236,57 +294,126 @@ def setup(param, df_data, t1er_param, power_param, fixed_param, legend_param, co
                 H1_legend_param = H3_legend_param = legend_param
             df_H1_power = specify_data_to_plot(df_group, power_param["H1"], "H1", H1_legend_param, 1, delta_AI)
             df_H3_power = specify_data_to_plot(df_group, power_param["H3"], "H3", H3_legend_param, 1, delta_AI)
-            fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(13,5))
             if param == "num_bioreps":
                 filename = ["power_BE_LE05_vs", param, fixed_param, str(group), "legend_is", legend_param, "delta_AI", str(delta_AI)]
-                if not df_H1_power.empty: create_plot(df_H1_power, "H1", color_palette, 1, ax1, r"$\Delta$$AI_1$="+str(delta_AI))
-                if not df_H3_power.empty: create_plot(df_H3_power, "H3", color_palette, 1, ax2, r"$\Delta$$AI_3$="+str(delta_AI))
+                titles = [r"$\Delta$$AI_1$="+str(delta_AI), r"$\Delta$$AI_3$="+str(delta_AI)]
             else:
                 filename = ["power_BE_LE05_vs", param, fixed_param[0], str(group[0]), fixed_param[1], str(group[1])]
-                if not df_H1_power.empty: create_plot(df_H1_power, "H1", color_palette, 1, ax1)
-                if not df_H3_power.empty: create_plot(df_H3_power, "H3", color_palette, 1, ax2)
-            if (df_H1_power.empty==False) or (df_H3_power.empty==False):
-                plt.savefig(os.path.join(output, "_".join(filename)+".jpg"), bbox_inches = "tight", dpi=100)
-                plt.close(fig)
+                titles = [None, None]
+            figures.append({"filename": os.path.join(output, "_".join(filename)+".jpg"),
+                            "panels": [(df_H1_power, "H1", color_palette, 1, titles[0]), (df_H3_power, "H3", color_palette, 1, titles[1])]})
+    return(figures)
 
 
-def main():
-    args = getOptions()
-    outdir = args.outdir if args.outdir else os.path.join(os.path.curdir, "data_visualization")
-    if not os.path.exists(outdir): os.makedirs(outdir)
-    df_summary = pd.read_csv(args.infile[0])
-    if len(args.infile) > 1:
-        for infile in args.infile[1:]:
-            df_infile = pd.read_csv(infile)
-            df_summary = pd.concat([df_summary, df_infile])
-    # print(df_summary)
-    df_summary.reset_index(drop=True, inplace=True)
+def render_figure(figure):
+    """Function to draw the two subplots of a figure and save it
+         Arguments:
+           :param figure: Output "filename" and the arguments of create_plot for each of the two "panels"
+           :type figure: dictionary
 
-    t1er_xaxis_param = {"H1": "delta_AI_3", "H3": "delta_AI_1"} if args.param == "delta_AI" else {"H1": args.param, "H3": args.param}
-    power_xaxis_param = {"H1": "delta_AI_1", "H3": "delta_AI_3"} if args.param == "delta_AI" else {"H1": args.param, "H3": args.param}
-    if args.param == "delta_AI":
+         Returns:
+           :return: Name of the file written
+           :rtype: string
+    """
+    plt = load_pyplot()
+    fig, axes = plt.subplots(1, 2, figsize=(13,5))
+    for ax, (df_panel, hypothesis, colormap, flag_power_plot, title) in zip(axes, figure["panels"]):
+        if not df_panel.empty: create_plot(df_panel, hypothesis, colormap, flag_power_plot, ax, title)
+    plt.savefig(figure["filename"], bbox_inches = "tight", dpi=100)
+    plt.close(fig)
+    return(figure["filename"])
+
+
+def render_figures(figures, jobs=1):
+    """Function to draw and save the figures that have data in at least one subplot
+         Arguments:
+           :param figures: Figures returned by setup
+           :type figures: list
+
+           :param jobs: Number of figures to draw at the same time
+           :type jobs: int
+    """
+    figures = [figure for figure in figures if not all(panel[0].empty for panel in figure["panels"])]
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for filename in executor.map(render_figure, figures):
+                print(filename)
+    else:
+        for figure in figures:
+            print(render_figure(figure))
+
+
+def color_map(legend_values):
+    """Function to give each legend value a color of the colorblind palette
+         Arguments:
+           :param legend_values: Sorted legend values
+           :type legend_values: list
+
+         Returns:
+           :return: Color of each legend value
+           :rtype: dictionary
+    """
+    return {value: COLORBLIND_PALETTE[index % len(COLORBLIND_PALETTE)] for index, value in enumerate(legend_values)}
+
+
+def build_figures(param, df_summary, outdir):
+    """Function to prepare the figures of type I error and power versus one simulation parameter
+         Arguments:
+           :param param: 'nfeature', 'num_allele_specific_reads_per_biorep', 'delta_AI' or 'num_bioreps'
+           :type param: string
+
+           :param df_summary: Summary from summarize_posterior_estimates.py
+           :type df_summary: Pandas DataFrame
+
+           :param outdir: Directory to which to save plots
+           :type outdir: string
+
+         Returns:
+           :return: Figures as returned by setup, to draw with render_figures
+           :rtype: list
+    """
+    t1er_xaxis_param = {"H1": "delta_AI_3", "H3": "delta_AI_1"} if param == "delta_AI" else {"H1": param, "H3": param}
+    power_xaxis_param = {"H1": "delta_AI_1", "H3": "delta_AI_3"} if param == "delta_AI" else {"H1": param, "H3": param}
+    if param == "delta_AI":
         fixed = ["num_bioreps", "nfeature"]
         legend_values = sorted(set(df_summary["num_allele_specific_reads"]))
-        colors = dict(zip(legend_values , sns.color_palette("colorblind", len(legend_values))))
-        setup(args.param, df_summary, t1er_xaxis_param, power_xaxis_param, fixed, "num_allele_specific_reads", colors, outdir)
-    elif args.param == "num_bioreps":
+        colors = color_map(legend_values)
+        figures = setup(param, df_summary, t1er_xaxis_param, power_xaxis_param, fixed, "num_allele_specific_reads", colors, outdir)
+    elif param == "num_bioreps":
         fixed = "nfeature"
         all_delta_AI = sorted((set(df_summary["delta_AI_1"]).union(set(df_summary["delta_AI_2"])).union(set(df_summary["delta_AI_3"]))))
         colors = {}
         legend_values = sorted(set(df_summary["num_allele_specific_reads"]))
-        colors["num_allele_specific_reads"] = dict(zip(legend_values , sns.color_palette("colorblind", len(legend_values))))
+        colors["num_allele_specific_reads"] = color_map(legend_values)
         legend_values = sorted(set(df_summary["num_allele_specific_reads_per_biorep"]))
-        colors["num_allele_specific_reads_per_biorep"] = dict(zip(legend_values , sns.color_palette("colorblind", len(legend_values))))
+        colors["num_allele_specific_reads_per_biorep"] = color_map(legend_values)
+        figures = []
         for legend_param in colors.keys():
             for delta in [d for d in all_delta_AI]: 
-                setup(args.param, df_summary, t1er_xaxis_param, power_xaxis_param, fixed, legend_param, colors[legend_param], outdir, delta)
+                figures.extend(setup(param, df_summary, t1er_xaxis_param, power_xaxis_param, fixed, legend_param, colors[legend_param], outdir, delta))
     else: 
-        fixed = ["num_bioreps", "num_allele_specific_reads"] ### if args.param == "num_features" 
-        if args.param == "num_allele_specific_reads_per_biorep": fixed = ["nfeature", "num_bioreps"]
+        fixed = ["num_bioreps", "num_allele_specific_reads"] ### if param == "num_features" 
+        if param == "num_allele_specific_reads_per_biorep": fixed = ["nfeature", "num_bioreps"]
         legend_param = {"t1er": {"H1": "delta_AI_3", "H3": "delta_AI_1"}, "power": {"H1": "delta_AI_1", "H3": "delta_AI_3"}}
         legend_values = sorted((set(df_summary["delta_AI_1"]).union(set(df_summary["delta_AI_2"])).union(set(df_summary["delta_AI_3"]))))
-        colors = dict(zip(legend_values , sns.color_palette("colorblind", len(legend_values))))
-        setup(args.param, df_summary, t1er_xaxis_param, power_xaxis_param, fixed, legend_param, colors, outdir)
+        colors = color_map(legend_values)
+        figures = setup(param, df_summary, t1er_xaxis_param, power_xaxis_param, fixed, legend_param, colors, outdir)
+    return figures
+
+
+def main(argv=None):
+    args = getOptions(argv)
+    if args.telemetry:
+        telemetry.enable(args.telemetry)
+    outdir = args.outdir if args.outdir else os.path.join(os.path.curdir, "data_visualization")
+    if not os.path.exists(outdir): os.makedirs(outdir)
+    df_summary = pd.concat([pd.read_csv(infile) for infile in args.infile], ignore_index=True)
+    # print(df_summary)
+
+    with telemetry.stage("plot_setup", {"param": args.param, "rows": df_summary.shape[0]}):
+        figures = build_figures(args.param, df_summary, outdir)
+    with telemetry.stage("plot_render", {"param": args.param, "figures": len(figures)}):
+        render_figures(figures, args.jobs)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+import argparse
+import pandas as pd
+from tasks import power_surface
+
+def getOptions():
+    parser = argparse.ArgumentParser(description="Interpolate power or Type I error from a surface built with build_power_surface.py")
+    parser.add_argument(
+        "-s",
+        "--surface",
+        action="store",
+        default="power_surface.npz",
+        help="Surface file (default: power_surface.npz)",
+    )
+    parser.add_argument(
+        "-b",
+        "--bioreps",
+        action="store",
+        type=float,
+        nargs='*',
+        default=[],
+        help="Number(s) of bioreps to query",
+    )
+    parser.add_argument(
+        "-r",
+        "--reads",
+        action="store",
+        type=float,
+        nargs='*',
+        default=[],
+        help="Number(s) of allele specific reads per biorep to query",
+    )
+    parser.add_argument(
+        "-d",
+        "--delta_AI",
+        action="store",
+        type=float,
+        nargs='*',
+        default=[],
+        help="Level(s) of AI to query, 0 for the Type I error",
+    )
+    parser.add_argument(
+        "-q",
+        "--queries",
+        action="store",
+        required=False,
+        help="Optional CSV file of queries with columns num_bioreps, num_allele_specific_reads_per_biorep and delta_AI "
+             "(and optionally hypothesis and level), answered in addition to -b/-r/-d",
+    )
+    parser.add_argument(
+        "-t",
+        "--hypothesis",
+        action="store",
+        choices=list(power_surface.HYPOTHESES),
+        default="H1",
+        help="'H1' for AI in one condition or 'H3' for a difference of AI between conditions (default: H1)",
+    )
+    parser.add_argument(
+        "-l",
+        "--level",
+        action="store",
+        choices=power_surface.LEVELS,
+        default="05",
+        help="Bayes evidence threshold: '05' for 0.05 or '01' for 0.01 (default: 05)",
+    )
+    parser.add_argument(
+        "-z",
+        "--z",
+        action="store",
+        type=float,
+        default=1.96,
+        help="Number of standard errors of the uncertainty band (default: 1.96)",
+    )
+    parser.add_argument(
+        "-o",
+        "--outfile",
+        action="store",
+        required=False,
+        help="Optional CSV file to which to save the answers. Default - printed only",
+    )
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = getOptions()
+    surface = power_surface.load_surface(args.surface)
+    queries = [(bioreps, reads, delta, args.hypothesis, args.level)
+               for bioreps in args.bioreps for reads in args.reads for delta in args.delta_AI]
+    if args.queries:
+        df_queries = pd.read_csv(args.queries, dtype={"level": str})
+        for row in df_queries.to_dict("records"):
+            queries.append((row["num_bioreps"], row["num_allele_specific_reads_per_biorep"], row["delta_AI"],
+                            row.get("hypothesis", args.hypothesis), str(row.get("level", args.level)).replace("0.", "")))
+    if not queries:
+        raise SystemExit("Give -b, -r and -d, or a CSV file of queries with -q")
+    df_answers = pd.DataFrame([power_surface.query_surface(surface, bioreps, reads, delta, hypothesis, level, args.z)
+                               for bioreps, reads, delta, hypothesis, level in queries], columns=power_surface.QUERY_COLUMNS)
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(df_answers.round(4).to_string(index=False))
+    if (df_answers["flag"] != "ok").any():
+        print("outside: beyond the simulated range, the nearest simulated value is used; "
+              "incomplete: not surrounded by simulated points, the nearest ones are used")
+    if args.outfile:
+        df_answers.to_csv(args.outfile, index=False)
+
+
+if __name__ == "__main__":
+    main()
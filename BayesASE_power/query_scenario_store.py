@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+import argparse
+from tasks import scenario_store
+
+def getOptions():
+    parser = argparse.ArgumentParser(description="Query the summaries or the dataset and fit records of a scenario store")
+    parser.add_argument(
+        "-s",
+        "--store",
+        action="store",
+        help="SQLite scenario store written with --store by run_read_count_simul.py, merge_simul_conditions.py, "
+             "run_nbmodel_fits.py and summarize_posterior_estimates.py",
+    )
+    parser.add_argument(
+        "--table",
+        action="store",
+        choices=["summaries", "records"],
+        default="summaries",
+        help="Query the summary rows ('summaries') or the simulated, merged and fit files ('records') (default: summaries)",
+    )
+    parser.add_argument(
+        "-w",
+        "--where",
+        action="store",
+        required=False,
+        help="Optional SQL condition on the columns of the table, e.g. \"num_bioreps >= 4 AND delta_AI_3 = 0.2\" "
+             "or \"kind = 'fit'\". Default - every row",
+    )
+    parser.add_argument(
+        "-c",
+        "--columns",
+        action="store",
+        nargs='*',
+        required=False,
+        help="Optional list of columns to report. Default - every column",
+    )
+    parser.add_argument(
+        "-o",
+        "--outfile",
+        action="store",
+        required=False,
+        help="Optional CSV file to which to save the selected rows. Default - print them",
+    )
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = getOptions()
+    df = scenario_store.query(args.store, args.table, args.where, args.columns)
+    if args.outfile:
+        df.to_csv(args.outfile, index=False)
+        print(str(df.shape[0]) + " rows saved to " + args.outfile)
+    else:
+        print(df.to_csv(index=False), end="")
+
+
+if __name__ == "__main__":
+    main()
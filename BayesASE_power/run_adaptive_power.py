@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+import argparse
+import functools
+import os
+import sys
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from tasks import adaptive_power
+from tasks import count_store
+from tasks import integrity
+from tasks import telemetry
+
+def getOptions():
+    parser = argparse.ArgumentParser(description="Simulate and fit two-condition scenarios in batches until Type I error/power is estimated with the requested precision")
+    parser.add_argument(
+        "-d",
+        "--design",
+        action="store",
+        help="CSV file with one scenario per row: theta1, theta2, nbiorep, n_allele_specific_reads and optionally simruns, the budget cap of the scenario",
+    )
+    parser.add_argument(
+        "-o",
+        "--outdir",
+        action="store",
+        help="Directory to which to save the bayesian_out_<compID>.tabular files",
+    )
+    parser.add_argument(
+        "-s",
+        "--summary",
+        action="store",
+        required=False,
+        help="CSV file with the number of features, batches and confidence intervals of each scenario. Default - <outdir>_adaptive_summary.csv",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch",
+        action="store",
+        type=int,
+        default=1000,
+        help="Number of features simulated and fit in each batch (default: 1000)",
+    )
+    parser.add_argument(
+        "-m",
+        "--max_features",
+        action="store",
+        type=int,
+        default=100000,
+        help="Budget cap on the number of features of a scenario without a simruns column (default: 100000)",
+    )
+    parser.add_argument(
+        "-w",
+        "--width",
+        action="store",
+        type=float,
+        default=0.02,
+        help="Target width of the confidence interval of prop_H1_LE05, prop_H2_LE05 and prop_H3_LE05 (default: 0.02)",
+    )
+    parser.add_argument(
+        "--confidence",
+        action="store",
+        type=float,
+        default=0.95,
+        help="Confidence level of the intervals (default: 0.95)",
+    )
+    parser.add_argument(
+        "--monitor",
+        action="store",
+        nargs='*',
+        choices=list(adaptive_power.MONITORED_EVIDENCE),
+        help="Proportions whose interval must reach the target width. Default - all",
+    )
+    parser.add_argument(
+        "-e",
+        "--engine",
+        action="store",
+        choices=["approx", "stan"],
+        default="approx",
+        help="Fit each batch with the approximate model ('approx') or with nbmodel_stan2.py ('stan') (default: approx)",
+    )
+    parser.add_argument(
+        "--nbmodel",
+        action="store",
+        default="nbmodel_stan2.py",
+        help="Command or path of nbmodel_stan2.py from BayesASE (default: nbmodel_stan2.py)",
+    )
+    parser.add_argument(
+        "-c",
+        "--chains",
+        action="store",
+        type=int,
+        default=2,
+        help="Number of chains of each nbmodel_stan2.py fit (default: 2)",
+    )
+    parser.add_argument(
+        "-t",
+        "--iterations",
+        action="store",
+        type=int,
+        default=6000,
+        help="Number of iterations of each nbmodel_stan2.py fit (default: 6000)",
+    )
+    parser.add_argument(
+        "--warmup",
+        action="store",
+        type=int,
+        default=3000,
+        help="Number of warmup iterations of each nbmodel_stan2.py fit (default: 3000)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        action="store",
+        type=int,
+        default=1,
+        help="Optional number of scenarios to run at the same time (default: 1)",
+    )
+    parser.add_argument(
+        "--seed",
+        action="store",
+        type=int,
+        required=False,
+        help="Optional master seed from which the seed of each scenario is derived. Default - a random seed that is printed",
+    )
+    parser.add_argument(
+        "--telemetry",
+        action="store",
+        required=False,
+        help="Optional JSON-lines log to which to append the wall time, CPU time, peak memory and I/O of every scenario and fit "
+             "(also switched on by the BAYESASE_TELEMETRY environment variable)",
+    )
+    args = parser.parse_args()
+    return args
+
+
+def stan_batch(counts, comparison, args, workroot):
+    """Function to fit one batch of a scenario with nbmodel_stan2.py
+         Arguments:
+           :param counts: Arrays of shape (batch size, nbiorep, 3) with the counts of conditions c1 and c2
+           :type counts: dictionary
+
+           :param comparison: Name of the comparison (compID) of the batch
+           :type comparison: string
+
+           :param args: Command line arguments with the nbmodel_stan2.py command and options
+           :type args: argparse Namespace
+
+           :param workroot: Directory for the datasets and working directories of the batches
+           :type workroot: string
+
+         Returns:
+           :return: Dataframe with the columns of the bayesian_out_*.tabular files
+           :rtype: Pandas DataFrame
+    """
+    from run_nbmodel_fits import fit_dataset
+    conditions = {condition: {"rsim-g1": adaptive_power.simulate_nbmodel.Q_TEST, "rsim-g2": adaptive_power.simulate_nbmodel.Q_LINE}
+                  for condition in counts}
+    infile = os.path.join(workroot, comparison + ".tsv")
+    count_store.counts_to_frame({"conditions": conditions}, counts).to_csv(infile, index=False, sep="\t")
+    fit_args = argparse.Namespace(engine="stan", nbmodel=args.nbmodel, chains=args.chains,
+                                  iterations=args.iterations, warmup=args.warmup)
+    if fit_dataset(comparison, infile, fit_args, workroot, workroot) != 0:
+        raise RuntimeError("nbmodel_stan2.py failed on " + infile)
+    outfile = os.path.join(workroot, "bayesian_out_" + comparison + ".tabular")
+    df_result = pd.read_csv(outfile, sep="\t")
+    integrity.remove(outfile)
+    os.remove(infile)
+    return df_result
+
+
+def run_scenario(task):
+    """Function to run one scenario of the design file and save the fit of all the features it used
+         Arguments:
+           :param task: Row of the design file, seed sequence, command line arguments and output directory
+           :type task: dictionary
+
+         Returns:
+           :return: Summary row of the scenario
+           :rtype: dictionary
+    """
+    row, args = task["row"], task["args"]
+    if args.engine == "stan":
+        workroot = os.path.join(os.path.normpath(args.outdir) + "_fits", "adaptive_" + str(task["index"]))
+        os.makedirs(workroot, exist_ok=True)
+        fit_batch = functools.partial(stan_batch, args=args, workroot=workroot)
+    else:
+        fit_batch = adaptive_power.approx_batch
+    max_features = int(float(row["simruns"])) if "simruns" in row and pd.notna(row["simruns"]) else args.max_features
+    params = {"theta1": row["theta1"], "theta2": row["theta2"], "nbiorep": row["nbiorep"],
+              "allelicreads": row["n_allele_specific_reads"], "engine": args.engine}
+    with telemetry.stage("adaptive_scenario", params):
+        df_result, summary = adaptive_power.run_adaptive_scenario(
+                row["theta1"], row["theta2"], row["nbiorep"], row["n_allele_specific_reads"], np.random.default_rng(task["seed"]),
+                fit_batch, args.batch, max_features, args.width, args.confidence, args.monitor)
+    with integrity.atomic_path(os.path.join(args.outdir, "bayesian_out_" + summary["comparison"] + ".tabular")) as temporary:
+        df_result.to_csv(temporary, index=False, sep="\t")
+    print(summary["comparison"] + ": " + str(summary["nfeature"]) + " features, stopped on " + summary["stop"])
+    return summary
+
+
+def main():
+    args = getOptions()
+    if args.telemetry:
+        telemetry.enable(args.telemetry)
+    if args.batch < 1:
+        sys.exit("--batch must be at least 1 feature")
+    if args.max_features < 1:
+        sys.exit("--max_features must be at least 1 feature")
+    df = pd.read_csv(args.design, dtype=str)
+    if "simruns" in df.columns and (pd.to_numeric(df["simruns"].dropna()) < 1).any():
+        sys.exit("The simruns budget of every scenario in " + args.design + " must be at least 1 feature")
+    os.makedirs(args.outdir, exist_ok=True)
+
+    master_seed = np.random.SeedSequence(args.seed)
+    print("Master seed: " + str(master_seed.entropy))
+    tasks = [{"index": index, "row": row.to_dict(), "args": args, "seed": seed}
+             for (index, row), seed in zip(df.iterrows(), master_seed.spawn(df.shape[0]))]
+    if args.jobs > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            summaries = list(executor.map(run_scenario, tasks))
+    else:
+        summaries = [run_scenario(task) for task in tasks]
+    ## Kept out of outdir, which summarize_posterior_estimates.py reads
+    summary_file = args.summary if args.summary else os.path.normpath(args.outdir) + "_adaptive_summary.csv"
+    with integrity.atomic_path(summary_file) as temporary:
+        pd.DataFrame(summaries).to_csv(temporary, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+
+import argparse
+import ast
+import fnmatch
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from create_nbmodel_design_file import write_design_file
+from tasks import count_store
+from tasks import integrity
+from tasks import scenario_store
+from tasks import telemetry
+
+MERGED_DIR_PATTERN = "H1_*_H2_*_H3_*"
+LOG_COLUMNS = ["compID", "status", "wall_time_s", "returncode"]
+## nbmodel_stan2.py scripts loaded by this process for warm fits: path -> (compiled code, module namespace or None)
+WARM_SCRIPTS = {}
+
+def getOptions(argv=None):
+    parser = argparse.ArgumentParser(description="Fit the Bayesian model to every merged simulated dataset over a pool of workers")
+    parser.add_argument(
+        "-i",
+        "--inputdirs",
+        action="store",
+        nargs='*',
+        help="(List of) parent directory(ies) of the H1_<>_H2_<>_H3_<> folders, or the folders themselves",
+    )
+    parser.add_argument(
+        "-o",
+        "--outdir",
+        action="store",
+        help="Directory to which to save the bayesian_out_<compID>.tabular files",
+    )
+    parser.add_argument(
+        "-e",
+        "--engine",
+        action="store",
+        choices=["stan", "approx"],
+        default="stan",
+        help="Fit with nbmodel_stan2.py ('stan') or with fit_approx_nbmodel.py ('approx') (default: stan)",
+    )
+    parser.add_argument(
+        "-c",
+        "--chains",
+        action="store",
+        type=int,
+        default=2,
+        help="Number of chains of each nbmodel_stan2.py fit (default: 2)",
+    )
+    parser.add_argument(
+        "-t",
+        "--iterations",
+        action="store",
+        type=int,
+        default=6000,
+        help="Number of iterations of each nbmodel_stan2.py fit (default: 6000)",
+    )
+    parser.add_argument(
+        "-w",
+        "--warmup",
+        action="store",
+        type=int,
+        default=3000,
+        help="Number of warmup iterations of each nbmodel_stan2.py fit (default: 3000)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        action="store",
+        type=int,
+        required=False,
+        help="Number of fits to run at the same time. Default - number of cores divided by number of chains",
+    )
+    parser.add_argument(
+        "--workdir",
+        action="store",
+        required=False,
+        help="Directory for the working directory of each fit and the fit_log.tsv log. Default - <outdir>_fits",
+    )
+    parser.add_argument(
+        "--nbmodel",
+        action="store",
+        default="nbmodel_stan2.py",
+        help="Command or path of nbmodel_stan2.py from BayesASE (default: nbmodel_stan2.py)",
+    )
+    parser.add_argument(
+        "--warm",
+        action="store_true",
+        help="Fit in long-lived worker processes that each load nbmodel_stan2.py (or the approx engine) once and then take "
+             "datasets from a queue, instead of starting nbmodel_stan2.py for every dataset (default: off)",
+    )
+    parser.add_argument(
+        "--store",
+        action="store",
+        required=False,
+        help="Optional SQLite scenario store (created if needed). Datasets with the same content already fit with the "
+             "same engine and options are copied from the store instead of fit again, and new fits are recorded",
+    )
+    parser.add_argument(
+        "--telemetry",
+        action="store",
+        required=False,
+        help="Optional JSON-lines log to which to append the wall time, CPU time, peak memory and I/O of every fit, including the nbmodel_stan2.py processes "
+             "(also switched on by the BAYESASE_TELEMETRY environment variable)",
+    )
+    args = parser.parse_args(argv)
+    return args
+
+
+def find_datasets(dir_list):
+    """Function to find the merged simulated datasets to fit
+         Arguments:
+           :param dir_list: A list of H1_<>_H2_<>_H3_<> directories or of their parent directories
+           :type dir_list: list
+
+         Returns:
+           :return: Path of the dataset of each compID (input filename without extension). TSV files are preferred
+                over npz files of the same dataset.
+           :rtype: dictionary
+    """
+    datasets = {}
+    for dir in dir_list:
+        if fnmatch.fnmatch(os.path.basename(os.path.normpath(dir)), MERGED_DIR_PATTERN):
+            merged_dirs = [dir]
+        else:
+            merged_dirs = sorted(glob.glob(os.path.join(dir, MERGED_DIR_PATTERN)))
+        for merged_dir in merged_dirs:
+            for extension in ["npz", "tsv"]:
+                for infile in sorted(glob.glob(os.path.join(merged_dir, "*." + extension))):
+                    datasets[os.path.splitext(os.path.basename(infile))[0]] = infile
+    return datasets
+
+
+def count_features(infile):
+    """Function to count the features (rows) of a simulated dataset or of a bayesian_out_*.tabular file
+         Arguments:
+           :param infile: Filename ending in .tsv, .tabular or .npz
+           :type infile: string
+
+         Returns:
+           :return: Number of features
+           :rtype: int
+    """
+    if infile.endswith(".npz"):
+        header, counts = count_store.read_counts(infile)
+        return counts["c1"].shape[0]
+    with open(infile, "rb") as data:
+        lines = sum(block.count(b"\n") for block in iter(lambda: data.read(1 << 20), b""))
+        data.seek(max(0, os.path.getsize(infile)-1))
+        if data.read(1) not in [b"\n", b""]:
+            lines += 1 ## Last line without newline
+    return max(0, lines-1)
+
+
+def is_complete(outfile, infile):
+    """Function to check that a fit output exists and has one row per feature of its input dataset
+         Arguments:
+           :param outfile: bayesian_out_<compID>.tabular file
+           :type outfile: string
+
+           :param infile: Simulated dataset that was fit
+           :type infile: string
+
+         Returns:
+           :return: True if the output is complete, and matches its check file if it has one
+           :rtype: bool
+    """
+    if not os.path.exists(outfile):
+        return False
+    try:
+        integrity.verify(outfile)
+    except ValueError as error:
+        print(str(error))
+        return False
+    return count_features(outfile) == count_features(infile)
+
+
+def load_script(command):
+    """Function to load nbmodel_stan2.py once per process for warm fits. If the script defines main() behind an
+        if __name__ == "__main__" guard, it is imported once, so that its imports and module level objects (e.g. a
+        compiled Stan model) are kept, and main() is called for each fit. Otherwise its compiled code is run as
+        __main__ for each fit, and only the modules it imports are kept.
+         Arguments:
+           :param command: Command or path of nbmodel_stan2.py
+           :type command: string
+
+         Returns:
+           :return: Path of the script, its compiled code and its module namespace (None if it has no main())
+           :rtype: tuple (string, code, dictionary)
+    """
+    path = command if os.path.exists(command) else shutil.which(command)
+    if path is None:
+        raise ValueError(command + " not found")
+    path = os.path.abspath(path)
+    if path not in WARM_SCRIPTS:
+        with open(path) as script:
+            source = script.read()
+        tree = ast.parse(source, path)
+        has_main = (any(isinstance(node, ast.FunctionDef) and node.name == "main" for node in tree.body) and
+                    any(isinstance(node, ast.If) and "__main__" in ast.dump(node.test) for node in tree.body))
+        code = compile(tree, path, "exec")
+        ## As when run as a script, modules next to it can be imported
+        if os.path.dirname(path) not in sys.path:
+            sys.path.insert(0, os.path.dirname(path))
+        namespace = None
+        if has_main:
+            namespace = {"__name__": "nbmodel_warm", "__file__": path, "__builtins__": __builtins__}
+            exec(code, namespace)
+        WARM_SCRIPTS[path] = (code, namespace)
+    return (path,) + WARM_SCRIPTS[path]
+
+
+def run_warm(cmd, workdir, logfile):
+    """Function to run an nbmodel_stan2.py command in the current process, as a fresh process would, with the script
+        loaded by load_script. Output, including that of compiled code, goes to the log file.
+         Arguments:
+           :param cmd: nbmodel_stan2.py command and its arguments
+           :type cmd: list
+
+           :param workdir: Working directory of the fit
+           :type workdir: string
+
+           :param logfile: Log file of the fit
+           :type logfile: string
+
+         Returns:
+           :return: Return code of the fit (0 on success)
+           :rtype: int
+    """
+    path, code, namespace = load_script(cmd[0])
+    argv, cwd = sys.argv, os.getcwd()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = [os.dup(1), os.dup(2)]
+    returncode = 0
+    with open(logfile, "w") as log:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        try:
+            os.chdir(workdir)
+            sys.argv = [path] + cmd[1:]
+            if namespace is not None:
+                namespace["main"]()
+            else:
+                exec(code, {"__name__": "__main__", "__file__": path, "__builtins__": __builtins__})
+        except SystemExit as error:
+            returncode = error.code if isinstance(error.code, int) else (0 if error.code is None else 1)
+        except Exception:
+            traceback.print_exc()
+            returncode = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            for fd, copy in zip([1, 2], saved):
+                os.dup2(copy, fd)
+                os.close(copy)
+            os.chdir(cwd)
+            sys.argv = argv
+    return returncode
+
+
+def fit_dataset(compID, infile, args, outdir, workroot):
+    """Function to fit the model to one dataset in its own working directory, with its own design file
+         Arguments:
+           :param compID: Name of the comparison, the input filename without extension
+           :type compID: string
+
+           :param infile: Merged simulated dataset
+           :type infile: string
+
+           :param args: Command line arguments with the engine, nbmodel_stan2.py command and options, and whether to
+                run nbmodel_stan2.py in the current process (warm) instead of a new one
+           :type args: argparse Namespace
+
+           :param outdir: Directory to which to save the bayesian_out_<compID>.tabular file
+           :type outdir: string
+
+           :param workroot: Directory under which the working directory of the fit is created
+           :type workroot: string
+
+         Returns:
+           :return: Return code of the fit (0 on success)
+           :rtype: int
+    """
+    workdir = os.path.join(workroot, compID)
+    ## Leftovers of an interrupted fit are discarded
+    shutil.rmtree(workdir, ignore_errors=True)
+    os.makedirs(workdir)
+
+    params = dict(scenario_store.name_parameters(compID), engine=args.engine)
+    try:
+        integrity.verify(infile)
+    except ValueError as error:
+        print(str(error))
+        return 1
+    if args.engine == "approx":
+        from fit_approx_nbmodel import fit_file
+        with telemetry.stage("fit", params):
+            fit_file(infile, workdir)
+        returncode = 0
+    else:
+        if infile.endswith(".npz"):
+            tsv = os.path.join(workdir, compID + ".tsv")
+            count_store.export_tsv(infile, tsv)
+            infile = tsv
+        design = os.path.join(workdir, "condition_design_file.tsv")
+        write_design_file(infile, design)
+        cmd = [args.nbmodel, "-d", os.path.abspath(design), "-i", os.path.abspath(infile),
+               "-c", str(args.chains), "-t", str(args.iterations), "-w", str(args.warmup)]
+        print(" ".join(cmd))
+        if getattr(args, "warm", False):
+            with telemetry.stage("fit", params):
+                returncode = run_warm(cmd, workdir, os.path.join(workdir, "nbmodel.log"))
+        else:
+            with open(os.path.join(workdir, "nbmodel.log"), "w") as log:
+                returncode = telemetry.call(cmd, "fit", params, cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+
+    tabular = os.path.join(workdir, "bayesian_out_" + compID + ".tabular")
+    if returncode != 0 or not is_complete(tabular, infile):
+        return returncode if returncode != 0 else 1
+    for filename in os.listdir(workdir):
+        if filename.startswith(compID + "_"): ## <compID>_r_out and <compID>_temp
+            os.replace(os.path.join(workdir, filename), os.path.join(outdir, filename))
+    ## The tabular file is moved last, with its check file, so that its presence in outdir marks a finished fit
+    integrity.publish(tabular, os.path.join(outdir, os.path.basename(tabular)))
+    shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+def fit_options(args):
+    """Function to list the options that determine the output of a fit, as recorded in the scenario store
+         Arguments:
+           :param args: Command line arguments with the engine, nbmodel_stan2.py command and options
+           :type args: argparse Namespace
+
+         Returns:
+           :return: Options of the fit
+           :rtype: dictionary
+    """
+    if args.engine == "approx":
+        return {"engine": "approx"}
+    return {"engine": "stan", "nbmodel": os.path.basename(args.nbmodel), "chains": args.chains,
+            "iterations": args.iterations, "warmup": args.warmup}
+
+
+def run_fits(datasets, args, outdir, workroot, jobs):
+    """Function to fit every dataset whose output is missing or incomplete over a pool of workers. With args.warm,
+        the fits run in long-lived worker processes that take the datasets from the queue of the pool and keep
+        nbmodel_stan2.py loaded between fits.
+         Arguments:
+           :param datasets: Path of the dataset of each compID
+           :type datasets: dictionary
+
+           :param args: Command line arguments with the engine, nbmodel_stan2.py command and options
+           :type args: argparse Namespace
+
+           :param outdir: Directory to which to save the bayesian_out_<compID>.tabular files
+           :type outdir: string
+
+           :param workroot: Directory for the working directory of each fit and the fit_log.tsv log
+           :type workroot: string
+
+           :param jobs: Number of fits to run at the same time
+           :type jobs: int
+
+         Returns:
+           :return: Number of failed fits
+           :rtype: int
+    """
+    log_file = os.path.join(workroot, "fit_log.tsv")
+    log_lock = threading.Lock()
+    if not os.path.exists(log_file):
+        with open(log_file, "w") as log:
+            log.write("\t".join(LOG_COLUMNS) + "\n")
+
+    store = getattr(args, "store", None)
+    workers = ProcessPoolExecutor(max_workers=jobs) if getattr(args, "warm", False) else None
+
+    def run_job(compID):
+        start = time.time()
+        outfile = os.path.join(outdir, "bayesian_out_" + compID + ".tabular")
+        found = None
+        if store:
+            ## Fits are keyed by the content of their input, which covers the scenario parameters and seed
+            params = scenario_store.name_parameters(compID)
+            inputs = [scenario_store.file_hash(datasets[compID])]
+            found = scenario_store.find(store, "fit", params, None, fit_options(args), inputs)
+        if found:
+            scenario_store.reuse(found, outfile)
+            returncode, status = 0, "reused"
+        else:
+            if workers is not None:
+                returncode = workers.submit(fit_dataset, compID, datasets[compID], args, outdir, workroot).result()
+            else:
+                returncode = fit_dataset(compID, datasets[compID], args, outdir, workroot)
+            status = "done" if returncode == 0 else "failed"
+            if store and returncode == 0:
+                scenario_store.record(store, "fit", outfile, params, None, fit_options(args), inputs, time.time()-start)
+        with log_lock:
+            with open(log_file, "a") as log:
+                log.write("\t".join([compID, status, "{:.1f}".format(time.time()-start), str(returncode)]) + "\n")
+        print(compID + ": " + status)
+        return returncode
+
+    pending = []
+    for compID, infile in sorted(datasets.items()):
+        if is_complete(os.path.join(outdir, "bayesian_out_" + compID + ".tabular"), infile):
+            print(compID + ": already fit, skipped")
+        else:
+            pending.append(compID)
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            returncodes = list(executor.map(run_job, pending))
+    finally:
+        if workers is not None:
+            workers.shutdown()
+    return sum(returncode != 0 for returncode in returncodes)
+
+
+def main(argv=None):
+    args = getOptions(argv)
+    if args.telemetry:
+        telemetry.enable(args.telemetry)
+    ## Working directories and the log are kept out of outdir, which summarize_posterior_estimates.py reads
+    workroot = args.workdir if args.workdir else os.path.normpath(args.outdir) + "_fits"
+    os.makedirs(args.outdir, exist_ok=True)
+    os.makedirs(workroot, exist_ok=True)
+    jobs = args.jobs if args.jobs else max(1, (os.cpu_count() or 1)//args.chains)
+    failed = run_fits(find_datasets(args.inputdirs), args, args.outdir, workroot, jobs)
+    if failed:
+        raise SystemExit(str(failed) + " fit(s) failed, see " + os.path.join(workroot, "fit_log.tsv"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+
+import argparse
+import configparser
+import contextlib
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from run_read_count_simul import simulate_task
+from run_nbmodel_fits import fit_dataset, fit_options
+from summarize_posterior_estimates import compute_prop_hypothesis_cached, list_result_files, paired_differences, paired_filename, SUMMARY_COLUMNS
+from tasks import integrity
+from tasks import merge_catalog
+from tasks import pipeline
+from tasks import simulate_nbmodel
+from tasks import streaming_stats
+from tasks import telemetry
+from tasks import work_queue
+
+## Options of each section of the config file and their default. Paths are relative to the config file.
+DEFAULTS = {
+    "pipeline": {"designs": "", "outdir": "pipeline_out", "jobs": "1", "seed": ""},
+    "simulate": {"engine": "numpy", "format": "tsv", "sets": "2", "chunk_size": "0",
+                 "checkpoint": str(simulate_nbmodel.CHECKPOINT_SECONDS), "crn": "no"},
+    "merge": {"all_pairs": "no", "recombine": "0", "resample": "no"},
+    "fit": {"engine": "stan", "nbmodel": "nbmodel_stan2.py", "chains": "2", "iterations": "6000", "warmup": "3000",
+            "warm": "no", "outdir": "ase_bayesian_out"},
+    "summarize": {"outfile": "posterior_estimates_summary.csv", "paired": "", "chunk_size": "0",
+                  "quantile_error": str(streaming_stats.QUANTILE_ERROR)},
+    "plot": {"parameters": "num_bioreps num_allele_specific_reads_per_biorep nfeature delta_AI", "outdir": "data_visualization"},
+}
+
+def getOptions():
+    parser = argparse.ArgumentParser(description="Run the simulate, merge, fit, summarize and plot steps from a config file, "
+                                                 "only redoing the work whose inputs or parameters changed")
+    parser.add_argument(
+        "-c",
+        "--config",
+        action="store",
+        help="INI config file with the sections [pipeline] (designs, outdir, jobs, seed), [simulate], [merge], [fit], [summarize] "
+             "and [plot], whose options are those of the corresponding scripts",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        action="store",
+        type=int,
+        required=False,
+        help="Optional number of tasks to run at the same time. Default - jobs in the [pipeline] section of the config file",
+    )
+    parser.add_argument(
+        "-n",
+        "--dry_run",
+        action="store_true",
+        help="Only print the tasks that would run and why",
+    )
+    parser.add_argument(
+        "-q",
+        "--queue",
+        action="store",
+        required=False,
+        help="Optional work queue directory on a filesystem shared by several hosts. The same command run on any number of hosts "
+             "drains the tasks together: each task is claimed with a lease file, run once, and marked done in the queue. "
+             "--jobs is then the number of workers on this host",
+    )
+    parser.add_argument(
+        "--lease",
+        action="store",
+        type=float,
+        default=work_queue.LEASE_SECONDS,
+        help="With --queue, number of seconds after which the task of a worker that stopped renewing its lease is taken over "
+             "by another worker (default: " + str(work_queue.LEASE_SECONDS) + ")",
+    )
+    parser.add_argument(
+        "--telemetry",
+        action="store",
+        required=False,
+        help="Optional JSON-lines log to which to append the wall time, CPU time, peak memory and I/O of every task and of the stages and commands it runs "
+             "(also switched on by the BAYESASE_TELEMETRY environment variable)",
+    )
+    args = parser.parse_args()
+    return args
+
+
+def read_config(config_file):
+    """Function to read the config file of the pipeline, with the defaults of the missing options
+         Arguments:
+           :param config_file: INI config file
+           :type config_file: string
+
+         Returns:
+           :return: Config with every section of DEFAULTS. Paths are made relative to the current directory.
+           :rtype: configparser ConfigParser
+    """
+    config = configparser.ConfigParser()
+    config.read_dict(DEFAULTS)
+    if not config.read(config_file):
+        raise SystemExit("Cannot read config file " + config_file)
+    base = os.path.dirname(os.path.abspath(config_file))
+    config["pipeline"]["designs"] = " ".join(os.path.join(base, design) for design in config["pipeline"]["designs"].split())
+    config["pipeline"]["outdir"] = os.path.join(base, config["pipeline"]["outdir"])
+    if os.path.sep in config["fit"]["nbmodel"]:
+        config["fit"]["nbmodel"] = os.path.join(base, config["fit"]["nbmodel"])
+    for section in ["fit", "plot"]:
+        config[section]["outdir"] = os.path.join(config["pipeline"]["outdir"], config[section]["outdir"])
+    config["summarize"]["outfile"] = os.path.join(config["pipeline"]["outdir"], config["summarize"]["outfile"])
+    return config
+
+
+def simulation_tasks(config, entropy):
+    """Function to list the simulation tasks, one per scenario of the design files and set.
+        The seed of each task is derived from the master seed and the scenario, so that adding or removing
+        rows of a design file does not change the datasets of the other rows.
+         Arguments:
+           :param config: Config of the pipeline
+           :type config: configparser ConfigParser
+
+           :param entropy: Master seed of the pipeline
+           :type entropy: int
+
+         Returns:
+           :return: Simulation tasks, and the catalog of the datasets they write as in merge_catalog.build_catalog
+           :rtype: tuple (list, Pandas DataFrame)
+    """
+    outdir = config["pipeline"]["outdir"]
+    r_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tasks/simulate_read_counts_NBmodel.r")
+    tasks, rows, outfiles = [], [], set()
+    crn = config["simulate"].getboolean("crn")
+    for design in config["pipeline"]["designs"].split():
+        df = pd.read_csv(design, dtype=str)
+        for row in df.to_dict("records"):
+            hypothesis = "H1_null" if float(row["theta"]) == merge_catalog.NULL_THETA else "H1_not_null"
+            for i in range(config["simulate"].getint("sets")):
+                routput = os.path.join(outdir, hypothesis, "out_set_" + str(i+1))
+                outfile = simulate_nbmodel.simulation_filename(routput, row["theta"], row["simruns"], row["nbiorep"],
+                                                               row["n_allele_specific_reads"],
+                                                               extension="." + config["simulate"]["format"])
+                if outfile in outfiles:
+                    continue ## Same scenario in two design files
+                outfiles.add(outfile)
+                name = os.path.basename(outfile)
+                task = {"theta": row["theta"], "simruns": row["simruns"], "nbiorep": row["nbiorep"],
+                        "n_allele_specific_reads": row["n_allele_specific_reads"], "routput": routput,
+                        "engine": config["simulate"]["engine"], "r_script": r_script, "format": config["simulate"]["format"],
+                        "chunk_size": config["simulate"].getint("chunk_size") or None,
+                        "checkpoint": config["simulate"].getfloat("checkpoint") or None, "crn": crn,
+                        "seed": np.random.SeedSequence(entropy, spawn_key=(i+1, zlib.crc32(name.encode())))}
+                if crn:
+                    task["seed"] = simulate_nbmodel.crn_seed(entropy, i+1, row["nbiorep"], row["simruns"])
+                params = {key: task[key] for key in ["theta", "simruns", "nbiorep", "n_allele_specific_reads", "engine", "format"]}
+                if task["chunk_size"]:
+                    params["stream"] = True ## The chunk size itself does not change the counts
+                if crn:
+                    params["crn"] = True
+                tasks.append({"name": "simulate " + name, "function": simulate_task, "args": (task,), "inputs": [],
+                              "outputs": [outfile], "params": dict(params, set=i+1, seed=entropy)})
+                rows.append({"path": outfile, "set": i+1, "theta": row["theta"], "rsim-g1": str(simulate_nbmodel.Q_TEST),
+                             "rsim-g2": str(simulate_nbmodel.Q_LINE), "nbiorep": row["nbiorep"],
+                             "allelicreads": row["n_allele_specific_reads"], "simruns": row["simruns"],
+                             "format": config["simulate"]["format"], **merge_catalog.EXTENDED_DEFAULTS})
+    catalog = pd.DataFrame(rows, columns=["path", "set", "theta"] + merge_catalog.SHARED_KEYS)
+    catalog["theta_value"] = catalog["theta"].astype(float)
+    return tasks, catalog
+
+
+def merge_tasks(config, catalog, entropy):
+    """Function to list the merge tasks, one per merged dataset, as merge_simul_conditions.py would write them
+         Arguments:
+           :param config: Config of the pipeline
+           :type config: configparser ConfigParser
+
+           :param catalog: Catalog of the simulated datasets
+           :type catalog: Pandas DataFrame
+
+           :param entropy: Master seed of the pipeline, used for the feature resampling
+           :type entropy: int
+
+         Returns:
+           :return: Merge tasks
+           :rtype: list
+    """
+    all_pairs = config["merge"].getboolean("all_pairs")
+    crn = config["simulate"].getboolean("crn")
+    if config["merge"].getint("recombine") > 0:
+        pairs = merge_catalog.recombine_pairs(catalog, config["merge"].getint("recombine"), all_pairs,
+                                              config["merge"].getboolean("resample"), entropy, crn)
+    else:
+        pairs = merge_catalog.pair_datasets(catalog, all_pairs, crn)
+    pairs["outfile"] = [os.path.join(config["pipeline"]["outdir"], outdir, filename)
+                        for outdir, filename in zip(pairs["outdir"], pairs["filename"])]
+    tasks = []
+    for index in range(pairs.shape[0]):
+        df_pair = pairs.iloc[[index]]
+        row = df_pair.iloc[0]
+        params = {"resample": int(row["resample"])}
+        if row["resample"] > 0:
+            params["resample_seed"] = [int(value) for value in row["resample_seed"]]
+        tasks.append({"name": "merge " + row["filename"], "function": merge_catalog.merge_group, "args": (df_pair,),
+                      "inputs": [row["path_c1"], row["path_c2"]], "outputs": [row["outfile"]], "params": params})
+    return tasks
+
+
+def fit_task(compID, infile, options, outdir, workroot):
+    """Function to fit the model to one merged dataset, failing if the fit fails
+         Arguments:
+           :param compID: Name of the comparison, the input filename without extension
+           :type compID: string
+
+           :param infile: Merged simulated dataset
+           :type infile: string
+
+           :param options: Engine, nbmodel_stan2.py command and options, as given to run_nbmodel_fits.fit_dataset
+           :type options: argparse Namespace
+
+           :param outdir: Directory to which to save the bayesian_out_<compID>.tabular file
+           :type outdir: string
+
+           :param workroot: Directory under which the working directory of the fit is created
+           :type workroot: string
+    """
+    os.makedirs(workroot, exist_ok=True)
+    returncode = fit_dataset(compID, infile, options, outdir, workroot)
+    if returncode != 0:
+        raise RuntimeError("Fit of " + compID + " failed with return code " + str(returncode) +
+                           ", see " + os.path.join(workroot, compID))
+
+
+def fit_tasks(config, merged):
+    """Function to list the fit tasks, one per merged dataset
+         Arguments:
+           :param config: Config of the pipeline
+           :type config: configparser ConfigParser
+
+           :param merged: Merged datasets
+           :type merged: list
+
+         Returns:
+           :return: Fit tasks
+           :rtype: list
+    """
+    fit = config["fit"]
+    options = argparse.Namespace(engine=fit["engine"], nbmodel=fit["nbmodel"], chains=fit.getint("chains"),
+                                 iterations=fit.getint("iterations"), warmup=fit.getint("warmup"),
+                                 warm=fit.getboolean("warm"))
+    workroot = os.path.normpath(fit["outdir"]) + "_fits"
+    tasks = []
+    for infile in merged:
+        compID = os.path.splitext(os.path.basename(infile))[0]
+        tasks.append({"name": "fit " + compID, "function": fit_task, "args": (compID, infile, options, fit["outdir"], workroot),
+                      "inputs": [infile], "outputs": [os.path.join(fit["outdir"], "bayesian_out_" + compID + ".tabular")],
+                      "params": fit_options(options)})
+    return tasks
+
+
+def summarize_task(fitdir, outfile, paired=(), chunk_size=None, error=streaming_stats.QUANTILE_ERROR):
+    """Function to summarize the fit outputs, reusing the summary cache of the files that did not change
+         Arguments:
+           :param fitdir: Directory of the bayesian_out_<compID>.tabular files
+           :type fitdir: string
+
+           :param outfile: Summary CSV file
+           :type outfile: string
+
+           :param paired: Parameters along which to compute paired differences of power
+           :type paired: list
+
+           :param chunk_size: If not None, number of rows of each file read at a time by the streaming summary
+           :type chunk_size: int
+
+           :param error: With chunk_size, bound on the rank error of the medians
+           :type error: float
+    """
+    df_manifest = compute_prop_hypothesis_cached([fitdir], outfile + ".manifest.csv", chunk_size=chunk_size, error=error)
+    with integrity.atomic_path(outfile) as temporary:
+        df_manifest[SUMMARY_COLUMNS].to_csv(temporary, index=False)
+    for parameter in paired:
+        with integrity.atomic_path(paired_filename(outfile, parameter)) as temporary:
+            paired_differences(list_result_files([fitdir]), parameter).to_csv(temporary, index=False)
+
+
+def plot_task(param, summary, outdir, stamp):
+    """Function to draw the plots of one parameter with plot_power.py, in the current process, and mark them as done
+         Arguments:
+           :param param: Parameter on the x axis, as given to plot_power.py -p
+           :type param: string
+
+           :param summary: Summary CSV file
+           :type summary: string
+
+           :param outdir: Directory of the plots
+           :type outdir: string
+
+           :param stamp: File written once the plots are drawn
+           :type stamp: string
+    """
+    ## Imported here, so that matplotlib is only loaded by the processes that draw
+    import plot_power
+    argv = ["-p", param, "-o", outdir, "-i", summary]
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        with telemetry.stage("plot", {"param": param}):
+            plot_power.main(argv)
+    with open(stamp, "w") as output:
+        output.write(" ".join(["plot_power.py"] + argv) + "\n")
+
+
+def build_tasks(config, entropy):
+    """Function to list every task of the pipeline
+         Arguments:
+           :param config: Config of the pipeline
+           :type config: configparser ConfigParser
+
+           :param entropy: Master seed of the pipeline
+           :type entropy: int
+
+         Returns:
+           :return: Tasks of the graph
+           :rtype: list
+    """
+    simulations, catalog = simulation_tasks(config, entropy)
+    merges = merge_tasks(config, catalog, entropy)
+    fits = fit_tasks(config, [task["outputs"][0] for task in merges])
+    summary = config["summarize"]["outfile"]
+    tasks = simulations + merges + fits
+    paired = config["summarize"]["paired"].split()
+    chunk_size = config["summarize"].getint("chunk_size") or None
+    error = config["summarize"].getfloat("quantile_error")
+    params = {"paired": paired}
+    if chunk_size:
+        params["quantile_error"] = error ## The chunk size itself does not change the summary
+    tasks.append({"name": "summarize", "function": summarize_task, "args": (config["fit"]["outdir"], summary, paired, chunk_size, error),
+                  "inputs": [task["outputs"][0] for task in fits],
+                  "outputs": [summary] + [paired_filename(summary, parameter) for parameter in paired], "params": params})
+    for param in config["plot"]["parameters"].split():
+        stamp = os.path.join(config["plot"]["outdir"], "." + param + ".done")
+        tasks.append({"name": "plot " + param, "function": plot_task, "args": (param, summary, config["plot"]["outdir"], stamp),
+                      "inputs": [summary], "outputs": [stamp], "params": {"param": param}})
+    return tasks
+
+
+def queue_seed(queue_dir):
+    """Function to read the master seed shared by the workers of a queue, drawn by the first one
+         Arguments:
+           :param queue_dir: Directory of the queue
+           :type queue_dir: string
+
+         Returns:
+           :return: Master seed
+           :rtype: int
+    """
+    work_queue.make_queue(queue_dir)
+    seed_file = os.path.join(queue_dir, "seed")
+    work_queue.create_exclusive(seed_file, str(np.random.SeedSequence().entropy))
+    with open(seed_file) as seed:
+        return int(seed.read())
+
+
+def drain_queue(tasks, queue_dir, index, lease_seconds, state_file):
+    """Function to run one worker of a work queue
+         Arguments:
+           :param tasks: Tasks of the graph
+           :type tasks: list
+
+           :param queue_dir: Directory of the queue
+           :type queue_dir: string
+
+           :param index: Number of the worker on this host
+           :type index: int
+
+           :param lease_seconds: Age after which a lease that was not renewed is taken over
+           :type lease_seconds: float
+
+           :param state_file: State file of the pipeline, whose up to date tasks are marked done
+           :type state_file: string
+
+         Returns:
+           :return: Names of the tasks the worker ran, and names of the tasks that failed or were skipped
+           :rtype: tuple (list, list)
+    """
+    return work_queue.drain(tasks, queue_dir, work_queue.worker_name(index), lease_seconds, state_file=state_file)
+
+
+def main():
+    args = getOptions()
+    if args.telemetry:
+        telemetry.enable(args.telemetry)
+    config = read_config(args.config)
+    outdir = config["pipeline"]["outdir"]
+    os.makedirs(outdir, exist_ok=True)
+    state_file = os.path.join(outdir, "pipeline_state.json")
+
+    ## The master seed is kept in the state file when the config file does not give one, so that re-runs
+    ## reproduce the datasets already simulated. The workers of a queue share the seed of the queue.
+    state = pipeline.load_state(state_file)
+    if config["pipeline"]["seed"]:
+        entropy = config["pipeline"].getint("seed")
+    elif args.queue:
+        entropy = state.get("seed") or queue_seed(args.queue)
+    else:
+        entropy = state.get("seed", np.random.SeedSequence().entropy)
+    if state.get("seed") != entropy and not args.dry_run and not args.queue:
+        state["seed"] = entropy
+        pipeline.save_state(state_file, state)
+    print("Master seed: " + str(entropy))
+
+    tasks = build_tasks(config, entropy)
+    jobs = args.jobs if args.jobs else config["pipeline"].getint("jobs")
+    if args.queue and not args.dry_run:
+        ## The state file is only read: the workers of every host record their work in the queue
+        if jobs > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                results = list(executor.map(drain_queue, [tasks]*jobs, [args.queue]*jobs, range(jobs), [args.lease]*jobs, [state_file]*jobs))
+        else:
+            results = [drain_queue(tasks, args.queue, 0, args.lease, state_file)]
+        ran = [name for worker_ran, worker_failed in results for name in worker_ran]
+        failed = sorted({name for worker_ran, worker_failed in results for name in worker_failed})
+        print("{} of {} tasks run by the workers of this host".format(len(ran), len(tasks)))
+        if failed:
+            raise SystemExit(str(len(failed)) + " task(s) failed or skipped: " + ", ".join(failed) +
+                             ". Remove their markers from " + os.path.join(args.queue, "failed") + " to retry them")
+        return
+    ran, failed = pipeline.run_tasks(tasks, state_file, jobs, args.dry_run)
+    print("{} of {} tasks {}, {} up to date".format(len(ran), len(tasks), "to run" if args.dry_run else "run",
+                                                   len(tasks)-len(set(ran).union(failed))))
+    if failed:
+        raise SystemExit(str(len(failed)) + " task(s) failed or skipped: " + ", ".join(failed))
+
+
+if __name__ == "__main__":
+    main()
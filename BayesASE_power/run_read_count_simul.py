@@ -3,15 +3,22 @@
 import argparse
 import os
 import sys
-import subprocess
+import time
+import zlib
 import pandas as pd
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from tasks import integrity
+from tasks import simulate_nbmodel
+from tasks import scenario_store
+from tasks import telemetry
 
 #try:
 #    from importlib import resources as ires
 #except ImportError:
 #    import importlib_resources as ires
 
-def getOptions():
+def getOptions(argv=None):
     parser = argparse.ArgumentParser(description="Simulated RNA-seq read counts")
     parser.add_argument(
         "-d",
@@ -33,46 +40,228 @@ def getOptions():
         action="store",
         help="Path to directory where to save output",
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "-e",
+        "--engine",
+        action="store",
+        choices=["numpy", "R"],
+        default="numpy",
+        help="Simulation backend: 'numpy' to simulate in-process or 'R' to call tasks/simulate_read_counts_NBmodel.r (default: numpy)",
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        action="store",
+        choices=["tsv", "npz"],
+        default="tsv",
+        help="Format of the simulated datasets: 'tsv' or the binary 'npz' format (numpy engine only, default: tsv)",
+    )
+    parser.add_argument(
+        "-c",
+        "--chunk_size",
+        action="store",
+        type=int,
+        required=False,
+        help="Optional number of features to simulate and write at a time (numpy engine only), so that memory does not "
+             "grow with simruns. For a given seed the datasets are the same for any chunk size, but differ from those "
+             "simulated in one go. Default - each dataset is simulated in memory in one go",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        action="store",
+        type=float,
+        default=simulate_nbmodel.CHECKPOINT_SECONDS,
+        help="With --chunk_size, seconds between two checkpoints of each dataset, taken after a chunk is written: a "
+             "simulation that is killed resumes from its last checkpoint when run again with the same seed, and gives "
+             "the same dataset. 0 to switch off "
+             "(default: " + str(simulate_nbmodel.CHECKPOINT_SECONDS) + ")",
+    )
+    parser.add_argument(
+        "--crn",
+        action="store_true",
+        help="Common random numbers (numpy engine only): datasets of the same set, number of bioreps and simruns share "
+             "their random draws whatever theta and read depth, so that differences of power between neighboring "
+             "scenarios have less Monte Carlo noise. Requires --seed, and the same --seed for every design file whose "
+             "datasets are compared. Merge them with merge_simul_conditions.py --crn",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        action="store",
+        type=int,
+        default=1,
+        help="Optional number of simulations to run in parallel (default: 1)",
+    )
+    parser.add_argument(
+        "--seed",
+        action="store",
+        type=int,
+        required=False,
+        help="Optional master seed from which the seed of each simulation is derived, together with its set and dataset "
+             "name. Default - a random seed that is printed",
+    )
+    parser.add_argument(
+        "--store",
+        action="store",
+        required=False,
+        help="Optional SQLite scenario store (created if needed). Datasets already simulated with the same parameters, "
+             "seed, engine and format are copied from the store instead of simulated again, and new datasets are recorded",
+    )
+    parser.add_argument(
+        "--telemetry",
+        action="store",
+        required=False,
+        help="Optional JSON-lines log to which to append the wall time, CPU time, peak memory and I/O of every simulation "
+             "(also switched on by the BAYESASE_TELEMETRY environment variable)",
+    )
+    args = parser.parse_args(argv)
     return args
 
 
-def main():
-    args = getOptions()
+def simulate_task(task):
+    """Function to run the simulation of one design row and set
+         Arguments:
+           :param task: Simulation parameters (theta, simruns, nbiorep, n_allele_specific_reads),
+                output prefix, engine, path of the R script and seed sequence of the task
+           :type task: dictionary
+
+         Returns:
+           :return: Name of the file written, and wall time in seconds
+           :rtype: tuple (string, float)
+    """
+    start = time.time()
+    params = dict(store_key(task)[0], set=os.path.basename(task["routput"]).split("_")[-1], format=task["format"])
+    if task["engine"] == "numpy":
+        rng = np.random.default_rng(task["seed"])
+        with telemetry.stage("simulate", params):
+            outfile = simulate_nbmodel.run_simulation(task["theta"], task["simruns"], task["nbiorep"],
+                                                      task["n_allele_specific_reads"], task["routput"], rng,
+                                                      task["format"], task.get("chunk_size"), task.get("crn", False),
+                                                      task.get("checkpoint"))
+        return outfile, time.time()-start
 
-    r_script = os.path.join(sys.path[0], "tasks/simulate_read_counts_NBmodel.r")
+    ## The R script appends to its output line by line: it writes under a hidden prefix, and the dataset is
+    ## published under its final name once Rscript succeeded
+    private = os.path.join(os.path.dirname(task["routput"]), "." + str(os.getpid()) + "_" + os.path.basename(task["routput"]))
+    written = simulate_nbmodel.simulation_filename(private, task["theta"], task["simruns"], task["nbiorep"], task["n_allele_specific_reads"])
+    cmd = [
+            "Rscript",
+            task["r_script"],
+            task["theta"],
+            task["simruns"],
+            private,
+            task["nbiorep"],
+            task["n_allele_specific_reads"],
+            str(task["seed"].generate_state(1)[0] % 2147483647) ## R seeds must fit in a signed 32 bit integer
+            ]
+    print(" ".join(cmd))
+    returncode = telemetry.call(cmd, "simulate", params)
+    if returncode != 0 or not os.path.exists(written):
+        if os.path.exists(written):
+            os.remove(written)
+        raise RuntimeError("Rscript failed with return code " + str(returncode) + ": " + " ".join(cmd))
+    outfile = simulate_nbmodel.simulation_filename(task["routput"], task["theta"], task["simruns"], task["nbiorep"],
+                                                   task["n_allele_specific_reads"])
+    integrity.publish(written, outfile)
+    return outfile, time.time()-start
+
+
+def store_key(task):
+    """Function to describe a simulation task for the scenario store
+         Arguments:
+           :param task: Simulation task, as given to simulate_task
+           :type task: dictionary
+
+         Returns:
+           :return: Scenario parameters, seed and options of the task
+           :rtype: tuple (dictionary, string, dictionary)
+    """
+    params = {"theta": task["theta"], "rsim-g1": str(simulate_nbmodel.Q_TEST), "rsim-g2": str(simulate_nbmodel.Q_LINE),
+              "nbiorep": task["nbiorep"], "allelicreads": task["n_allele_specific_reads"], "simruns": task["simruns"]}
+    seed = str(task["seed"].entropy) + "/" + "-".join(str(key) for key in task["seed"].spawn_key)
+    options = {"engine": task["engine"], "format": task["format"]}
+    if task.get("chunk_size"):
+        options["stream"] = True ## Streamed counts differ from in-memory counts, whatever the chunk size
+    if task.get("crn"):
+        options["crn"] = True
+    return params, seed, options
+
+
+def main(argv=None):
+    args = getOptions(argv)
+    if args.telemetry:
+        telemetry.enable(args.telemetry)
+
+    r_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tasks/simulate_read_counts_NBmodel.r")
     # Once the package is built with set up files, i think this is what you want:
     #with ires.path("BayesASE_power", "simulate_read_counts_NBmodel_05kos.r") as R_path:
     #        r_script = str(R_path)
 
+    if args.engine == "R" and args.format != "tsv":
+        sys.exit("The R simulation backend only writes TSV datasets")
+    if args.crn and args.seed is None:
+        sys.exit("--crn needs --seed: the draws are shared through the seed, so use the same --seed in every "
+                 "simulation step whose datasets are compared")
+    if args.engine == "R" and args.crn:
+        sys.exit("The R simulation backend does not support common random numbers, use the numpy engine with --crn")
+    if args.engine == "R" and args.chunk_size:
+        sys.exit("The R simulation backend simulates datasets in one go, use the numpy engine with --chunk_size")
+
     df = pd.read_csv(args.design, dtype=str)
 
     # iterate over design file
+    tasks = []
     for index, row in df.iterrows():
 
         for i in range(args.sets):
 
             if float(row["theta"]) == 0.5:
-                if not os.path.exists(os.path.join(args.outdir, "H1_null")):
-                    os.makedirs(os.path.join(args.outdir, "H1_null"))
+                os.makedirs(os.path.join(args.outdir, "H1_null"), exist_ok=True)
                 routput = os.path.join(args.outdir, "H1_null", "out_set_"+str(i+1))
             else:
-                if not os.path.exists(os.path.join(args.outdir, "H1_not_null")):
-                    os.makedirs(os.path.join(args.outdir, "H1_not_null"))
+                os.makedirs(os.path.join(args.outdir, "H1_not_null"), exist_ok=True)
                 routput = os.path.join(args.outdir, "H1_not_null", "out_set_"+str(i+1))
 
-            cmd = [
-                    "Rscript",
-                    r_script,
-                    row["theta"],
-                    row["simruns"],
-                    routput,
-                    row["nbiorep"],
-                    row["n_allele_specific_reads"]
-                    ]
-            print(" ".join(cmd))
-
-            subprocess.call(cmd)
+            tasks.append({"theta": row["theta"], "simruns": row["simruns"], "nbiorep": row["nbiorep"],
+                          "n_allele_specific_reads": row["n_allele_specific_reads"], "routput": routput,
+                          "engine": args.engine, "r_script": r_script, "format": args.format,
+                          "chunk_size": args.chunk_size, "checkpoint": args.checkpoint or None, "crn": args.crn,
+                          "set": i+1})
+
+    # every (row, set) gets its own random stream, keyed on its set and dataset name as in run_pipeline.py,
+    # so the output does not depend on the number of jobs, the order of the design rows or the other design
+    # files run with the same seed
+    master_seed = np.random.SeedSequence(args.seed)
+    print("Master seed: " + str(master_seed.entropy))
+    for task in tasks:
+        task["outfile"] = simulate_nbmodel.simulation_filename(task["routput"], task["theta"], task["simruns"], task["nbiorep"],
+                                                               task["n_allele_specific_reads"], extension="." + task["format"])
+        name = os.path.basename(task["outfile"])
+        task["seed"] = np.random.SeedSequence(master_seed.entropy, spawn_key=(task["set"], zlib.crc32(name.encode())))
+        if task["crn"]:
+            ## every theta and read depth of a set shares the random stream of its set, bioreps and simruns
+            task["seed"] = simulate_nbmodel.crn_seed(master_seed.entropy, task["set"], task["nbiorep"], task["simruns"])
+    if args.store:
+        pending = []
+        for task in tasks:
+            found = scenario_store.find(args.store, "simulated", *store_key(task))
+            if found:
+                scenario_store.reuse(found, task["outfile"])
+                print(task["outfile"] + ": reused " + found[0])
+            else:
+                pending.append(task)
+        tasks = pending
+
+    if args.jobs > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            results = list(executor.map(simulate_task, tasks))
+    else:
+        results = [simulate_task(task) for task in tasks]
+    for task, (outfile, wall_time) in zip(tasks, results):
+        print(outfile)
+        if args.store:
+            params, seed, options = store_key(task)
+            scenario_store.record(args.store, "simulated", task["outfile"], params, seed, options, wall_time_s=wall_time)
 
 
 if __name__ == "__main__":
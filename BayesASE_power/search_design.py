@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+import argparse
+import functools
+import os
+import numpy as np
+import pandas as pd
+from tasks import adaptive_power
+from tasks import design_search
+from tasks import integrity
+
+def getOptions():
+    parser = argparse.ArgumentParser(description="Find the cheapest number of bioreps and read depth that reach a target power for H1 or H3")
+    parser.add_argument(
+        "-H",
+        "--hypothesis",
+        action="store",
+        choices=["H1", "H3"],
+        default="H3",
+        help="Hypothesis whose power is targeted: AI in condition 1 ('H1') or difference of AI between conditions ('H3') (default: H3)",
+    )
+    parser.add_argument(
+        "-d",
+        "--delta_AI",
+        action="store",
+        type=float,
+        help="Effect size to detect, as delta_AI_1 (H1: |theta1 - 0.5|/0.5) or delta_AI_3 (H3: |theta2 - theta1|/theta1) in the summary",
+    )
+    parser.add_argument(
+        "--theta1",
+        action="store",
+        type=float,
+        default=0.5,
+        help="Level of AI of condition 1 for H3 (default: 0.5)",
+    )
+    parser.add_argument(
+        "-p",
+        "--power",
+        action="store",
+        type=float,
+        default=0.8,
+        help="Target power, proportion of features with Bayes evidence < 0.05 under the alternative, that the lower "
+             "bound of the confidence interval must reach (default: 0.8)",
+    )
+    parser.add_argument(
+        "-a",
+        "--type_I_error",
+        action="store",
+        type=float,
+        default=0.05,
+        help="Highest acceptable Type I error, proportion of features with Bayes evidence < 0.05 under the null, for the "
+             "upper bound of the confidence interval (default: 0.05)",
+    )
+    parser.add_argument(
+        "-n",
+        "--nbiorep",
+        action="store",
+        type=int,
+        nargs=2,
+        default=[2, 10],
+        help="Smallest and largest number of bioreps per condition (default: 2 10)",
+    )
+    parser.add_argument(
+        "-r",
+        "--reads",
+        action="store",
+        type=int,
+        nargs=2,
+        default=[10, 1000],
+        help="Smallest and largest number of allele specific reads per biorep (default: 10 1000)",
+    )
+    parser.add_argument(
+        "--step",
+        action="store",
+        type=int,
+        default=10,
+        help="Resolution of the read depth search, in allele specific reads per biorep (default: 10)",
+    )
+    parser.add_argument(
+        "--cost_biorep",
+        action="store",
+        type=float,
+        default=1.0,
+        help="Cost of one biorep (library) (default: 1.0)",
+    )
+    parser.add_argument(
+        "--cost_read",
+        action="store",
+        type=float,
+        default=0.001,
+        help="Cost of one allele specific read (default: 0.001)",
+    )
+    parser.add_argument(
+        "-o",
+        "--outfile",
+        action="store",
+        default="design_search.csv",
+        help="CSV file with the search path: every evaluated design point, its cost, power and Type I error (default: design_search.csv)",
+    )
+    parser.add_argument(
+        "--fitdir",
+        action="store",
+        required=False,
+        help="Optional directory to which to save the bayesian_out_<compID>.tabular file of every evaluated scenario",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch",
+        action="store",
+        type=int,
+        default=1000,
+        help="Number of features simulated and fit in each batch (default: 1000)",
+    )
+    parser.add_argument(
+        "-m",
+        "--max_features",
+        action="store",
+        type=int,
+        default=20000,
+        help="Budget cap on the number of features of each scenario (default: 20000)",
+    )
+    parser.add_argument(
+        "-w",
+        "--width",
+        action="store",
+        type=float,
+        default=0.02,
+        help="Target width of the confidence intervals of power and Type I error (default: 0.02)",
+    )
+    parser.add_argument(
+        "-e",
+        "--engine",
+        action="store",
+        choices=["approx", "stan"],
+        default="approx",
+        help="Fit each batch with the approximate model ('approx') or with nbmodel_stan2.py ('stan') (default: approx)",
+    )
+    parser.add_argument(
+        "--nbmodel",
+        action="store",
+        default="nbmodel_stan2.py",
+        help="Command or path of nbmodel_stan2.py from BayesASE (default: nbmodel_stan2.py)",
+    )
+    parser.add_argument(
+        "-c",
+        "--chains",
+        action="store",
+        type=int,
+        default=2,
+        help="Number of chains of each nbmodel_stan2.py fit (default: 2)",
+    )
+    parser.add_argument(
+        "-t",
+        "--iterations",
+        action="store",
+        type=int,
+        default=6000,
+        help="Number of iterations of each nbmodel_stan2.py fit (default: 6000)",
+    )
+    parser.add_argument(
+        "--warmup",
+        action="store",
+        type=int,
+        default=3000,
+        help="Number of warmup iterations of each nbmodel_stan2.py fit (default: 3000)",
+    )
+    parser.add_argument(
+        "--seed",
+        action="store",
+        type=int,
+        required=False,
+        help="Optional master seed from which the seed of each design point is derived. Default - a random seed that is printed",
+    )
+    parser.add_argument(
+        "--telemetry",
+        action="store",
+        required=False,
+        help="Optional JSON-lines log to which to append the wall time, CPU time, peak memory and I/O of every scenario and fit "
+             "(also switched on by the BAYESASE_TELEMETRY environment variable)",
+    )
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = getOptions()
+    if args.telemetry:
+        telemetry.enable(args.telemetry)
+    thetas = design_search.scenario_thetas(args.hypothesis, args.delta_AI, args.theta1)
+    entropy = np.random.SeedSequence(args.seed).entropy
+    print("Master seed: " + str(entropy))
+
+    if args.engine == "stan":
+        from run_adaptive_power import stan_batch
+        workroot = os.path.splitext(args.outfile)[0] + "_fits"
+        os.makedirs(workroot, exist_ok=True)
+        fit_batch = functools.partial(stan_batch, args=args, workroot=workroot)
+    else:
+        fit_batch = adaptive_power.approx_batch
+    if args.fitdir:
+        os.makedirs(args.fitdir, exist_ok=True)
+
+    def evaluate(nbiorep, reads_per_biorep):
+        row, results = design_search.evaluate_design(nbiorep, reads_per_biorep, args.hypothesis, thetas, entropy,
+                                                     args.power, args.type_I_error, fit_batch, args.batch,
+                                                     args.max_features, args.width)
+        if args.fitdir:
+            for df_result in results:
+                with integrity.atomic_path(os.path.join(args.fitdir, "bayesian_out_" + df_result["comparison"].iloc[0] + ".tabular")) as temporary:
+                    df_result.to_csv(temporary, index=False, sep="\t")
+        print("nbiorep {} x {} reads/biorep: power {:.3f} ({:.3f}-{:.3f}), Type I error {:.3f} ({:.3f}-{:.3f}), cost {:g}{}".format(
+              nbiorep, reads_per_biorep, row["power"], row["power_lower"], row["power_upper"], row["type_I_error"],
+              row["type_I_error_lower"], row["type_I_error_upper"],
+              design_search.design_cost(nbiorep, reads_per_biorep, args.cost_biorep, args.cost_read),
+              "" if row["feasible"] else " (not feasible)"))
+        return row
+
+    cost = functools.partial(design_search.design_cost, cost_biorep=args.cost_biorep, cost_read=args.cost_read)
+    path, best = design_search.search_designs(evaluate, args.nbiorep, args.reads, args.step, cost)
+    pd.DataFrame(path)[design_search.SEARCH_COLUMNS].to_csv(args.outfile, index=False)
+    print(str(len(path)) + " design points evaluated, search path saved to " + args.outfile)
+    if best is None:
+        raise SystemExit("No design in the search ranges reaches power " + str(args.power) +
+                         " with Type I error <= " + str(args.type_I_error) + " at the bounds of their confidence intervals")
+    print("Cheapest design: {} bioreps x {} allele specific reads per biorep ({} reads), cost {:g}, power {:.3f}, Type I error {:.3f}".format(
+          best["nbiorep"], best["reads_per_biorep"], best["n_allele_specific_reads"], best["cost"], best["power"], best["type_I_error"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,40 @@
 #!/usr/bin/env python3
 
 import argparse
+import hashlib
+import io
 import os
 import pandas as pd
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from tasks import integrity
+from tasks import scenario_store
+from tasks import simulate_nbmodel
+from tasks import streaming_stats
+from tasks import telemetry
 
-def getOptions():
+## Posterior estimates summarized by their average, median and variance, and the name used in the summary columns
+ESTIMATE_COLUMNS = {'alpha1_postmean': 'alpha1', 'alpha2_postmean': 'alpha2', 'c1_theta': 'theta1', 'c2_theta': 'theta2',
+                    'c1_sampleprop': 'c1_sampleprop', 'c2_sampleprop': 'c2_sampleprop'}
+## Bayes evidence summarized by the proportion of features below 0.05 and 0.01
+EVIDENCE_COLUMNS = {'prop_H1': 'c1_Bayes_evidence', 'prop_H2': 'c2_Bayes_evidence', 'prop_H3': 'H3_independence_Bayes_evidence'}
+RESULT_COLUMNS = ['comparison'] + list(ESTIMATE_COLUMNS) + list(EVIDENCE_COLUMNS.values())
+SUMMARY_COLUMNS = ['nfeature', 'r_g1', 'r_g2', 'num_bioreps', 'num_allele_specific_reads_per_biorep', 'num_allele_specific_reads', 'coverage_per_biorep', 
+                   'theta1_sim', 'theta2_sim', 'delta_AI_1', 'delta_AI_2', 'delta_AI_3',
+                   'alpha1_sim', 'alpha2_sim', 
+                   'average_alpha1', 'median_alpha1', 'variance_alpha1', 'average_alpha2', 'median_alpha2', 'variance_alpha2',
+                   'average_theta1', 'median_theta1', 'variance_theta1', 'average_theta2', 'median_theta2', 'variance_theta2',
+                   'average_c1_sampleprop', 'median_c1_sampleprop', 'variance_c1_sampleprop',
+                   'average_c2_sampleprop', 'median_c2_sampleprop', 'variance_c2_sampleprop',
+                   'prop_H1_LE05', 'prop_H1_LE01', 'prop_H2_LE05', 'prop_H2_LE01', 'prop_H3_LE05', 'prop_H3_LE01',
+                   'source_c1', 'source_c2', 'phi_sim', 'biorep_sd_sim']
+## Parameters along which paired differences of power can be computed, and the proportions compared
+PAIRED_PARAMETERS = ['theta1', 'theta2', 'allelicreads']
+PAIRED_PROPORTIONS = [prop + '_LE' + level for prop in EVIDENCE_COLUMNS for level in ['05', '01']]
+## Columns identifying each file in the summary cache manifest
+MANIFEST_COLUMNS = ['path', 'size', 'mtime_ns', 'sha256']
+
+def getOptions(argv=None):
     parser = argparse.ArgumentParser(description="Summarize the posterior estimates after fitting NB model to data")
     parser.add_argument(
         "-o",
@@ -21,89 +50,537 @@ def getOptions():
         nargs='*',
         help="(List of) folder(s) with outputs from Bayesian ASE model to summarize",
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "-t",
+        "--threads",
+        action="store",
+        type=int,
+        required=False,
+        help="Optional number of files to read at the same time. Default - chosen from the number of cores",
+    )
+    parser.add_argument(
+        "-c",
+        "--cache",
+        action="store_true",
+        help="Keep a summary cache in <outfile>.manifest.csv and only summarize new or changed files",
+    )
+    parser.add_argument(
+        "--store",
+        action="store",
+        required=False,
+        help="Optional SQLite scenario store (created if needed) in which to save the summary row of each file, "
+             "with its path and content hash. Implies --cache",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        action="store",
+        type=int,
+        required=False,
+        help="Optional number of rows to read at a time: each file is summarized in a streaming pass that only keeps "
+             "the columns it needs, running means and variances, exact counts for the proportions and a quantile sketch "
+             "for the medians, so that memory does not grow with the number of features. Default - each file is read "
+             "in one go and its medians are exact",
+    )
+    parser.add_argument(
+        "--quantile_error",
+        action="store",
+        type=float,
+        default=streaming_stats.QUANTILE_ERROR,
+        help="With --chunk_size, bound on the rank error of the medians as a fraction of the number of features; "
+             "files with fewer than " + str(streaming_stats.SKETCH_LEVELS) + "/quantile_error features get exact medians "
+             "(default: " + str(streaming_stats.QUANTILE_ERROR) + ")",
+    )
+    parser.add_argument(
+        "-p",
+        "--paired",
+        action="store",
+        nargs='*',
+        choices=PAIRED_PARAMETERS,
+        required=False,
+        help="Optional parameter(s) along which to compute paired differences of power between scenarios that differ "
+             "only in that parameter, feature by feature, saved to <outfile>_paired_<parameter>.csv. Meant for datasets "
+             "simulated with --crn, whose neighboring scenarios are positively correlated",
+    )
+    parser.add_argument(
+        "--telemetry",
+        action="store",
+        required=False,
+        help="Optional JSON-lines log to which to append the wall time, CPU time, peak memory and I/O of the summary "
+             "(also switched on by the BAYESASE_TELEMETRY environment variable)",
+    )
+    args = parser.parse_args(argv)
     return args
 
 
-def compute_prop_hypothesis(dir_list):
-    """Function to summarize results of analysis of data with Bayesian model
+def list_result_files(dir_list):
+    """Function to list the outputs from Bayesian ASE model in a list of directories
          Arguments:
            :param dir_list: A list of directories from which to read files
-           :type datadir: list
+           :type dir_list: list
+
          Returns:
-           :return : Dataframe with simulation parameters and summary statistics of model posterior estimates
-           :rypte: Pandas DataFrame
+           :return: Paths of the files to summarize, skipping the *r_out and *temp files of nbmodel_stan2.py,
+                check files and hidden (temporary) files
+           :rtype: list
     """
-    array_all_estimate = np.empty((0,38), dtype=float)
+    filelist = []
     for dir in dir_list:
         for filename in os.listdir(dir):
-            if len(list(filter(filename.endswith, ['r_out', 'temp']))) == 0:
-                print(filename)
-                df_result = pd.read_csv(os.path.join(dir, filename), sep="\t")
-                scenario = df_result['comparison'][0].split('_')
-                scenario = {name:value for name,value in zip(scenario[::2], scenario[1::2])}
-                coverage_per_biorep = int(scenario['allelicreads'])/2/int(scenario['nbiorep'])/np.mean([float(scenario['rsim-g1']), float(scenario['rsim-g2'])]) ## This includes the reads that map best to an allele g1 (or g2) and
-                                                                                                                                        ## equally well to both alleles given it was generated by g1 (or g2)
-                num_allele_specific_reads_per_biorep = float(scenario['allelicreads'])/int(scenario['nbiorep'])
-                alpha1_sim = np.sqrt((1/float(scenario['theta1']))-1) ## In the stan2 model, theta = 1/(alpha[i]^2+1)
-                alpha2_sim = np.sqrt((1/float(scenario['theta2']))-1)
-                delta_ai_1 = round(abs(float(scenario['theta1'])-0.5)/0.5, 2) ## |theta1 - theta0| / theta0 where theta0 = 0.5
-                delta_ai_2 = round(abs(float(scenario['theta2'])-0.5)/0.5, 2) ## |theta2 - theta0| / theta0 where theta0 = 0.5
-                delta_ai_3 = round(abs(float(scenario['theta2'])-float(scenario['theta1']))/float(scenario['theta1']), 2) ## |theta2 - theta1| / theta1
-                nfeature = df_result.shape[0]
-                alpha1_avg = np.mean(df_result['alpha1_postmean'])
-                alpha1_median = np.median(df_result['alpha1_postmean'])
-                alpha1_variance = np.var(df_result['alpha1_postmean'])
-                alpha2_avg = np.mean(df_result['alpha2_postmean'])
-                alpha2_median = np.median(df_result['alpha2_postmean'])
-                alpha2_variance = np.var(df_result['alpha2_postmean'])
-                theta1_avg = np.mean(df_result['c1_theta'])
-                theta1_median = np.median(df_result['c1_theta'])
-                theta1_variance = np.var(df_result['c1_theta'])
-                theta2_avg = np.mean(df_result['c2_theta'])
-                theta2_median = np.median(df_result['c2_theta'])
-                theta2_variance = np.var(df_result['c2_theta'])
-                c1_sampleprop_avg = np.mean(df_result['c1_sampleprop'])
-                c1_sampleprop_median = np.median(df_result['c1_sampleprop'])
-                c1_sampleprop_variance = np.var(df_result['c1_sampleprop'])
-                c2_sampleprop_avg = np.mean(df_result['c2_sampleprop'])
-                c2_sampleprop_median = np.median(df_result['c2_sampleprop'])
-                c2_sampleprop_variance = np.var(df_result['c2_sampleprop'])
-                prop_H1_LE05 = sum(df_result['c1_Bayes_evidence']<0.05)/nfeature
-                prop_H1_LE01 = sum(df_result['c1_Bayes_evidence']<0.01)/nfeature
-                prop_H2_LE05 = sum(df_result['c2_Bayes_evidence']<0.05)/nfeature
-                prop_H2_LE01 = sum(df_result['c2_Bayes_evidence']<0.01)/nfeature
-                prop_H3_LE05 = sum(df_result['H3_independence_Bayes_evidence']<0.05)/nfeature
-                prop_H3_LE01 = sum(df_result['H3_independence_Bayes_evidence']<0.01)/nfeature
-                array_all_estimate = np.append(array_all_estimate, np.array([[nfeature, scenario['rsim-g1'], scenario['rsim-g2'], 
-                                            int(scenario['nbiorep']), num_allele_specific_reads_per_biorep, scenario['allelicreads'], coverage_per_biorep, 
-                                            scenario['theta1'], scenario['theta2'], delta_ai_1, delta_ai_2, delta_ai_3, alpha1_sim, alpha2_sim,
-                                            alpha1_avg, alpha1_median, alpha1_variance, alpha2_avg, alpha2_median, alpha2_variance, theta1_avg,
-                                            theta1_median, theta1_variance, theta2_avg, theta2_median, theta2_variance, c1_sampleprop_avg,
-                                            c1_sampleprop_median, c1_sampleprop_variance, c2_sampleprop_avg, c2_sampleprop_median,
-                                            c2_sampleprop_variance, prop_H1_LE05, prop_H1_LE01, prop_H2_LE05, prop_H2_LE01, prop_H3_LE05, prop_H3_LE01]]), axis=0)
-
-    column_names = ['nfeature', 'r_g1', 'r_g2', 'num_bioreps', 'num_allele_specific_reads_per_biorep', 'num_allele_specific_reads', 'coverage_per_biorep', 
-                    'theta1_sim', 'theta2_sim', 'delta_AI_1', 'delta_AI_2', 'delta_AI_3',
-                    'alpha1_sim', 'alpha2_sim', 
-                    'average_alpha1', 'median_alpha1', 'variance_alpha1', 'average_alpha2', 'median_alpha2', 'variance_alpha2',
-                    'average_theta1', 'median_theta1', 'variance_theta1', 'average_theta2', 'median_theta2', 'variance_theta2',
-                    'average_c1_sampleprop', 'median_c1_sampleprop', 'variance_c1_sampleprop',
-                    'average_c2_sampleprop', 'median_c2_sampleprop', 'variance_c2_sampleprop',
-                    'prop_H1_LE05', 'prop_H1_LE01', 'prop_H2_LE05', 'prop_H2_LE01', 'prop_H3_LE05', 'prop_H3_LE01']
-
-    return(pd.DataFrame(array_all_estimate, columns=column_names))
-
-
-def main():
-    args = getOptions()
-    df_result = compute_prop_hypothesis(args.inputdirs)
+            if (len(list(filter(filename.endswith, ['r_out', 'temp', integrity.CHECK_SUFFIX]))) == 0 and not filename.startswith('.')
+                    and os.path.isfile(os.path.join(dir, filename))):
+                filelist.append(os.path.join(dir, filename))
+    return filelist
+
+
+def read_result(filename):
+    """Function to read one output from Bayesian ASE model
+         Arguments:
+           :param filename: Path of a bayesian_out_*.tabular file
+           :type filename: string
+
+         Returns:
+           :return: Dataframe with the columns needed for the summary. A file that does not match its check file
+                (see tasks/integrity.py) raises a ValueError.
+           :rtype: Pandas DataFrame
+    """
+    print(filename)
+    integrity.verify(filename)
+    return pd.read_csv(filename, sep="\t", usecols=RESULT_COLUMNS)
+
+
+def scenario_parameters(comparisons):
+    """Function to compute the simulation parameters encoded in the comparison names
+         Arguments:
+           :param comparisons: Comparison names, e.g. theta1_0.5_theta2_0.6_rsim-g1_0.8_rsim-g2_0.8_nbiorep_3_allelicreads_960_simruns_5
+           :type comparisons: Pandas Series
+
+         Returns:
+           :return: Dataframe with the simulation parameters of each comparison, with the same index as comparisons
+           :rtype: Pandas DataFrame
+    """
+    scenarios = []
+    for comparison in comparisons:
+        scenario = comparison.split('_')
+        scenarios.append({name:value for name,value in zip(scenario[::2], scenario[1::2])})
+    df_scenario = pd.DataFrame(scenarios, index=comparisons.index)
+    ## Datasets merged with merge_simul_conditions.py -k end in sets_<set_c1>-<set_c2>: the source datasets
+    ## are identified so that replicates sharing a source are not treated as independent
+    ## Comparisons simulated with the dispersion and biorep effects of the R simulator leave them out of their name
+    phi = df_scenario['phi'] if 'phi' in df_scenario.columns else pd.Series(np.nan, index=comparisons.index, dtype=object)
+    biorep_sd = df_scenario['biorepsd'] if 'biorepsd' in df_scenario.columns else pd.Series(np.nan, index=comparisons.index, dtype=object)
+    phi = phi.fillna(str(simulate_nbmodel.TRUE_PHI))
+    biorep_sd = biorep_sd.fillna(str(simulate_nbmodel.BIOREP_SD))
+    if 'sets' in df_scenario.columns:
+        sets = df_scenario['sets'].str.split('-', n=1, expand=True)
+        source = ('_rsim-g1_' + df_scenario['rsim-g1'] + '_rsim-g2_' + df_scenario['rsim-g2'] + '_nbiorep_' + df_scenario['nbiorep'] +
+                  '_allelicreads_' + df_scenario['allelicreads'] + '_simruns_' + df_scenario['simruns'] +
+                  [simulate_nbmodel.scenario_suffix(value, sd) for value, sd in zip(phi, biorep_sd)])
+        source_c1 = 'theta_' + df_scenario['theta1'] + source + '_set_' + sets[0]
+        source_c2 = 'theta_' + df_scenario['theta2'] + source + '_set_' + sets[1]
+    else:
+        source_c1 = source_c2 = pd.Series(np.nan, index=comparisons.index, dtype=object)
+    r_g1 = df_scenario['rsim-g1'].astype(float)
+    r_g2 = df_scenario['rsim-g2'].astype(float)
+    nbiorep = df_scenario['nbiorep'].astype(int)
+    allelicreads = pd.to_numeric(df_scenario['allelicreads'])
+    theta1 = df_scenario['theta1'].astype(float)
+    theta2 = df_scenario['theta2'].astype(float)
+    return pd.DataFrame({'r_g1': r_g1, 'r_g2': r_g2, 'num_bioreps': nbiorep,
+                         'num_allele_specific_reads_per_biorep': allelicreads/nbiorep,
+                         'num_allele_specific_reads': allelicreads,
+                         'coverage_per_biorep': allelicreads/2/nbiorep/((r_g1+r_g2)/2), ## This includes the reads that map best to an allele g1 (or g2) and
+                                                                                        ## equally well to both alleles given it was generated by g1 (or g2)
+                         'theta1_sim': theta1, 'theta2_sim': theta2,
+                         'delta_AI_1': (abs(theta1-0.5)/0.5).round(2), ## |theta1 - theta0| / theta0 where theta0 = 0.5
+                         'delta_AI_2': (abs(theta2-0.5)/0.5).round(2), ## |theta2 - theta0| / theta0 where theta0 = 0.5
+                         'delta_AI_3': (abs(theta2-theta1)/theta1).round(2), ## |theta2 - theta1| / theta1
+                         'alpha1_sim': np.sqrt((1/theta1)-1), ## In the stan2 model, theta = 1/(alpha[i]^2+1)
+                         'alpha2_sim': np.sqrt((1/theta2)-1),
+                         'source_c1': source_c1, 'source_c2': source_c2,
+                         'phi_sim': phi.astype(float), 'biorep_sd_sim': biorep_sd.astype(float)})
+
+
+def summarize_results(df_results, keys):
+    """Function to compute the summary statistics of model posterior estimates of each fit at once
+         Arguments:
+           :param df_results: Outputs from Bayesian ASE model, concatenated
+           :type df_results: Pandas DataFrame
+
+           :param keys: Columns identifying each fit, the last one being 'comparison'
+           :type keys: list
+
+         Returns:
+           :return: Dataframe with simulation parameters and summary statistics of model posterior estimates, one row per fit
+           :rtype: Pandas DataFrame
+    """
+    grouped = df_results.groupby(keys, sort=False)
+    df_mean = grouped[list(ESTIMATE_COLUMNS)].mean()
+    df_median = grouped[list(ESTIMATE_COLUMNS)].median()
+    df_variance = grouped[list(ESTIMATE_COLUMNS)].var(ddof=0)
+    df_evidence = pd.DataFrame({prop + '_LE' + level: df_results[column] < float('0.' + level)
+                                for prop, column in EVIDENCE_COLUMNS.items() for level in ['05', '01']})
+    df_prop = df_evidence.groupby([df_results[key] for key in keys], sort=False).mean()
+
+    df_summary = pd.DataFrame({'nfeature': grouped.size()})
+    for column, name in ESTIMATE_COLUMNS.items():
+        df_summary['average_' + name] = df_mean[column]
+        df_summary['median_' + name] = df_median[column]
+        df_summary['variance_' + name] = df_variance[column]
+    df_summary = df_summary.join(df_prop).reset_index()
+    return summary_frame(df_summary)
+
+
+def summary_frame(df_summary):
+    """Function to add the simulation parameters to the summary statistics of each fit
+         Arguments:
+           :param df_summary: Summary statistics of each fit, with its 'comparison'
+           :type df_summary: Pandas DataFrame
+
+         Returns:
+           :return: Dataframe with the SUMMARY_COLUMNS
+           :rtype: Pandas DataFrame
+    """
+    df_summary = pd.concat([df_summary, scenario_parameters(df_summary['comparison'])], axis=1)
+    return df_summary[SUMMARY_COLUMNS]
+
+
+def read_result_chunks(filename, chunk_size, found):
+    """Function to read one output from Bayesian ASE model chunk_size rows at a time, computing the size, number of
+        lines and hash of the file in the same pass (see integrity.describe), so that the file is read only once.
+        The file is checked against its check file after the last chunk.
+         Arguments:
+           :param filename: Path of a bayesian_out_*.tabular file
+           :type filename: string
+
+           :param chunk_size: Number of rows read at a time
+           :type chunk_size: int
+
+           :param found: Filled with the 'bytes', 'lines' and 'sha256' of the file once it is read
+           :type found: dictionary
+
+         Returns:
+           :return: Dataframes with the columns needed for the summary. A file that does not match its check file
+                raises a ValueError after its last chunk.
+           :rtype: generator
+    """
+    sha256, size, lines = hashlib.sha256(), 0, 0
+    header, pending, rest = None, [], b""
+    with open(filename, "rb") as data:
+        for block in iter(lambda: data.read(1 << 20), b""):
+            sha256.update(block)
+            size += len(block)
+            lines += block.count(b"\n")
+            pending.extend((rest + block).split(b"\n"))
+            rest = pending.pop()
+            if header is None and pending:
+                header = pending.pop(0)
+            while len(pending) >= chunk_size:
+                yield pd.read_csv(io.BytesIO(b"\n".join([header] + pending[:chunk_size])), sep="\t", usecols=RESULT_COLUMNS)
+                del pending[:chunk_size]
+    if rest:
+        pending.append(rest)
+    if pending:
+        yield pd.read_csv(io.BytesIO(b"\n".join([header] + pending)), sep="\t", usecols=RESULT_COLUMNS)
+    found.update({"bytes": size, "lines": lines, "sha256": sha256.hexdigest()})
+    integrity.verify(filename, found=found)
+
+
+def summarize_result_streaming(filename, chunk_size, error=streaming_stats.QUANTILE_ERROR):
+    """Function to summarize one output from Bayesian ASE model chunk_size rows at a time, as summarize_results
+        does for the whole file: averages and variances are exact up to rounding, proportions are exact and medians
+        come from a quantile sketch (see tasks/streaming_stats.py)
+         Arguments:
+           :param filename: Path of a bayesian_out_*.tabular file
+           :type filename: string
+
+           :param chunk_size: Number of rows read at a time
+           :type chunk_size: int
+
+           :param error: Bound on the rank error of the medians, as a fraction of the number of features
+           :type error: float
+
+         Returns:
+           :return: Dataframe with simulation parameters and summary statistics of model posterior estimates, one row
+                per comparison, and SHA-256 hash of the file. A file that does not match its check file raises a ValueError.
+           :rtype: tuple (Pandas DataFrame, string)
+    """
+    print(filename)
+    found = {}
+    fits = {}
+    for df_chunk in read_result_chunks(filename, chunk_size, found):
+        for comparison, df_comparison in df_chunk.groupby('comparison', sort=False):
+            fit = fits.setdefault(comparison, {'nfeature': 0, 'moments': {column: streaming_stats.new_moments() for column in ESTIMATE_COLUMNS},
+                                               'sketches': {column: streaming_stats.new_sketch(error) for column in ESTIMATE_COLUMNS},
+                                               'counts': {prop + '_LE' + level: 0 for prop in EVIDENCE_COLUMNS for level in ['05', '01']}})
+            fit['nfeature'] += df_comparison.shape[0]
+            for column in ESTIMATE_COLUMNS:
+                values = df_comparison[column].to_numpy(dtype=float)
+                streaming_stats.update_moments(fit['moments'][column], values)
+                streaming_stats.update_sketch(fit['sketches'][column], values)
+            for prop, column in EVIDENCE_COLUMNS.items():
+                for level in ['05', '01']:
+                    fit['counts'][prop + '_LE' + level] += int((df_comparison[column] < float('0.' + level)).sum())
+
+    rows = []
+    for comparison, fit in fits.items():
+        row = {'comparison': comparison, 'nfeature': fit['nfeature']}
+        for column, name in ESTIMATE_COLUMNS.items():
+            moments = fit['moments'][column]
+            row['average_' + name] = moments['mean'] if moments['n'] else np.nan
+            row['median_' + name] = streaming_stats.sketch_quantile(fit['sketches'][column], 0.5)
+            row['variance_' + name] = streaming_stats.moments_variance(moments)
+        row.update({prop: count/fit['nfeature'] for prop, count in fit['counts'].items()})
+        rows.append(row)
+    if not rows:
+        return pd.DataFrame(columns=SUMMARY_COLUMNS), found['sha256']
+    return summary_frame(pd.DataFrame(rows)), found['sha256']
+
+
+def compute_prop_hypothesis(dir_list, threads=None, chunk_size=None, error=streaming_stats.QUANTILE_ERROR):
+    """Function to summarize results of analysis of data with Bayesian model
+         Arguments:
+           :param dir_list: A list of directories from which to read files
+           :type dir_list: list
+
+           :param threads: Number of files to read at the same time. Default - chosen by ThreadPoolExecutor
+           :type threads: int
+
+           :param chunk_size: If not None, files are summarized chunk_size rows at a time with summarize_result_streaming
+           :type chunk_size: int
+
+           :param error: With chunk_size, bound on the rank error of the medians
+           :type error: float
+
+         Returns:
+           :return : Dataframe with simulation parameters and summary statistics of model posterior estimates
+           :rtype: Pandas DataFrame
+    """
+    filelist = list_result_files(dir_list)
+    if len(filelist) == 0:
+        return pd.DataFrame(columns=SUMMARY_COLUMNS)
+    if chunk_size:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(lambda filename: summarize_result_streaming(filename, chunk_size, error), filelist))
+        return pd.concat([df_summary for df_summary, sha256 in results], ignore_index=True)
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(read_result, filelist))
+    ## Each file is summarized separately, even if two files share a comparison name
+    df_results = pd.concat([df_result.assign(file=index) for index, df_result in enumerate(results)], ignore_index=True)
+    return summarize_results(df_results, ['file', 'comparison'])
+
+
+def paired_differences(filelist, parameter, threads=None):
+    """Function to compute the differences of power between scenarios that differ only in one parameter, pairing
+        the features of their outputs row by row. With common random numbers (run_read_count_simul.py --crn) row i
+        of both outputs comes from the same random draws, so the paired standard error is much smaller than the
+        standard error of independent scenarios, which is reported for comparison.
+         Arguments:
+           :param filelist: Paths of the bayesian_out_*.tabular files
+           :type filelist: list
+
+           :param parameter: Parameter that differs, one of PAIRED_PARAMETERS
+           :type parameter: string
+
+           :param threads: Number of files to read at the same time. Default - chosen by ThreadPoolExecutor
+           :type threads: int
+
+         Returns:
+           :return: One row per pair of neighboring values of the parameter, with the difference (b - a) of each
+                proportion in PAIRED_PROPORTIONS and its paired and independent standard errors
+           :rtype: Pandas DataFrame
+    """
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(read_result, filelist))
+    groups = {}
+    for df_result in results:
+        for comparison, df_comparison in df_result.groupby('comparison', sort=False):
+            scenario = comparison.split('_')
+            scenario = list(zip(scenario[::2], scenario[1::2]))
+            key = tuple(pair for pair in scenario if pair[0] != parameter)
+            if len(key) == len(scenario):
+                continue
+            evidence = np.column_stack([df_comparison[EVIDENCE_COLUMNS[prop.split('_LE')[0]]].to_numpy() < float('0.' + prop[-2:])
+                                        for prop in PAIRED_PROPORTIONS]).astype(float)
+            groups.setdefault(key, []).append((float(dict(scenario)[parameter]), comparison, evidence))
+
+    rows = []
+    for key, scenarios in groups.items():
+        scenarios.sort(key=lambda scenario: scenario[0])
+        for (value_a, comparison_a, evidence_a), (value_b, comparison_b, evidence_b) in zip(scenarios[:-1], scenarios[1:]):
+            if evidence_a.shape != evidence_b.shape:
+                print("Skipping " + comparison_a + " and " + comparison_b + ": different numbers of features")
+                continue
+            nfeature = evidence_a.shape[0]
+            difference = evidence_b - evidence_a
+            se_paired = difference.std(axis=0, ddof=1)/np.sqrt(nfeature)
+            se_independent = np.sqrt((evidence_a.var(axis=0, ddof=1) + evidence_b.var(axis=0, ddof=1))/nfeature)
+            row = {'comparison_a': comparison_a, 'comparison_b': comparison_b, parameter + '_a': value_a,
+                   parameter + '_b': value_b, 'nfeature': nfeature}
+            for index, prop in enumerate(PAIRED_PROPORTIONS):
+                row['diff_' + prop] = difference[:, index].mean()
+                row['se_paired_' + prop] = se_paired[index]
+                row['se_independent_' + prop] = se_independent[index]
+            rows.append(row)
+    columns = ['comparison_a', 'comparison_b', parameter + '_a', parameter + '_b', 'nfeature'] + \
+              [stat + prop for prop in PAIRED_PROPORTIONS for stat in ['diff_', 'se_paired_', 'se_independent_']]
+    return pd.DataFrame(rows, columns=columns)
+
+
+def paired_filename(outfile, parameter):
+    """Function to name the file of the paired differences along one parameter
+         Arguments:
+           :param outfile: Summary CSV file
+           :type outfile: string
+
+           :param parameter: Parameter that differs
+           :type parameter: string
+
+         Returns:
+           :return: <outfile without extension>_paired_<parameter>.csv
+           :rtype: string
+    """
+    return os.path.splitext(outfile)[0] + "_paired_" + parameter + ".csv"
+
+
+def read_result_with_hash(filename):
+    """Function to read one output from Bayesian ASE model and compute the SHA-256 hash of its content
+         Arguments:
+           :param filename: Path of a bayesian_out_*.tabular file
+           :type filename: string
+
+         Returns:
+           :return: Dataframe with the columns needed for the summary and hash of the file
+           :rtype: tuple (Pandas DataFrame, string)
+    """
+    print(filename)
+    found = integrity.describe(filename)
+    integrity.verify(filename, found=found)
+    return pd.read_csv(filename, sep="\t", usecols=RESULT_COLUMNS), found["sha256"]
+
+
+def file_hash(filename):
+    """Function to compute the SHA-256 hash of the content of a file
+         Arguments:
+           :param filename: Path of the file
+           :type filename: string
+
+         Returns:
+           :return: Hexadecimal hash
+           :rtype: string
+    """
+    sha256 = hashlib.sha256()
+    with open(filename, "rb") as data:
+        for block in iter(lambda: data.read(1 << 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def compute_prop_hypothesis_cached(dir_list, manifest, threads=None, chunk_size=None, error=streaming_stats.QUANTILE_ERROR):
+    """Function to summarize results of analysis of data with Bayesian model, reusing the summary of files
+        that did not change since the last run. The cache is a CSV manifest with the path, size, modification
+        time and content hash of each file next to its summary row.
+         Arguments:
+           :param dir_list: A list of directories from which to read files
+           :type dir_list: list
+
+           :param manifest: Path of the cache manifest, created if it does not exist
+           :type manifest: string
+
+           :param threads: Number of files to read at the same time. Default - chosen by ThreadPoolExecutor
+           :type threads: int
+
+           :param chunk_size: If not None, files are summarized chunk_size rows at a time with summarize_result_streaming
+           :type chunk_size: int
+
+           :param error: With chunk_size, bound on the rank error of the medians
+           :type error: float
+
+         Returns:
+           :return : Dataframe with the path, size, modification time and hash of each file, simulation parameters
+                and summary statistics of model posterior estimates
+           :rtype: Pandas DataFrame
+    """
+    if os.path.exists(manifest):
+        df_cache = pd.read_csv(manifest, float_precision="round_trip")
+        if not set(MANIFEST_COLUMNS + SUMMARY_COLUMNS).issubset(df_cache.columns):
+            print("Ignoring " + manifest + ", written with other summary columns")
+            df_cache = pd.DataFrame(columns=MANIFEST_COLUMNS + SUMMARY_COLUMNS)
+    else:
+        df_cache = pd.DataFrame(columns=MANIFEST_COLUMNS + SUMMARY_COLUMNS)
+    cached = {path: df_path for path, df_path in df_cache.groupby('path', sort=False)}
+
+    rows = []
+    to_summarize = []
+    for filename in list_result_files(dir_list):
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        df_path = cached.get(path)
+        if df_path is not None:
+            if df_path['size'].iloc[0] == stat.st_size and df_path['mtime_ns'].iloc[0] == stat.st_mtime_ns:
+                rows.append(df_path)
+                continue
+            ## Touched but possibly unchanged: compare the content
+            if df_path['size'].iloc[0] == stat.st_size and df_path['sha256'].iloc[0] == file_hash(path):
+                rows.append(df_path.assign(mtime_ns=stat.st_mtime_ns))
+                continue
+        rows.append(path)
+        to_summarize.append((path, stat))
+
+    print("Summarizing " + str(len(to_summarize)) + " new or changed file(s), reusing " + str(len(rows)-len(to_summarize)))
+    summaries = {}
+    if to_summarize and chunk_size:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(lambda path: summarize_result_streaming(path, chunk_size, error), [path for path, stat in to_summarize]))
+        for (path, stat), (df_summary, sha256) in zip(to_summarize, results):
+            summaries[path] = df_summary.assign(path=path, size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256=sha256)
+    elif to_summarize:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(read_result_with_hash, [path for path, stat in to_summarize]))
+        df_results = pd.concat([df_result.assign(path=path) for (path, stat), (df_result, sha256) in zip(to_summarize, results)],
+                               ignore_index=True)
+        df_new = summarize_results(df_results, ['path', 'comparison'])
+        df_new.insert(0, 'path', df_results.groupby(['path', 'comparison'], sort=False).size().reset_index()['path'])
+        for (path, stat), (df_result, sha256) in zip(to_summarize, results):
+            summaries[path] = df_new[df_new['path'] == path].assign(size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256=sha256)
+
+    ## Rows of deleted files are dropped since only listed files are kept
+    df_manifest = pd.concat([summaries[row] if isinstance(row, str) else row for row in rows] +
+                            [pd.DataFrame(columns=MANIFEST_COLUMNS + SUMMARY_COLUMNS)], ignore_index=True)
+    df_manifest = df_manifest[MANIFEST_COLUMNS + SUMMARY_COLUMNS]
+    df_manifest.to_csv(manifest + ".tmp", index=False)
+    os.replace(manifest + ".tmp", manifest)
+    return df_manifest
+
+
+def main(argv=None):
+    args = getOptions(argv)
+    if args.telemetry:
+        telemetry.enable(args.telemetry)
     if not args.outfile:
         outfile = "posterior_estimates_summary_across_simul.csv"
     else:
         outfile = args.outfile
 
-    df_result.to_csv(outfile, index=False)
+    with telemetry.stage("summarize", {"inputdirs": len(args.inputdirs), "cache": bool(args.cache or args.store)}):
+        if args.cache or args.store:
+            df_manifest = compute_prop_hypothesis_cached(args.inputdirs, outfile + ".manifest.csv", args.threads,
+                                                         args.chunk_size, args.quantile_error)
+            if args.store:
+                scenario_store.record_summaries(args.store, df_manifest)
+                print("Summary rows saved to " + args.store)
+            df_result = df_manifest[SUMMARY_COLUMNS]
+        else:
+            df_result = compute_prop_hypothesis(args.inputdirs, args.threads, args.chunk_size, args.quantile_error)
+
+    with integrity.atomic_path(outfile) as temporary:
+        df_result.to_csv(temporary, index=False)
+
+    for parameter in args.paired or []:
+        with telemetry.stage("summarize_paired", {"inputdirs": len(args.inputdirs), "param": parameter}):
+            df_paired = paired_differences(list_result_files(args.inputdirs), parameter, args.threads)
+        with integrity.atomic_path(paired_filename(outfile, parameter)) as temporary:
+            df_paired.to_csv(temporary, index=False)
+        print(str(df_paired.shape[0]) + " paired differences along " + parameter + " saved to " + paired_filename(outfile, parameter))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import numpy as np
+from tasks import sweep
+from tasks import telemetry
+
+def getOptions():
+    parser = argparse.ArgumentParser(description="Simulate every scenario of a parameter sweep over theta, map bias, dispersion, "
+                                                 "biorep effects, number of bioreps and depth, in broadcast array draws")
+    parser.add_argument(
+        "-c",
+        "--config",
+        action="store",
+        help="INI sweep file with a [sweep] section giving each parameter as a list of values, start:stop:step or lhs low high "
+             "(see example_in/sweep.ini)",
+    )
+    parser.add_argument(
+        "-o",
+        "--outdir",
+        action="store",
+        help="Path to directory where to save the simulated datasets (H1_null and H1_not_null) and sweep_scenarios.csv",
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        action="store",
+        choices=["tsv", "npz"],
+        default="tsv",
+        help="Format of the simulated datasets: 'tsv' or the binary 'npz' format (default: tsv)",
+    )
+    parser.add_argument(
+        "-s",
+        "--sets",
+        action="store",
+        type=int,
+        required=False,
+        help="Optional number of sets of simulations per scenario. Default - sets of the sweep file, or 2",
+    )
+    parser.add_argument(
+        "--seed",
+        action="store",
+        type=int,
+        required=False,
+        help="Optional master seed of the Latin-hypercube sample and of the counts. Default - a random seed that is printed",
+    )
+    parser.add_argument(
+        "-n",
+        "--dry_run",
+        action="store_true",
+        help="Only write the scenarios of the sweep to sweep_scenarios.csv, without simulating them",
+    )
+    parser.add_argument(
+        "--telemetry",
+        action="store",
+        required=False,
+        help="Optional JSON-lines log to which to append the wall time, CPU time, peak memory and I/O of every batch of datasets "
+             "(also switched on by the BAYESASE_TELEMETRY environment variable)",
+    )
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = getOptions()
+    if args.telemetry:
+        telemetry.enable(args.telemetry)
+
+    specs, options = sweep.read_sweep(args.config)
+    sets = args.sets if args.sets else options["sets"]
+    master_seed = np.random.SeedSequence(args.seed)
+    print("Master seed: " + str(master_seed.entropy))
+    rng = np.random.default_rng(np.random.SeedSequence(master_seed.entropy, spawn_key=(0,)))
+    df_scenarios = sweep.expand_sweep(specs, options["lhs_samples"], rng)
+    print(str(df_scenarios.shape[0]) + " scenarios, " + str(df_scenarios.shape[0]*sets) + " datasets")
+
+    os.makedirs(args.outdir, exist_ok=True)
+    scenario_file = os.path.join(args.outdir, "sweep_scenarios.csv")
+    if args.dry_run:
+        df_scenarios.to_csv(scenario_file, index=False)
+    else:
+        df_datasets = sweep.run_sweep(df_scenarios, sets, args.outdir, master_seed.entropy, args.format)
+        df_datasets.to_csv(scenario_file, index=False)
+    print("Scenarios saved to " + scenario_file)
+
+
+if __name__ == "__main__":
+    main()
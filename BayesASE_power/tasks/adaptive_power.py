@@ -0,0 +1,147 @@
+import numpy as np
+import pandas as pd
+from statistics import NormalDist
+from tasks import simulate_nbmodel
+from tasks import approx_nbmodel
+
+## Bayes evidence columns whose proportion below 0.05 is monitored, and the summary column of each proportion
+MONITORED_EVIDENCE = {"prop_H1_LE05": "c1_Bayes_evidence", "prop_H2_LE05": "c2_Bayes_evidence",
+                      "prop_H3_LE05": "H3_independence_Bayes_evidence"}
+
+
+def wilson_interval(successes, n, confidence=0.95):
+    """Function to compute the Wilson score interval of a binomial proportion
+         Arguments:
+           :param successes: Number of features with Bayes evidence below the threshold
+           :type successes: int
+
+           :param n: Number of features
+           :type n: int
+
+           :param confidence: Confidence level of the interval
+           :type confidence: float
+
+         Returns:
+           :return: Lower and upper bounds of the interval
+           :rtype: tuple
+    """
+    if n == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(0.5+confidence/2)
+    p = successes/n
+    center = (p+z*z/(2*n))/(1+z*z/n)
+    half_width = z*np.sqrt(p*(1-p)/n+z*z/(4*n*n))/(1+z*z/n)
+    return max(0.0, center-half_width), min(1.0, center+half_width)
+
+
+def scenario_name(theta1, theta2, nbiorep, n_allele_specific_reads, simruns,
+                  q_test=simulate_nbmodel.Q_TEST, q_line=simulate_nbmodel.Q_LINE):
+    """Function to build the comparison name of a two-condition scenario as merge_simul_conditions.py does
+         Returns:
+           :return: Comparison name, e.g. theta1_0.5_theta2_0.6_rsim-g1_0.8_rsim-g2_0.8_nbiorep_3_allelicreads_960_simruns_5
+           :rtype: string
+    """
+    return "_".join(["theta1", str(theta1), "theta2", str(theta2), "rsim-g1", str(q_test), "rsim-g2", str(q_line),
+                     "nbiorep", str(nbiorep), "allelicreads", str(n_allele_specific_reads), "simruns", str(simruns)])
+
+
+def approx_batch(counts, comparison, phi=simulate_nbmodel.TRUE_PHI):
+    """Function to fit one batch of a scenario with the approximate model of tasks/approx_nbmodel.py
+         Arguments:
+           :param counts: Arrays of shape (batch size, nbiorep, 3) with the counts of conditions c1 and c2
+           :type counts: dictionary
+
+           :param comparison: Name of the comparison
+           :type comparison: string
+
+         Returns:
+           :return: Dataframe with the columns of the bayesian_out_*.tabular files
+           :rtype: Pandas DataFrame
+    """
+    priors = {condition: {"rsim-g1": simulate_nbmodel.Q_TEST, "rsim-g2": simulate_nbmodel.Q_LINE} for condition in counts}
+    return approx_nbmodel.fit_dataset(priors, counts, comparison, phi)
+
+
+def run_adaptive_scenario(theta1, theta2, nbiorep, n_allele_specific_reads, rng, fit_batch=approx_batch,
+                          batch_size=1000, max_features=100000, width=0.02, confidence=0.95, monitored=None):
+    """Function to simulate and fit a two-condition scenario in batches until the confidence interval of every
+        monitored proportion of features with Bayes evidence < 0.05 is narrower than width, or max_features is reached
+         Arguments:
+           :param theta1: Level of allelic imbalance of condition 1, as given in the scenario file
+           :type theta1: string
+
+           :param theta2: Level of allelic imbalance of condition 2, as given in the scenario file
+           :type theta2: string
+
+           :param nbiorep: Number of biological replicates, as given in the scenario file
+           :type nbiorep: string
+
+           :param n_allele_specific_reads: Sum of allele specific reads across all bioreps, as given in the scenario file
+           :type n_allele_specific_reads: string
+
+           :param rng: Random number generator of the scenario
+           :type rng: numpy Generator
+
+           :param fit_batch: Function fitting the counts of one batch, called with the counts and a comparison name
+           :type fit_batch: function
+
+           :param batch_size: Number of features simulated and fit in each batch
+           :type batch_size: int
+
+           :param max_features: Budget cap on the number of features of the scenario
+           :type max_features: int
+
+           :param width: Target width of the confidence intervals
+           :type width: float
+
+           :param confidence: Confidence level of the intervals
+           :type confidence: float
+
+           :param monitored: Proportions (keys of MONITORED_EVIDENCE) whose intervals must reach the target width.
+                Default - all of them.
+           :type monitored: list
+
+         Returns:
+           :return: Fit of all the features used, under the final comparison name, and one summary row with the
+                number of features and batches used, the monitored proportions and their confidence intervals
+           :rtype: tuple (Pandas DataFrame, dictionary)
+    """
+    if batch_size < 1 or max_features < 1:
+        raise ValueError("The batch size and the budget of a scenario must be at least 1 feature, not " +
+                         str(batch_size) + " and " + str(max_features))
+    monitored = monitored if monitored else list(MONITORED_EVIDENCE)
+    nbiorep_int = int(float(nbiorep))
+    n_reads = float(n_allele_specific_reads)
+    results = []
+    successes = {prop: 0 for prop in MONITORED_EVIDENCE}
+    n = 0
+    while True:
+        size = min(batch_size, max_features-n)
+        if size <= 0:
+            stop = "budget"
+            break
+        counts = {"c1": simulate_nbmodel.simulate_read_counts(float(theta1), size, nbiorep_int, n_reads, rng),
+                  "c2": simulate_nbmodel.simulate_read_counts(float(theta2), size, nbiorep_int, n_reads, rng)}
+        df_batch = fit_batch(counts, scenario_name(theta1, theta2, nbiorep, n_allele_specific_reads, size) +
+                             "_batch_" + str(len(results)+1))
+        results.append(df_batch)
+        n += df_batch.shape[0]
+        for prop, column in MONITORED_EVIDENCE.items():
+            successes[prop] += int((df_batch[column] < 0.05).sum())
+        intervals = {prop: wilson_interval(successes[prop], n, confidence) for prop in MONITORED_EVIDENCE}
+        max_width = max(intervals[prop][1]-intervals[prop][0] for prop in monitored)
+        if max_width <= width:
+            stop = "precision"
+            break
+        if n >= max_features:
+            stop = "budget"
+            break
+
+    comparison = scenario_name(theta1, theta2, nbiorep, n_allele_specific_reads, n)
+    df_result = pd.concat(results, ignore_index=True)
+    df_result["comparison"] = comparison
+    summary = {"comparison": comparison, "nfeature": n, "batches": len(results), "stop": stop}
+    for prop in MONITORED_EVIDENCE:
+        summary[prop] = successes[prop]/n
+        summary[prop + "_lower"], summary[prop + "_upper"] = intervals[prop]
+    return df_result, summary
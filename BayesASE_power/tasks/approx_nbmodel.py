@@ -0,0 +1,171 @@
+import numpy as np
+import pandas as pd
+from tasks import simulate_nbmodel
+
+## Grid approximation of the posterior of the NB/AI model fit by nbmodel_stan2.py.
+## For each feature and condition, the biorep effects are profiled out (under the Poisson
+## approximation their estimate is beta_i = n_i/(alpha + 1/alpha), with n_i the total counts of
+## biorep i), the negative binomial likelihood of log(alpha) is evaluated on a grid and combined
+## with a normal prior on log(alpha). All features of a dataset are fit at once, in chunks.
+GRID_SIZE = 401
+GRID_LIMIT = 4.0         ## log(alpha) grid on [-4, 4], i.e. theta in (0.0003, 0.9997)
+PRIOR_SD = 5.0           ## Standard deviation of the normal prior on log(alpha)
+CHUNK_SIZE = 1024        ## Number of features evaluated at once
+
+RESULT_COLUMNS = ["comparison", "FEATURE_ID", "c1_num_reps", "c2_num_reps",
+                  "counts_c1_g1", "counts_c1_g2", "counts_c1_both", "counts_c2_g1", "counts_c2_g2", "counts_c2_both",
+                  "prior_c1_g1", "prior_c1_g2", "prior_c2_g1", "prior_c2_g2", "H3_independence_Bayes_evidence",
+                  "c1_sampleprop", "c1_theta", "c1_q025", "c1_q975", "c1_Bayes_evidence", "c1_AI_decision",
+                  "c2_sampleprop", "c2_theta", "c2_q025", "c2_q975", "c2_Bayes_evidence", "c2_AI_decision",
+                  "alpha1_postmean", "alpha2_postmean", "flaganalyze"]
+
+
+def log_alpha_grid(grid_size=GRID_SIZE, grid_limit=GRID_LIMIT):
+    """Function to create the grid of log(alpha) values on which the posterior is evaluated
+         Returns:
+           :return: Grid of log(alpha) values
+           :rtype: numpy array
+    """
+    return np.linspace(-grid_limit, grid_limit, grid_size)
+
+
+def grid_posterior(counts, q_g1, q_g2, phi=simulate_nbmodel.TRUE_PHI, grid=None, prior_sd=PRIOR_SD, chunk_size=CHUNK_SIZE):
+    """Function to compute the posterior of log(alpha) of every feature of one condition on a grid
+         Arguments:
+           :param counts: Array of shape (nfeature, nbiorep, 3) with the g1, g2 and both counts
+           :type counts: numpy array
+
+           :param q_g1: Probability that a read from allele g1 maps better to g1 (prior_g1)
+           :type q_g1: float
+
+           :param q_g2: Probability that a read from allele g2 maps better to g2 (prior_g2)
+           :type q_g2: float
+
+           :param phi: Negative binomial dispersion parameter
+           :type phi: float
+
+           :param grid: If not None, grid of log(alpha) values
+           :type grid: numpy array
+
+           :param prior_sd: Standard deviation of the normal prior on log(alpha)
+           :type prior_sd: float
+
+           :param chunk_size: Number of features evaluated at once
+           :type chunk_size: int
+
+         Returns:
+           :return: Array of shape (nfeature, grid size) with the posterior probability of each grid point
+           :rtype: numpy array
+    """
+    if grid is None:
+        grid = log_alpha_grid()
+    size = 1/phi
+    alpha = np.exp(grid)
+    ## Relative means of the g1, g2 and both counts for each value of alpha, shape (grid, 3)
+    rel_means = np.stack([q_g1/alpha, q_g2*alpha, (1-q_g1)/alpha+(1-q_g2)*alpha], axis=1)
+    log_prior = -0.5*(grid/prior_sd)**2
+    posterior = np.empty((counts.shape[0], grid.size))
+    for start in range(0, counts.shape[0], chunk_size):
+        k = counts[start:start+chunk_size].astype(float)
+        betas = k.sum(axis=2)[:, np.newaxis, :]/(alpha+1/alpha)[np.newaxis, :, np.newaxis]
+        means = betas[..., np.newaxis]*rel_means[np.newaxis, :, np.newaxis, :]
+        kk = k[:, np.newaxis, :, :]
+        ## Negative binomial log-likelihood, up to terms that do not depend on alpha
+        with np.errstate(divide="ignore", invalid="ignore"):
+            loglik = np.where(kk > 0, kk*np.log(means), 0) - (size+kk)*np.log(size+means)
+        logpost = loglik.sum(axis=(2, 3)) + log_prior
+        logpost -= logpost.max(axis=1, keepdims=True)
+        weights = np.exp(logpost)
+        posterior[start:start+chunk_size] = weights/weights.sum(axis=1, keepdims=True)
+    return posterior
+
+
+def grid_quantile(posterior, values, prob):
+    """Function to compute a quantile of each posterior on the grid by linear interpolation
+         Arguments:
+           :param posterior: Array of shape (nfeature, grid size) with the posterior probability of each grid point
+           :type posterior: numpy array
+
+           :param values: Increasing values of the parameter at each grid point
+           :type values: numpy array
+
+           :param prob: Probability of the quantile
+           :type prob: float
+
+         Returns:
+           :return: Quantile of each feature
+           :rtype: numpy array
+    """
+    cdf = np.cumsum(posterior, axis=1)
+    index = np.clip((cdf < prob).sum(axis=1), 1, values.size-1)
+    rows = np.arange(posterior.shape[0])
+    lower, upper = cdf[rows, index-1], cdf[rows, index]
+    fraction = np.clip((prob-lower)/np.where(upper > lower, upper-lower, 1), 0, 1)
+    return values[index-1] + fraction*(values[index]-values[index-1])
+
+
+def summarize_condition(posterior, grid):
+    """Function to compute the posterior estimates reported by nbmodel_stan2.py for one condition
+         Arguments:
+           :param posterior: Array of shape (nfeature, grid size) with the posterior probability of each grid point
+           :type posterior: numpy array
+
+           :param grid: Grid of log(alpha) values
+           :type grid: numpy array
+
+         Returns:
+           :return: Posterior mean of theta and alpha, 95% credible interval of theta and Bayes evidence of AI
+           :rtype: dictionary
+    """
+    theta = 1/(1+np.exp(2*grid)) ## In the stan2 model, theta = 1/(alpha[i]^2+1)
+    prob_alpha_gt_1 = posterior[:, grid > 0].sum(axis=1) + 0.5*posterior[:, grid == 0].sum(axis=1)
+    ## theta decreases with alpha, so its quantiles are taken on the reversed grid
+    return {"theta": posterior @ theta,
+            "q025": grid_quantile(posterior[:, ::-1], theta[::-1], 0.025),
+            "q975": grid_quantile(posterior[:, ::-1], theta[::-1], 0.975),
+            "Bayes_evidence": 2*np.minimum(prob_alpha_gt_1, 1-prob_alpha_gt_1),
+            "alpha": posterior @ np.exp(grid)}
+
+
+def fit_dataset(priors, counts, comparison, phi=simulate_nbmodel.TRUE_PHI, grid=None, prior_sd=PRIOR_SD, chunk_size=CHUNK_SIZE):
+    """Function to fit the approximate NB/AI model to every feature of a two-condition dataset
+         Arguments:
+           :param priors: Map bias priors (rsim-g1, rsim-g2) of each condition
+           :type priors: dictionary
+
+           :param counts: Arrays of shape (nfeature, nbiorep, 3) with the g1, g2 and both counts of each condition
+           :type counts: dictionary
+
+           :param comparison: Name of the comparison (compID), usually the input filename without extension
+           :type comparison: string
+
+         Returns:
+           :return: Dataframe with the columns of the bayesian_out_*.tabular files of nbmodel_stan2.py
+           :rtype: Pandas DataFrame
+    """
+    if grid is None:
+        grid = log_alpha_grid()
+    result = {"comparison": comparison, "FEATURE_ID": "fusion_id"}
+    posteriors = {}
+    for condition in ["c1", "c2"]:
+        totals = counts[condition].sum(axis=1)
+        result[condition + "_num_reps"] = counts[condition].shape[1]
+        for index, allele in enumerate(["g1", "g2", "both"]):
+            result["counts_{}_{}".format(condition, allele)] = totals[:, index]
+        result["prior_{}_g1".format(condition)] = priors[condition]["rsim-g1"]
+        result["prior_{}_g2".format(condition)] = priors[condition]["rsim-g2"]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            result[condition + "_sampleprop"] = totals[:, 0]/(totals[:, 0]+totals[:, 1])
+        posteriors[condition] = grid_posterior(counts[condition], priors[condition]["rsim-g1"], priors[condition]["rsim-g2"],
+                                               phi, grid, prior_sd, chunk_size)
+        estimates = summarize_condition(posteriors[condition], grid)
+        for name in ["theta", "q025", "q975", "Bayes_evidence"]:
+            result[condition + "_" + name] = estimates[name]
+        result[condition + "_AI_decision"] = (estimates["Bayes_evidence"] < 0.05).astype(int)
+        result["alpha{}_postmean".format(condition[1])] = estimates["alpha"]
+    ## P(alpha1 > alpha2) from the two independent grid posteriors, ties split evenly
+    cdf2 = np.cumsum(posteriors["c2"], axis=1)
+    prob_alpha1_gt_alpha2 = (posteriors["c1"]*(cdf2-0.5*posteriors["c2"])).sum(axis=1)
+    result["H3_independence_Bayes_evidence"] = 2*np.minimum(prob_alpha1_gt_alpha2, 1-prob_alpha1_gt_alpha2)
+    result["flaganalyze"] = simulate_nbmodel.FLAG_ANALYZE
+    return pd.DataFrame(result)[RESULT_COLUMNS].round(4)
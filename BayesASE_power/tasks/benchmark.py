@@ -0,0 +1,202 @@
+import contextlib
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from tasks import approx_nbmodel
+from tasks import telemetry
+
+## Benchmark helpers: each case is timed in a fresh process, so that its peak resident memory is its own,
+## and results are saved as JSON records keyed by stage and parameters to be compared between commits.
+## Peak memory is the maximum resident set size of the process and of the commands it ran.
+SCALES = {
+    "small": {"simruns": [1000, 10000], "nbiorep": [2, 20], "tabular": [100, 1000]},
+    "medium": {"simruns": [1000, 10000, 100000], "nbiorep": [2, 5, 20], "tabular": [100, 1000, 2000]},
+    "large": {"simruns": [1000, 10000, 100000, 1000000], "nbiorep": [2, 5, 20], "tabular": [100, 1000, 5000]},
+}
+COMPARE_COLUMNS = ["stage", "params", "baseline_wall_s", "wall_s", "wall_ratio", "baseline_peak_rss_mb", "peak_rss_mb",
+                   "rss_ratio", "regression"]
+## Smallest change of wall time, in seconds, reported as a regression: shorter cases are within timer noise
+MIN_WALL_DIFFERENCE = 0.05
+## Scenarios of the synthetic bayesian_out_*.tabular files, combined in turn
+SYNTHETIC_THETAS = [("0.5", "0.5"), ("0.5", "0.6"), ("0.5", "0.7"), ("0.6", "0.6"), ("0.7", "0.7"), ("0.5", "0.8")]
+SYNTHETIC_NBIOREP = [2, 3, 4, 5, 6, 8, 10, 20]
+SYNTHETIC_READS_PER_BIOREP = [10, 20, 50, 100, 200, 500, 1000]
+
+
+def environment():
+    """Function to describe the machine and software versions the benchmarks ran with
+         Returns:
+           :return: Date, git commit, Python, numpy and pandas versions, platform and number of cores
+           :rtype: dictionary
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"date": datetime.datetime.now().isoformat(timespec="seconds"), "commit": commit,
+            "python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+            "platform": platform.platform(), "cpu_count": os.cpu_count()}
+
+
+def peak_rss_mb():
+    """Function to read the peak resident memory of the current process and of the commands it ran
+         Returns:
+           :return: Peak resident set size in MB
+           :rtype: float
+    """
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    children = children//1024 if sys.platform == "darwin" else children ## ru_maxrss is in bytes on macOS and in kB on Linux
+    return max(telemetry.peak_rss_kb(), children)*1024/1e6
+
+
+def timed_call(function, args):
+    """Function to run a benchmark case once, without printing its messages
+         Arguments:
+           :param function: Function of the stage
+           :type function: function
+
+           :param args: Arguments of the function
+           :type args: tuple
+
+         Returns:
+           :return: Wall time in seconds, peak resident memory before the call (interpreter and modules) and
+                after the call, in MB
+           :rtype: tuple (float, float, float)
+    """
+    baseline = peak_rss_mb()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        function(*args)
+        wall = time.perf_counter()-start
+    return wall, baseline, peak_rss_mb()
+
+
+def measure(function, args, repeat=3):
+    """Function to time a benchmark case, each repetition in a new process
+         Arguments:
+           :param function: Function of the stage, importable by a new process
+           :type function: function
+
+           :param args: Arguments of the function, picklable
+           :type args: tuple
+
+           :param repeat: Number of repetitions
+           :type repeat: int
+
+         Returns:
+           :return: Wall time of each repetition, their minimum and median, and the peak resident memory
+           :rtype: dictionary
+    """
+    walls, baselines, peaks = [], [], []
+    for i in range(repeat):
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            wall, baseline, peak = executor.submit(timed_call, function, args).result()
+        walls.append(wall)
+        baselines.append(baseline)
+        peaks.append(peak)
+    return {"wall_s": [round(wall, 4) for wall in walls], "wall_s_min": round(min(walls), 4),
+            "wall_s_median": round(float(np.median(walls)), 4), "baseline_rss_mb": round(max(baselines), 1),
+            "peak_rss_mb": round(max(peaks), 1)}
+
+
+def synthetic_results(outdir, nfile, nfeature, seed=1):
+    """Function to write bayesian_out_*.tabular files with random estimates over a range of scenarios.
+        Scenarios repeat every len(SYNTHETIC_THETAS)*len(SYNTHETIC_NBIOREP)*len(SYNTHETIC_READS_PER_BIOREP)
+        files, as merged replicates with sets_1-<n>.
+         Arguments:
+           :param outdir: Directory of the files, created if needed
+           :type outdir: string
+
+           :param nfile: Number of files
+           :type nfile: int
+
+           :param nfeature: Number of features (rows) per file
+           :type nfeature: int
+
+           :param seed: Seed of the random estimates
+           :type seed: int
+
+         Returns:
+           :return: Names of the files written
+           :rtype: list
+    """
+    os.makedirs(outdir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    values = pd.DataFrame(rng.uniform(size=(nfeature, len(approx_nbmodel.RESULT_COLUMNS)-2)).round(4),
+                          columns=approx_nbmodel.RESULT_COLUMNS[2:])
+    values.insert(0, "FEATURE_ID", "fusion_id")
+    buffer = io.StringIO()
+    values.to_csv(buffer, index=False, header=False, sep="\t")
+    rows = buffer.getvalue().splitlines()
+    header = "\t".join(approx_nbmodel.RESULT_COLUMNS) + "\n"
+    nscenario = len(SYNTHETIC_THETAS)*len(SYNTHETIC_NBIOREP)*len(SYNTHETIC_READS_PER_BIOREP)
+    written = []
+    for index in range(nfile):
+        theta1, theta2 = SYNTHETIC_THETAS[index % len(SYNTHETIC_THETAS)]
+        nbiorep = SYNTHETIC_NBIOREP[index//len(SYNTHETIC_THETAS) % len(SYNTHETIC_NBIOREP)]
+        reads = SYNTHETIC_READS_PER_BIOREP[index//(len(SYNTHETIC_THETAS)*len(SYNTHETIC_NBIOREP)) % len(SYNTHETIC_READS_PER_BIOREP)]
+        comparison = "theta1_{}_theta2_{}_rsim-g1_0.8_rsim-g2_0.8_nbiorep_{}_allelicreads_{}_simruns_{}_sets_1-{}".format(
+                     theta1, theta2, nbiorep, nbiorep*reads, nfeature, index//nscenario+2)
+        outfile = os.path.join(outdir, "bayesian_out_" + comparison + ".tabular")
+        with open(outfile, "w") as output:
+            output.write(header)
+            output.write("".join(comparison + "\t" + row + "\n" for row in rows))
+        written.append(outfile)
+    return written
+
+
+def result_key(result):
+    """Function to identify a benchmark case across result files
+         Arguments:
+           :param result: Result record with its stage and parameters
+           :type result: dictionary
+
+         Returns:
+           :return: Stage and parameters serialized with sorted keys
+           :rtype: string
+    """
+    return result["stage"] + " " + json.dumps(result["params"], sort_keys=True)
+
+
+def compare_results(baseline, current, threshold=1.2):
+    """Function to compare two benchmark result files case by case
+         Arguments:
+           :param baseline: Results of the reference commit, as saved by the benchmark script
+           :type baseline: dictionary
+
+           :param current: Results to compare with the reference
+           :type current: dictionary
+
+           :param threshold: Ratio of the minimum wall time (if longer by more than MIN_WALL_DIFFERENCE) or of the
+                peak memory above which a case is a regression
+           :type threshold: float
+
+         Returns:
+           :return: One row per case present in both files, with the ratios current/baseline
+           :rtype: Pandas DataFrame
+    """
+    reference = {result_key(result): result for result in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        old = reference.get(result_key(result))
+        if old is None:
+            continue
+        wall_ratio = result["wall_s_min"]/old["wall_s_min"] if old["wall_s_min"] > 0 else np.nan
+        rss_ratio = result["peak_rss_mb"]/old["peak_rss_mb"] if old["peak_rss_mb"] > 0 else np.nan
+        rows.append({"stage": result["stage"], "params": json.dumps(result["params"], sort_keys=True),
+                     "baseline_wall_s": old["wall_s_min"], "wall_s": result["wall_s_min"], "wall_ratio": round(wall_ratio, 3),
+                     "baseline_peak_rss_mb": old["peak_rss_mb"], "peak_rss_mb": result["peak_rss_mb"],
+                     "rss_ratio": round(rss_ratio, 3), "regression": bool((wall_ratio > threshold and result["wall_s_min"]-old["wall_s_min"] > MIN_WALL_DIFFERENCE)
+                                                     or rss_ratio > threshold)})
+    return pd.DataFrame(rows, columns=COMPARE_COLUMNS)
@@ -0,0 +1,289 @@
+import contextlib
+import json
+import zipfile
+import io
+import numpy as np
+import pandas as pd
+from tasks import integrity
+from tasks import simulate_nbmodel
+
+## Simulated datasets can be stored as uncompressed .npz files: one int32 array of shape
+## (simruns, nbiorep, 3) with the g1, g2 and both counts per condition ("counts_c1", "counts_c2")
+## and a small JSON header with the parameters used to simulate each condition and the number of features
+## ("rows"), checked when the file is read. The CRC-32 of each array in the archive is checked by numpy.
+FORMAT_NAME = "BayesASE_power counts"
+FORMAT_VERSION = 1
+SCENARIO_KEYS = ["theta", "rsim-g1", "rsim-g2", "nbiorep", "allelicreads", "simruns"]
+## Parameters of the model written to the header only when they are not the defaults of the R simulator
+EXTENDED_KEYS = ["phi", "biorepsd"]
+
+
+def scenario_header(theta, simruns, nbiorep, n_allele_specific_reads, q_test=simulate_nbmodel.Q_TEST, q_line=simulate_nbmodel.Q_LINE,
+                    phi=simulate_nbmodel.TRUE_PHI, biorep_sd=simulate_nbmodel.BIOREP_SD):
+    """Function to create the header of a simulated dataset for one condition
+         Arguments:
+           :param theta: Level of allelic imbalance, as given in the design file
+           :type theta: string
+
+           :param simruns: Number of simulated features, as given in the design file
+           :type simruns: string
+
+           :param nbiorep: Number of biological replicates, as given in the design file
+           :type nbiorep: string
+
+           :param n_allele_specific_reads: Sum of allele specific reads across all bioreps, as given in the design file
+           :type n_allele_specific_reads: string
+
+           :param phi: Negative binomial dispersion parameter, saved only with biorep_sd if one is not the default
+           :type phi: string
+
+           :param biorep_sd: Standard deviation of the log biorep effects
+           :type biorep_sd: string
+
+         Returns:
+           :return: Header with the simulation parameters of condition c1
+           :rtype: dictionary
+    """
+    parameters = [theta, q_test, q_line, nbiorep, n_allele_specific_reads, simruns]
+    condition = {key: str(value) for key, value in zip(SCENARIO_KEYS, parameters)}
+    if simulate_nbmodel.scenario_suffix(phi, biorep_sd):
+        condition.update({"phi": str(phi), "biorepsd": str(biorep_sd)})
+    return {"format": FORMAT_NAME, "version": FORMAT_VERSION, "conditions": {"c1": condition}}
+
+
+def write_counts(outfile, header, counts):
+    """Function to save simulated counts in the binary format
+         Arguments:
+           :param outfile: Output filename, ending in .npz
+           :type outfile: string
+
+           :param header: Header with the simulation parameters of each condition
+           :type header: dictionary
+
+           :param counts: Arrays of shape (simruns, nbiorep, 3) with the g1, g2 and both counts of each condition
+           :type counts: dictionary
+    """
+    arrays = {"counts_" + condition: np.asarray(counts[condition], dtype=np.int32) for condition in header["conditions"]}
+    header = dict(header, rows=int(next(iter(arrays.values())).shape[0]))
+    with integrity.atomic_path(outfile) as temporary:
+        with open(temporary, "wb") as output:
+            np.savez(output, header=np.array(json.dumps(header)), **arrays)
+
+
+@contextlib.contextmanager
+def counts_entry(output, header, simruns, nbiorep):
+    """Function to start the npz (zip) archive of the counts of one condition in an open file, and give the counts
+        entry to write the int32 bytes of the features to, in order. The archive is the one write_counts would write
+        once the entry and the archive are closed.
+         Arguments:
+           :param output: File opened for writing in binary mode
+           :type output: file
+
+           :param header: Header with the simulation parameters of condition c1
+           :type header: dictionary
+
+           :param simruns: Total number of features that will be written
+           :type simruns: int
+
+           :param nbiorep: Number of biological replicates
+           :type nbiorep: int
+
+         Returns:
+           :return: Entry of the counts array, after its .npy header
+           :rtype: file
+    """
+    header = dict(header, rows=int(simruns))
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+        with archive.open("header.npy", "w") as entry:
+            np.lib.format.write_array(entry, np.array(json.dumps(header)))
+        with archive.open("counts_c1.npy", "w", force_zip64=True) as entry:
+            np.lib.format.write_array_header_1_0(entry, {"descr": np.lib.format.dtype_to_descr(np.dtype(np.int32)),
+                                                         "fortran_order": False, "shape": (simruns, nbiorep, 3)})
+            yield entry
+
+
+def write_counts_chunks(outfile, header, chunks, simruns, nbiorep):
+    """Function to save the simulated counts of one condition in the binary format, one chunk at a time.
+        The file is the one write_counts would write, built entry by entry in the npz (zip) archive.
+         Arguments:
+           :param outfile: Output filename, ending in .npz
+           :type outfile: string
+
+           :param header: Header with the simulation parameters of condition c1
+           :type header: dictionary
+
+           :param chunks: Arrays of shape (n, nbiorep, 3) with the g1, g2 and both counts, e.g. from
+                simulate_nbmodel.iter_read_counts
+           :type chunks: iterable
+
+           :param simruns: Total number of features of the chunks
+           :type simruns: int
+
+           :param nbiorep: Number of biological replicates
+           :type nbiorep: int
+    """
+    with integrity.atomic_path(outfile) as temporary:
+        with open(temporary, "wb") as output, counts_entry(output, header, simruns, nbiorep) as entry:
+            written = 0
+            for counts in chunks:
+                entry.write(np.ascontiguousarray(counts, dtype=np.int32).tobytes())
+                written += counts.shape[0]
+        if written != simruns:
+            raise ValueError(outfile + ": " + str(written) + " features written instead of " + str(simruns))
+
+
+def read_counts(infile, mmap_mode=None):
+    """Function to read simulated counts saved in the binary format
+         Arguments:
+           :param infile: Filename ending in .npz
+           :type infile: string
+
+           :param mmap_mode: If not None, passed to numpy.load
+           :type mmap_mode: string
+
+         Returns:
+           :return: Header with the simulation parameters of each condition and
+                arrays of shape (simruns, nbiorep, 3) with the counts of each condition
+           :rtype: tuple (dictionary, dictionary)
+    """
+    with np.load(infile, mmap_mode=mmap_mode) as data:
+        header = json.loads(str(data["header"]))
+        if header.get("format") != FORMAT_NAME:
+            raise ValueError(infile + " is not a simulated read count dataset")
+        counts = {condition: data["counts_" + condition] for condition in header["conditions"]}
+    for condition, array in counts.items():
+        if "rows" in header and array.shape[0] != header["rows"]:
+            raise ValueError(infile + ": " + str(array.shape[0]) + " features of " + condition + " instead of " + str(header["rows"]))
+    return header, counts
+
+
+def read_header(infile):
+    """Function to read only the header of a simulated dataset saved in the binary format
+         Arguments:
+           :param infile: Filename ending in .npz
+           :type infile: string
+
+         Returns:
+           :return: Header with the simulation parameters of each condition
+           :rtype: dictionary
+    """
+    with np.load(infile) as data:
+        header = json.loads(str(data["header"]))
+    if header.get("format") != FORMAT_NAME:
+        raise ValueError(infile + " is not a simulated read count dataset")
+    return header
+
+
+def write_tsv(outfile, header, counts):
+    """Function to write counts of one or more conditions in the TSV layout, without building a dataframe
+         Arguments:
+           :param outfile: Output TSV filename
+           :type outfile: string
+
+           :param header: Header with the simulation parameters of each condition
+           :type header: dictionary
+
+           :param counts: Arrays of shape (simruns, nbiorep, 3) with the g1, g2 and both counts of each condition
+           :type counts: dictionary
+    """
+    columns = ["FEATURE_ID"]
+    row_format = ["fusion_id"]
+    arrays = []
+    for condition, parameters in header["conditions"].items():
+        simruns, nbiorep = counts[condition].shape[0], counts[condition].shape[1]
+        columns.extend(simulate_nbmodel.count_column_names(nbiorep, condition)[1:])
+        ## Priors are written as pandas writes floats, as in the TSV files merged by pandas
+        row_format.extend([str(nbiorep)] + ["%d"]*(nbiorep*3) +
+                          [str(float(parameters["rsim-g1"])), str(float(parameters["rsim-g2"])), str(simulate_nbmodel.FLAG_ANALYZE)])
+        arrays.append(np.asarray(counts[condition]).reshape(simruns, nbiorep*3))
+    with integrity.atomic_path(outfile) as temporary:
+        with open(temporary, "w") as output:
+            output.write("\t".join(columns) + "\n")
+            if arrays[0].shape[0] > 0:
+                np.savetxt(output, np.concatenate(arrays, axis=1), fmt="\t".join(row_format))
+
+
+def counts_to_frame(header, counts):
+    """Function to convert simulated counts to the table layout of the TSV datasets
+         Arguments:
+           :param header: Header with the simulation parameters of each condition
+           :type header: dictionary
+
+           :param counts: Arrays of shape (simruns, nbiorep, 3) with the g1, g2 and both counts of each condition
+           :type counts: dictionary
+
+         Returns:
+           :return: Dataframe with the columns of the TSV written by the simulator (and merged by merge_simul_conditions.py)
+           :rtype: Pandas DataFrame
+    """
+    frames = []
+    for condition, parameters in header["conditions"].items():
+        simruns, nbiorep = counts[condition].shape[0], counts[condition].shape[1]
+        columns = simulate_nbmodel.count_column_names(nbiorep, condition)
+        df_condition = pd.DataFrame(counts[condition].reshape(simruns, nbiorep*3), columns=columns[2:-3])
+        df_condition.insert(0, columns[1], nbiorep)
+        if not frames:
+            df_condition.insert(0, "FEATURE_ID", "fusion_id")
+        df_condition[columns[-3]] = float(parameters["rsim-g1"])
+        df_condition[columns[-2]] = float(parameters["rsim-g2"])
+        df_condition[columns[-1]] = simulate_nbmodel.FLAG_ANALYZE
+        frames.append(df_condition)
+    return pd.concat(frames, axis=1)
+
+
+def export_tsv(infile, outfile):
+    """Function to convert a dataset in the binary format to the TSV read by nbmodel_stan2.py
+         Arguments:
+           :param infile: Filename ending in .npz
+           :type infile: string
+
+           :param outfile: Output TSV filename
+           :type outfile: string
+    """
+    header, counts = read_counts(infile)
+    write_tsv(outfile, header, counts)
+
+
+def frame_to_counts(df_counts):
+    """Function to extract the counts and priors of each condition from a dataset in the TSV layout
+         Arguments:
+           :param df_counts: Simulated or merged dataset
+           :type df_counts: Pandas DataFrame
+
+         Returns:
+           :return: Map bias priors (rsim-g1, rsim-g2) of each condition and
+                arrays of shape (nfeature, nbiorep, 3) with the g1, g2 and both counts of each condition
+           :rtype: tuple (dictionary, dictionary)
+    """
+    priors = {}
+    counts = {}
+    for condition in ["c1", "c2"]:
+        if condition + "_num_reps" not in df_counts.columns:
+            continue
+        nbiorep = int(df_counts[condition + "_num_reps"].iloc[0])
+        columns = simulate_nbmodel.count_column_names(nbiorep, condition)
+        counts[condition] = df_counts[columns[2:-3]].to_numpy(dtype=np.int64).reshape(-1, nbiorep, 3)
+        priors[condition] = {"rsim-g1": float(df_counts[columns[-3]].iloc[0]), "rsim-g2": float(df_counts[columns[-2]].iloc[0])}
+    return priors, counts
+
+
+def load_counts(infile):
+    """Function to read the counts of a simulated or merged dataset saved either as TSV or npz
+         Arguments:
+           :param infile: Filename ending in .tsv or .npz
+           :type infile: string
+
+         Returns:
+           :return: Map bias priors (rsim-g1, rsim-g2) of each condition and
+                arrays of shape (nfeature, nbiorep, 3) with the g1, g2 and both counts of each condition
+           :rtype: tuple (dictionary, dictionary)
+    """
+    if infile.endswith(".npz"):
+        header, counts = read_counts(infile)
+        priors = {condition: {key: float(parameters[key]) for key in ["rsim-g1", "rsim-g2"]}
+                  for condition, parameters in header["conditions"].items()}
+        return priors, counts
+    with open(infile, "rb") as data:
+        content = data.read()
+    integrity.verify(infile, content)
+    return frame_to_counts(pd.read_csv(io.BytesIO(content), sep="\t"))
@@ -0,0 +1,177 @@
+import numpy as np
+from tasks import adaptive_power
+from tasks import telemetry
+
+## Design search: for each number of bioreps, the smallest read depth per biorep that reaches the target
+## power with an acceptable Type I error is found by bisection on a grid of depths. Feasibility is assumed
+## to be monotone in read depth. Each design point is evaluated with the adaptive simulate/fit loop of
+## tasks/adaptive_power.py, once under the alternative (power) and once under the null (Type I error). A point is
+## feasible when the lower bound of its power reaches the target and the upper bound of its Type I error is
+## acceptable: the point estimates alone jump across the thresholds with the simulation noise, which would
+## break the bisection.
+NULL_THETA = 0.5
+SEARCH_COLUMNS = ["step", "nbiorep", "reads_per_biorep", "n_allele_specific_reads", "cost", "power", "power_lower",
+                  "power_upper", "type_I_error", "type_I_error_lower", "type_I_error_upper", "nfeature", "feasible"]
+
+
+def scenario_thetas(hypothesis, delta_AI, theta1=NULL_THETA):
+    """Function to compute the levels of AI of the two conditions under the alternative and under the null
+         Arguments:
+           :param hypothesis: 'H1' (AI in condition 1) or 'H3' (difference of AI between conditions)
+           :type hypothesis: string
+
+           :param delta_AI: Effect size as in summarize_posterior_estimates.py: |theta1 - 0.5|/0.5 for H1 and
+                |theta2 - theta1|/theta1 for H3
+           :type delta_AI: float
+
+           :param theta1: Level of AI of condition 1 for H3
+           :type theta1: float
+
+         Returns:
+           :return: (theta1, theta2) under the alternative and (theta1, theta2) under the null
+           :rtype: tuple (tuple, tuple)
+    """
+    if hypothesis == "H1":
+        theta = NULL_THETA*(1-delta_AI)
+        alternative, null = (theta, theta), (NULL_THETA, NULL_THETA)
+    else:
+        alternative, null = (theta1, theta1*(1+delta_AI)), (theta1, theta1)
+    for theta in alternative+null:
+        if not 0 < theta < 1:
+            raise ValueError("delta_AI " + str(delta_AI) + " gives a level of AI outside (0, 1)")
+    return alternative, null
+
+
+def design_cost(nbiorep, reads_per_biorep, cost_biorep, cost_read):
+    """Function to compute the cost of a design
+         Arguments:
+           :param nbiorep: Number of biological replicates per condition
+           :type nbiorep: int
+
+           :param reads_per_biorep: Number of allele specific reads per biorep
+           :type reads_per_biorep: int
+
+           :param cost_biorep: Cost of one biological replicate (library)
+           :type cost_biorep: float
+
+           :param cost_read: Cost of one allele specific read
+           :type cost_read: float
+
+         Returns:
+           :return: Cost of the design
+           :rtype: float
+    """
+    return round(nbiorep*(cost_biorep + reads_per_biorep*cost_read), 6)
+
+
+def point_seed(entropy, nbiorep, reads_per_biorep):
+    """Function to derive the seeds of a design point from the master seed, independently of the search order
+         Returns:
+           :return: Seed sequences of the alternative and null scenarios
+           :rtype: list
+    """
+    return np.random.SeedSequence(entropy, spawn_key=(nbiorep, reads_per_biorep)).spawn(2)
+
+
+def evaluate_design(nbiorep, reads_per_biorep, hypothesis, thetas, entropy, target_power, max_type_I_error,
+                    fit_batch=adaptive_power.approx_batch, batch_size=1000, max_features=20000, width=0.02,
+                    confidence=0.95):
+    """Function to estimate the power and Type I error of a design point
+         Arguments:
+           :param nbiorep: Number of biological replicates per condition
+           :type nbiorep: int
+
+           :param reads_per_biorep: Number of allele specific reads per biorep
+           :type reads_per_biorep: int
+
+           :param hypothesis: 'H1' or 'H3'
+           :type hypothesis: string
+
+           :param thetas: (theta1, theta2) under the alternative and under the null, from scenario_thetas
+           :type thetas: tuple
+
+           :param entropy: Master seed of the search
+           :type entropy: int
+
+           :param target_power: Power that the lower bound of the power must reach
+           :type target_power: float
+
+           :param max_type_I_error: Highest acceptable upper bound of the Type I error
+           :type max_type_I_error: float
+
+         Returns:
+           :return: Search path row of the design point, and the fits of the alternative and null scenarios
+           :rtype: tuple (dictionary, list)
+    """
+    prop = "prop_" + hypothesis + "_LE05"
+    n_reads = str(nbiorep*reads_per_biorep)
+    row = {"nbiorep": nbiorep, "reads_per_biorep": reads_per_biorep, "n_allele_specific_reads": int(n_reads), "nfeature": 0}
+    results = []
+    for name, (theta1, theta2), seed in zip(["power", "type_I_error"], thetas, point_seed(entropy, nbiorep, reads_per_biorep)):
+        params = {"theta1": "{:g}".format(theta1), "theta2": "{:g}".format(theta2), "nbiorep": str(nbiorep), "allelicreads": n_reads}
+        with telemetry.stage("adaptive_scenario", params):
+            df_result, summary = adaptive_power.run_adaptive_scenario(
+                    params["theta1"], params["theta2"], params["nbiorep"], n_reads, np.random.default_rng(seed),
+                    fit_batch, batch_size, max_features, width, confidence, [prop])
+        row[name], row[name + "_lower"], row[name + "_upper"] = summary[prop], summary[prop + "_lower"], summary[prop + "_upper"]
+        row["nfeature"] += summary["nfeature"]
+        results.append(df_result)
+    row["feasible"] = bool(row["power_lower"] >= target_power and row["type_I_error_upper"] <= max_type_I_error)
+    return row, results
+
+
+def search_designs(evaluate, nbiorep_range, reads_range, reads_step, cost):
+    """Function to find the cheapest feasible design by bisection on read depth for each number of bioreps
+         Arguments:
+           :param evaluate: Function of (nbiorep, reads_per_biorep) returning the search path row of the design point
+           :type evaluate: function
+
+           :param nbiorep_range: Smallest and largest number of bioreps
+           :type nbiorep_range: tuple
+
+           :param reads_range: Smallest and largest number of allele specific reads per biorep
+           :type reads_range: tuple
+
+           :param reads_step: Resolution of the read depth search
+           :type reads_step: int
+
+           :param cost: Function of (nbiorep, reads_per_biorep) returning the cost of the design
+           :type cost: function
+
+         Returns:
+           :return: Search path (one row per evaluated design point, in evaluation order) and the cheapest
+                feasible row, or None if no design in the ranges is feasible
+           :rtype: tuple (list, dictionary)
+    """
+    path = []
+    best = None
+
+    def visit(nbiorep, reads_per_biorep):
+        row = evaluate(nbiorep, reads_per_biorep)
+        row["step"] = len(path)+1
+        row["cost"] = cost(nbiorep, reads_per_biorep)
+        path.append(row)
+        return row
+
+    depths = list(range(reads_range[0], reads_range[1]+1, reads_step))
+    for nbiorep in range(nbiorep_range[0], nbiorep_range[1]+1):
+        ## Depths that cannot beat the best design so far are not evaluated
+        candidates = [reads for reads in depths if best is None or cost(nbiorep, reads) < best["cost"]]
+        if not candidates:
+            break ## Cost increases with nbiorep, so no larger design can be cheaper
+        row = visit(nbiorep, candidates[-1])
+        if not row["feasible"]:
+            continue
+        ## Bisection between an infeasible depth (low, -1 stands for the depth below the range) and a feasible one (high)
+        found = row
+        low, high = -1, len(candidates)-1
+        while high-low > 1:
+            middle = (low+high)//2
+            row = visit(nbiorep, candidates[middle])
+            if row["feasible"]:
+                found, high = row, middle
+            else:
+                low = middle
+        if best is None or found["cost"] < best["cost"]:
+            best = found
+    return path, best
@@ -0,0 +1,168 @@
+import contextlib
+import hashlib
+import json
+import os
+import socket
+
+## Outputs are written to a hidden temporary file next to their final path and renamed when complete, so that
+## a job killed partway through never leaves a truncated file under the final name. Each output gets a
+## <outfile>.check file with its size, number of lines and SHA-256 hash, which the stages reading it verify.
+## The check file is written before the output is renamed: if the job is killed in between, the previous
+## output no longer matches its check file and is reported instead of being used. Files without a check file
+## (e.g. written by an earlier version or by hand) are read without verification.
+CHECK_SUFFIX = ".check"
+
+
+def check_path(path):
+    """Function to name the check file of an output
+         Arguments:
+           :param path: Output file
+           :type path: string
+
+         Returns:
+           :return: <path>.check
+           :rtype: string
+    """
+    return path + CHECK_SUFFIX
+
+
+def temporary_path(path):
+    """Function to name the hidden temporary file of an output, unique to the process writing it, on any host
+         Arguments:
+           :param path: Output file
+           :type path: string
+
+         Returns:
+           :return: <folder>/.<filename>.<host>_<pid>.tmp
+           :rtype: string
+    """
+    return os.path.join(os.path.dirname(path), "." + os.path.basename(path) + "." + socket.gethostname() + "_" + str(os.getpid()) + ".tmp")
+
+
+def describe(path=None, content=None):
+    """Function to compute the size, number of lines and SHA-256 hash of a file or of its content
+         Arguments:
+           :param path: File to read, if content is None
+           :type path: string
+
+           :param content: Content of the file, if already read
+           :type content: bytes
+
+         Returns:
+           :return: 'bytes', 'lines' and 'sha256'
+           :rtype: dictionary
+    """
+    sha256, size, lines = hashlib.sha256(), 0, 0
+    if content is not None:
+        blocks = [content]
+    else:
+        data = open(path, "rb")
+        blocks = iter(lambda: data.read(1 << 20), b"")
+    try:
+        for block in blocks:
+            sha256.update(block)
+            size += len(block)
+            lines += block.count(b"\n")
+    finally:
+        if content is None:
+            data.close()
+    return {"bytes": size, "lines": lines, "sha256": sha256.hexdigest()}
+
+
+def replace_file(path, content):
+    """Function to replace a small file in a single step
+         Arguments:
+           :param path: File to write
+           :type path: string
+
+           :param content: Content of the file
+           :type content: string
+    """
+    temporary = temporary_path(path)
+    with open(temporary, "w") as output:
+        output.write(content)
+    os.replace(temporary, path)
+
+
+def publish(temporary, path):
+    """Function to move a complete file to its final path, after writing its check file
+         Arguments:
+           :param temporary: Complete file, on the same filesystem as path
+           :type temporary: string
+
+           :param path: Final path
+           :type path: string
+    """
+    with open(temporary, "rb") as data:
+        os.fsync(data.fileno())
+    replace_file(check_path(path), json.dumps(describe(temporary), sort_keys=True) + "\n")
+    os.replace(temporary, path)
+
+
+@contextlib.contextmanager
+def atomic_path(path):
+    """Function to write an output under a temporary name, published with its check file if the block succeeds,
+        e.g. with integrity.atomic_path(outfile) as temporary: df.to_csv(temporary)
+         Arguments:
+           :param path: Final path of the output
+           :type path: string
+
+         Returns:
+           :return: Temporary path to write to
+           :rtype: string
+    """
+    temporary = temporary_path(path)
+    try:
+        yield temporary
+        publish(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def verify(path, content=None, found=None):
+    """Function to check an input against its check file
+         Arguments:
+           :param path: Input file
+           :type path: string
+
+           :param content: Content of the file, if already read
+           :type content: bytes
+
+           :param found: Size, number of lines and hash of the file, if already computed with describe
+           :type found: dictionary
+
+         Returns:
+           :return: True if the file matches its check file, False if it has none. A file that does not match
+                raises a ValueError.
+           :rtype: bool
+    """
+    try:
+        with open(check_path(path)) as check:
+            expected = json.load(check)
+    except FileNotFoundError:
+        return False
+    if found is not None:
+        size = found["bytes"]
+    else:
+        size = len(content) if content is not None else os.path.getsize(path)
+    if size != expected["bytes"]:
+        raise ValueError(path + " has " + str(size) + " bytes instead of the " + str(expected["bytes"]) + " recorded in " +
+                         check_path(path) + ": it is incomplete or was modified, write it again")
+    if found is None:
+        found = describe(path, content)
+    if found != expected:
+        raise ValueError(path + " does not match " + check_path(path) + " (" + str(found["lines"]) + " lines instead of " +
+                         str(expected["lines"]) + ", or a different content): write it again")
+    return True
+
+
+def remove(path):
+    """Function to remove an output and its check file, if they exist
+         Arguments:
+           :param path: Output file
+           :type path: string
+    """
+    for filename in [path, check_path(path)]:
+        if os.path.exists(filename):
+            os.remove(filename)
@@ -0,0 +1,300 @@
+import fnmatch
+import os
+import re
+import zlib
+import numpy as np
+import pandas as pd
+from tasks import count_store
+from tasks import integrity
+from tasks import simulate_nbmodel
+from tasks import telemetry
+
+## Catalog of the single-condition datasets written by run_read_count_simul.py, one row per file, with the
+## scenario parameters as strings (as they appear in the filenames) and the set number. Two datasets can be
+## merged when they share SHARED_KEYS; the merged dataset goes to the H1_<>_H2_<>_H3_<> folder given by the
+## two levels of AI.
+DATASET_PATTERN = re.compile(r"^out_set_(?P<set>\d+)_theta_(?P<theta>[^_]+)_rsim-g1_(?P<g1>[^_]+)_rsim-g2_(?P<g2>[^_]+)"
+                             r"_nbiorep_(?P<nbiorep>[^_]+)_allelicreads_(?P<allelicreads>[^_]+)_simruns_(?P<simruns>[^_]+)"
+                             r"(?:_phi_(?P<phi>[^_]+)_biorepsd_(?P<biorepsd>[^_]+))?\.(?P<format>tsv|npz)$")
+MERGED_DIR_PATTERN = "H1_*_H2_*_H3_*"
+SHARED_KEYS = ["rsim-g1", "rsim-g2", "nbiorep", "allelicreads", "simruns", "phi", "biorepsd", "format"]
+## Values of phi and biorepsd of datasets whose names leave them out
+EXTENDED_DEFAULTS = {"phi": str(simulate_nbmodel.TRUE_PHI), "biorepsd": str(simulate_nbmodel.BIOREP_SD)}
+NULL_THETA = 0.5
+SOURCE_COLUMNS = ["outfile", "path_c1", "path_c2", "set_c1", "set_c2", "resample"]
+
+
+def build_catalog(inputdir, file_format=None):
+    """Function to list every simulated single-condition dataset under a directory with its scenario parameters.
+        Parameters are parsed from the filename, or from the header of npz files.
+         Arguments:
+           :param inputdir: Parent directory of the simulated datasets (e.g. with H1_null/ and H1_not_null/)
+           :type inputdir: string
+
+           :param file_format: If not None, only datasets in this format ('tsv' or 'npz') are listed
+           :type file_format: string
+
+         Returns:
+           :return: Catalog with the path, set, theta and SHARED_KEYS of each dataset
+           :rtype: Pandas DataFrame
+    """
+    rows = []
+    for root, dirs, files in os.walk(inputdir):
+        ## Merged datasets are outputs, not inputs
+        dirs[:] = sorted(dir for dir in dirs if not fnmatch.fnmatch(dir, MERGED_DIR_PATTERN))
+        for filename in sorted(files):
+            match = DATASET_PATTERN.match(filename)
+            if match is None or (file_format and match.group("format") != file_format):
+                continue
+            path = os.path.join(root, filename)
+            parameters = {"theta": match.group("theta"), "rsim-g1": match.group("g1"), "rsim-g2": match.group("g2"),
+                          "nbiorep": match.group("nbiorep"), "allelicreads": match.group("allelicreads"),
+                          "simruns": match.group("simruns"), "phi": match.group("phi"), "biorepsd": match.group("biorepsd")}
+            if match.group("format") == "npz":
+                parameters = count_store.read_header(path)["conditions"]["c1"]
+            rows.append(dict({key: parameters.get(key) or default for key, default in EXTENDED_DEFAULTS.items()},
+                             **{key: value for key, value in parameters.items() if key not in EXTENDED_DEFAULTS},
+                             path=path, set=int(match.group("set")), format=match.group("format")))
+    catalog = pd.DataFrame(rows, columns=["path", "set", "theta"] + SHARED_KEYS)
+    catalog["theta_value"] = catalog["theta"].astype(float)
+    return catalog
+
+
+def hypothesis_dir(theta1, theta2):
+    """Function to name the folder of a merged dataset after the hypotheses that are null
+         Arguments:
+           :param theta1: Level of AI of condition 1
+           :type theta1: float
+
+           :param theta2: Level of AI of condition 2
+           :type theta2: float
+
+         Returns:
+           :return: H1_<>_H2_<>_H3_<> where <> is null or not_null
+           :rtype: string
+    """
+    label = {True: "null", False: "not_null"}
+    return "H1_{}_H2_{}_H3_{}".format(label[theta1 == NULL_THETA], label[theta2 == NULL_THETA], label[theta1 == theta2])
+
+
+def join_catalog(catalog, all_pairs=False, crn=False):
+    """Function to list every pair of datasets that can be merged, with a join of the catalog with itself.
+        Datasets with the same level of AI are paired only with a different set (set_c1 < set_c2).
+        Datasets simulated with common random numbers share the draws of their set, so they are always paired
+        with a different set, to keep the two conditions independent.
+         Arguments:
+           :param catalog: Catalog from build_catalog
+           :type catalog: Pandas DataFrame
+
+           :param all_pairs: If True, every ordered pair of levels of AI is kept. Otherwise, as in the three
+                merges of the sample script, only pairs with theta1 = 0.5 or theta1 = theta2 are kept.
+           :type all_pairs: bool
+
+           :param crn: If True, the datasets were simulated with common random numbers
+           :type crn: bool
+
+         Returns:
+           :return: One row per pair with the paths and parameters of both conditions (suffixes _c1 and _c2),
+                the output folder and the output filename without extension
+           :rtype: Pandas DataFrame
+    """
+    pairs = catalog.merge(catalog, on=SHARED_KEYS, suffixes=("_c1", "_c2"))
+    same_theta = pairs["theta_c1"] == pairs["theta_c2"]
+    keep = np.where(same_theta, pairs["set_c1"] < pairs["set_c2"], pairs["set_c1"] != pairs["set_c2"] if crn else True)
+    if not all_pairs:
+        keep = keep & ((pairs["theta_value_c1"] == NULL_THETA) | same_theta).to_numpy()
+    pairs = pairs[keep].reset_index(drop=True)
+    pairs["outdir"] = [hypothesis_dir(theta1, theta2) for theta1, theta2 in zip(pairs["theta_value_c1"], pairs["theta_value_c2"])]
+    pairs["filename"] = ("theta1_" + pairs["theta_c1"] + "_theta2_" + pairs["theta_c2"] + "_rsim-g1_" + pairs["rsim-g1"] +
+                         "_rsim-g2_" + pairs["rsim-g2"] + "_nbiorep_" + pairs["nbiorep"] + "_allelicreads_" +
+                         pairs["allelicreads"] + "_simruns_" + pairs["simruns"] +
+                         [simulate_nbmodel.scenario_suffix(phi, biorepsd) for phi, biorepsd in zip(pairs["phi"], pairs["biorepsd"])])
+    pairs["resample"] = 0
+    return pairs
+
+
+def pair_datasets(catalog, all_pairs=False, crn=False):
+    """Function to compute one pair of datasets to merge per scenario. Datasets with the same level of AI
+        pair the first set with the second; datasets with different levels of AI pair their first sets, or
+        the first set with the second if they were simulated with common random numbers.
+         Arguments:
+           :param catalog: Catalog from build_catalog
+           :type catalog: Pandas DataFrame
+
+           :param all_pairs: If True, every ordered pair of levels of AI is merged
+           :type all_pairs: bool
+
+           :param crn: If True, the datasets were simulated with common random numbers
+           :type crn: bool
+
+         Returns:
+           :return: One row per merged dataset, as in join_catalog, with the filename extension
+           :rtype: Pandas DataFrame
+    """
+    catalog = catalog.copy()
+    catalog["set_rank"] = catalog.groupby(["theta"] + SHARED_KEYS)["set"].rank(method="dense").astype(int) - 1
+    pairs = join_catalog(catalog[catalog["set_rank"] < 2], all_pairs, crn)
+    same_theta = (pairs["theta_c1"] == pairs["theta_c2"]) | crn
+    keep = np.where(same_theta, (pairs["set_rank_c1"] == 0) & (pairs["set_rank_c2"] == 1),
+                    (pairs["set_rank_c1"] == 0) & (pairs["set_rank_c2"] == 0))
+    pairs = pairs[keep].reset_index(drop=True)
+    pairs["filename"] = pairs["filename"] + "." + pairs["format"]
+    return pairs.sort_values(SHARED_KEYS + ["filename"]).reset_index(drop=True)
+
+
+def select_pairings(df_scenario, k):
+    """Function to choose up to k pairings of the sets of one scenario, overlapping as little as possible:
+        pairings that share no source dataset are taken first, round after round
+         Arguments:
+           :param df_scenario: Rows of join_catalog of one scenario (theta1, theta2 and SHARED_KEYS)
+           :type df_scenario: Pandas DataFrame
+
+           :param k: Largest number of pairings
+           :type k: int
+
+         Returns:
+           :return: Selected rows, in order of selection
+           :rtype: Pandas DataFrame
+    """
+    remaining = list(df_scenario.sort_values(["set_c1", "set_c2"]).index)
+    selected = []
+    while remaining and len(selected) < k:
+        used = set()
+        for index in list(remaining):
+            ## A source dataset is a (theta, set), so that sets of the same level of AI are shared between conditions
+            sources = {(df_scenario.at[index, "theta_c1"], df_scenario.at[index, "set_c1"]),
+                       (df_scenario.at[index, "theta_c2"], df_scenario.at[index, "set_c2"])}
+            if used & sources:
+                continue
+            selected.append(index)
+            remaining.remove(index)
+            used |= sources
+            if len(selected) == k:
+                break
+    return df_scenario.loc[selected]
+
+
+def recombine_pairs(catalog, k, all_pairs=False, resample=False, seed=None, crn=False):
+    """Function to compute up to k merged datasets per scenario from the existing sets, using distinct
+        pairings of sets and, if resample is True, feature-level resampling of those pairings for the rest
+         Arguments:
+           :param catalog: Catalog from build_catalog
+           :type catalog: Pandas DataFrame
+
+           :param k: Number of merged datasets per scenario
+           :type k: int
+
+           :param all_pairs: If True, every ordered pair of levels of AI is merged
+           :type all_pairs: bool
+
+           :param resample: If True, scenarios with fewer than k distinct pairings are completed by drawing
+                the features of both conditions with replacement
+           :type resample: bool
+
+           :param seed: Master seed of the resampling
+           :type seed: int
+
+           :param crn: If True, the datasets were simulated with common random numbers
+           :type crn: bool
+
+         Returns:
+           :return: One row per merged dataset, as in join_catalog. Filenames end in _sets_<set_c1>-<set_c2>
+                and, for resampled datasets, _resample_<n>. Column resample_seed holds the seed of each resampling.
+           :rtype: Pandas DataFrame
+    """
+    pairs = join_catalog(catalog, all_pairs, crn)
+    recombined = []
+    for key, df_scenario in pairs.groupby(["theta_c1", "theta_c2"] + SHARED_KEYS, sort=False):
+        df_selected = select_pairings(df_scenario, k)
+        if resample and 0 < df_selected.shape[0] < k:
+            extra = [df_selected.iloc[[n % df_selected.shape[0]]].assign(resample=n//df_selected.shape[0]+1)
+                     for n in range(k-df_selected.shape[0])]
+            df_selected = pd.concat([df_selected] + extra)
+        recombined.append(df_selected)
+    pairs = pd.concat(recombined, ignore_index=True) if recombined else pairs.iloc[0:0]
+    pairs["filename"] = (pairs["filename"] + "_sets_" + pairs["set_c1"].astype(str) + "-" + pairs["set_c2"].astype(str) +
+                         np.where(pairs["resample"] > 0, "_resample_" + pairs["resample"].astype(str), "") + "." + pairs["format"])
+    entropy = np.random.SeedSequence(seed).entropy
+    pairs["resample_seed"] = [[entropy, zlib.crc32(filename.encode())] for filename in pairs["filename"]]
+    return pairs.sort_values(SHARED_KEYS + ["filename"]).reset_index(drop=True)
+
+
+def load_dataset(path):
+    """Function to read a single-condition dataset: the counts of an npz file, or the lines of a TSV file
+         Arguments:
+           :param path: Filename ending in .tsv or .npz
+           :type path: string
+
+         Returns:
+           :return: Array of shape (simruns, nbiorep, 3) with the g1, g2 and both counts, or lines without newline
+           :rtype: numpy array or list
+    """
+    if path.endswith(".npz"):
+        return count_store.read_counts(path)[1]["c1"]
+    with open(path, "rb") as data:
+        content = data.read()
+    integrity.verify(path, content)
+    return content.decode().splitlines()
+
+
+def stack_lines(lines_c1, lines_c2):
+    """Function to merge two TSV datasets line by line, without parsing the counts
+         Arguments:
+           :param lines_c1: Lines of the dataset of condition 1
+           :type lines_c1: list
+
+           :param lines_c2: Lines of the dataset of condition 2, whose columns are renamed from c1 to c2
+           :type lines_c2: list
+
+         Returns:
+           :return: Lines of the merged dataset, FEATURE_ID and the columns of c1 followed by the columns of c2
+           :rtype: list
+    """
+    if len(lines_c1) != len(lines_c2):
+        raise ValueError("Datasets with a different number of features cannot be merged")
+    header = lines_c1[0] + "\t" + lines_c2[0].split("\t", 1)[1].replace("c1", "c2")
+    return [header] + [line_c1 + "\t" + line_c2.split("\t", 1)[1] for line_c1, line_c2 in zip(lines_c1[1:], lines_c2[1:])]
+
+
+def merge_group(pairs):
+    """Function to write the merged datasets of one group of pairs, reading each source dataset once
+         Arguments:
+           :param pairs: Rows of pair_datasets with the same SHARED_KEYS, with the full output path in column outfile
+           :type pairs: Pandas DataFrame
+
+         Returns:
+           :return: Names of the files written
+           :rtype: list
+    """
+    datasets = {}
+    written = []
+    for row in pairs.to_dict("records"):
+        params = {"theta1": row["theta_c1"], "theta2": row["theta_c2"], "nbiorep": row["nbiorep"],
+                  "allelicreads": row["allelicreads"], "simruns": row["simruns"], "format": row["format"]}
+        with telemetry.stage("merge", params):
+            for path in [row["path_c1"], row["path_c2"]]:
+                if path not in datasets:
+                    datasets[path] = load_dataset(path)
+            data = {"c1": datasets[row["path_c1"]], "c2": datasets[row["path_c2"]]}
+            if row["resample"] > 0:
+                ## Features of each condition drawn with replacement; the header line of TSV datasets is kept
+                rng = np.random.default_rng(row["resample_seed"])
+                for condition in ["c1", "c2"]:
+                    if row["format"] == "npz":
+                        data[condition] = data[condition][rng.integers(0, data[condition].shape[0], data[condition].shape[0])]
+                    else:
+                        lines = data[condition]
+                        data[condition] = [lines[0]] + [lines[index] for index in rng.integers(1, len(lines), len(lines)-1)]
+            if row["format"] == "npz":
+                header = {"format": count_store.FORMAT_NAME, "version": count_store.FORMAT_VERSION,
+                          "conditions": {condition: count_store.scenario_header(row["theta_" + condition], row["simruns"], row["nbiorep"],
+                                                                                row["allelicreads"], row["rsim-g1"], row["rsim-g2"],
+                                                                                row["phi"], row["biorepsd"])["conditions"]["c1"]
+                                         for condition in ["c1", "c2"]}}
+                count_store.write_counts(row["outfile"], header, data)
+            else:
+                with integrity.atomic_path(row["outfile"]) as temporary:
+                    with open(temporary, "w") as output:
+                        output.write("\n".join(stack_lines(data["c1"], data["c2"])) + "\n")
+        written.append(row["outfile"])
+    return written
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tasks import approx_nbmodel
+from tasks import count_store
+from tasks import simulate_nbmodel
+
+## Stand-in for nbmodel_stan2.py used by the benchmarks, so that the fitting stage runs offline and in
+## seconds. It takes the same options, reads the dataset and writes a bayesian_out_<compID>.tabular file
+## with the columns of the real model, and a <compID>_r_out file, in the current directory. The estimates
+## are the sample proportions and every Bayes evidence is 1: the output is only meant for timing.
+
+def getOptions():
+    parser = argparse.ArgumentParser(description="Write a placeholder nbmodel_stan2.py output for benchmarking")
+    parser.add_argument("-d", "--design", action="store", help="Design file with the compID in its third column")
+    parser.add_argument("-i", "--input", action="store", help="Merged simulated dataset")
+    parser.add_argument("-c", "--chains", action="store", help="Ignored")
+    parser.add_argument("-t", "--iterations", action="store", help="Ignored")
+    parser.add_argument("-w", "--warmup", action="store", help="Ignored")
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = getOptions()
+    compID = pd.read_csv(args.design, sep="\t")["compID"].iloc[0]
+    priors, counts = count_store.load_counts(args.input)
+    result = {"comparison": compID, "FEATURE_ID": "fusion_id"}
+    for condition in ["c1", "c2"]:
+        totals = counts[condition].sum(axis=1)
+        result[condition + "_num_reps"] = counts[condition].shape[1]
+        for index, allele in enumerate(["g1", "g2", "both"]):
+            result["counts_{}_{}".format(condition, allele)] = totals[:, index]
+        result["prior_{}_g1".format(condition)] = priors[condition]["rsim-g1"]
+        result["prior_{}_g2".format(condition)] = priors[condition]["rsim-g2"]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            sampleprop = totals[:, 0]/(totals[:, 0]+totals[:, 1])
+        result[condition + "_sampleprop"] = sampleprop
+        result[condition + "_theta"] = sampleprop
+        result[condition + "_q025"] = sampleprop
+        result[condition + "_q975"] = sampleprop
+        result[condition + "_Bayes_evidence"] = 1.0
+        result[condition + "_AI_decision"] = 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            result["alpha{}_postmean".format(condition[1])] = np.sqrt(1/sampleprop-1)
+    result["H3_independence_Bayes_evidence"] = 1.0
+    result["flaganalyze"] = simulate_nbmodel.FLAG_ANALYZE
+    pd.DataFrame(result)[approx_nbmodel.RESULT_COLUMNS].round(4).to_csv("bayesian_out_" + compID + ".tabular", index=False, sep="\t")
+    with open(compID + "_r_out", "w") as output:
+        output.write("nbmodel_stub.py: no fit\n")
+
+
+if __name__ == "__main__":
+    main()
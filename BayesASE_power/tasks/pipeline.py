@@ -0,0 +1,203 @@
+import hashlib
+import json
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from tasks import telemetry
+
+## Make-style task graph. A task is a dictionary with a unique "name", a picklable "function" and its "args",
+## the "inputs" and "outputs" files and the "params" that determine the outputs. A task depends on the tasks
+## that produce its inputs. It runs only if an output is missing, an input is newer than its oldest output,
+## or its parameters changed since its last successful run. The parameter hash of every successful task is
+## kept in a JSON state file, together with the master seed of the pipeline.
+
+
+def params_hash(params):
+    """Function to hash the parameters of a task
+         Arguments:
+           :param params: Parameters of the task, as JSON serializable values
+           :type params: dictionary
+
+         Returns:
+           :return: SHA-256 hash of the parameters serialized with sorted keys
+           :rtype: string
+    """
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+def load_state(state_file):
+    """Function to read the state of the pipeline
+         Arguments:
+           :param state_file: JSON state file, which may not exist yet
+           :type state_file: string
+
+         Returns:
+           :return: State with the parameter hash of each task that ran successfully under "tasks"
+           :rtype: dictionary
+    """
+    if os.path.exists(state_file):
+        with open(state_file) as state:
+            return json.load(state)
+    return {"tasks": {}}
+
+
+def save_state(state_file, state):
+    """Function to write the state of the pipeline, replacing the previous one in a single step
+         Arguments:
+           :param state_file: JSON state file
+           :type state_file: string
+
+           :param state: State of the pipeline
+           :type state: dictionary
+    """
+    with open(state_file + ".tmp", "w") as output:
+        json.dump(state, output, indent=1, sort_keys=True)
+    os.replace(state_file + ".tmp", state_file)
+
+
+def outdated(task, state):
+    """Function to tell why a task must run
+         Arguments:
+           :param task: Task of the graph
+           :type task: dictionary
+
+           :param state: State of the pipeline
+           :type state: dictionary
+
+         Returns:
+           :return: Reason to run the task, or None if its outputs are up to date
+           :rtype: string
+    """
+    if any(not os.path.exists(output) for output in task["outputs"]):
+        return "missing output"
+    if state["tasks"].get(task["name"]) != params_hash(task["params"]):
+        return "parameters changed"
+    oldest_output = min(os.path.getmtime(output) for output in task["outputs"])
+    if any(os.path.getmtime(input) > oldest_output for input in task["inputs"] if os.path.exists(input)):
+        return "inputs changed"
+    return None
+
+
+def dependencies(tasks):
+    """Function to find the tasks that produce the inputs of each task
+         Arguments:
+           :param tasks: Tasks of the graph
+           :type tasks: list
+
+         Returns:
+           :return: Names of the tasks each task depends on
+           :rtype: dictionary
+    """
+    producers = {}
+    for task in tasks:
+        for output in task["outputs"]:
+            if os.path.abspath(output) in producers:
+                raise ValueError(output + " is an output of both " + producers[os.path.abspath(output)] + " and " + task["name"])
+            producers[os.path.abspath(output)] = task["name"]
+    return {task["name"]: sorted({producers[os.path.abspath(input)] for input in task["inputs"]
+                                  if os.path.abspath(input) in producers}) for task in tasks}
+
+
+def run_task(task):
+    """Function to run the function of a task after creating the folders of its outputs
+         Arguments:
+           :param task: Task of the graph
+           :type task: dictionary
+    """
+    for output in task["outputs"]:
+        if os.path.dirname(output):
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+    with telemetry.stage("pipeline_task", {"task": task["name"]}):
+        task["function"](*task["args"])
+
+
+def run_tasks(tasks, state_file, jobs=1, dry_run=False):
+    """Function to run the outdated tasks of a graph, running independent tasks at the same time.
+        A task is started as soon as the tasks it depends on are finished, and is skipped if one of them failed.
+         Arguments:
+           :param tasks: Tasks of the graph
+           :type tasks: list
+
+           :param state_file: JSON state file
+           :type state_file: string
+
+           :param jobs: Number of tasks to run at the same time
+           :type jobs: int
+
+           :param dry_run: If True, only print the tasks that would run and why
+           :type dry_run: bool
+
+         Returns:
+           :return: Names of the tasks that ran and names of the tasks that failed or were skipped
+           :rtype: tuple (list, list)
+    """
+    state = load_state(state_file)
+    by_name = {task["name"]: task for task in tasks}
+    depends_on = dependencies(tasks)
+    waiting = [task["name"] for task in tasks]
+    finished, ran, failed = set(), [], []
+    running = {}
+
+    def finish(name, error=None):
+        running.pop(name, None)
+        if error is None:
+            finished.add(name)
+        else:
+            failed.append(name)
+            print(name + ": failed\n" + error)
+
+    executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 and not dry_run else None
+    try:
+        while waiting or running:
+            for name in list(waiting):
+                if any(dependency in failed for dependency in depends_on[name]):
+                    waiting.remove(name)
+                    failed.append(name)
+                    print(name + ": skipped, a task it depends on failed")
+                    continue
+                if not all(dependency in finished for dependency in depends_on[name]):
+                    continue
+                waiting.remove(name)
+                task = by_name[name]
+                reason = outdated(task, state)
+                if reason is None and dry_run and any(dependency in ran for dependency in depends_on[name]):
+                    reason = "inputs changed"
+                if reason is None:
+                    finished.add(name)
+                    continue
+                print(name + ": " + reason)
+                ran.append(name)
+                if dry_run:
+                    finished.add(name)
+                elif executor is not None:
+                    running[name] = executor.submit(run_task, task)
+                else:
+                    running[name] = None
+                    try:
+                        run_task(task)
+                    except Exception:
+                        finish(name, traceback.format_exc())
+                        continue
+                    state["tasks"][name] = params_hash(task["params"])
+                    save_state(state_file, state)
+                    finish(name)
+            if not running:
+                if waiting and not any(all(dependency in finished or dependency in failed
+                                           for dependency in depends_on[name]) for name in waiting):
+                    raise ValueError("The task graph has a cycle through " + ", ".join(waiting))
+                continue
+            done, not_done = wait(running.values(), return_when=FIRST_COMPLETED)
+            for name, future in list(running.items()):
+                if future in done:
+                    if future.exception() is not None:
+                        error = "".join(traceback.format_exception(type(future.exception()), future.exception(),
+                                                                   future.exception().__traceback__))
+                        finish(name, error)
+                    else:
+                        state["tasks"][name] = params_hash(by_name[name]["params"])
+                        save_state(state_file, state)
+                        finish(name)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return ran, failed
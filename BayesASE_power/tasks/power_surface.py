@@ -0,0 +1,232 @@
+import datetime
+import json
+import numpy as np
+import pandas as pd
+from tasks import integrity
+
+## Power surface: power (or Type I error at delta_AI = 0) on the grid of simulated num_bioreps,
+## num_allele_specific_reads_per_biorep and delta_AI, for each hypothesis and level. H1 pools the test of
+## condition 1 (delta_AI_1, prop_H1) and of condition 2 (delta_AI_2, prop_H2); H3 is the comparison of the two
+## conditions (delta_AI_3, prop_H3). Each cell holds the average over replicates, weighted by the number of
+## features, and its standard error. Cells that were not simulated are NaN: the simulated points are usually
+## scattered over the grid, and queries interpolate between them only. The surface is saved as an
+## uncompressed .npz file with the axes, one power and one standard error array per hypothesis and level,
+## and a JSON header.
+FORMAT_NAME = "BayesASE_power surface"
+FORMAT_VERSION = 1
+AXES = ["num_bioreps", "num_allele_specific_reads_per_biorep", "delta_AI"]
+HYPOTHESES = {"H1": [("delta_AI_1", "prop_H1"), ("delta_AI_2", "prop_H2")], "H3": [("delta_AI_3", "prop_H3")]}
+LEVELS = ["05", "01"]
+## Simulation parameters that must be the same for every row of a surface
+FIXED_COLUMNS = ["r_g1", "r_g2", "phi_sim", "biorep_sd_sim"]
+QUERY_COLUMNS = ["hypothesis", "level", "num_bioreps", "num_allele_specific_reads_per_biorep", "delta_AI", "measure",
+                 "estimate", "se", "lower", "upper", "flag"]
+
+
+def surface_points(df_summary, hypothesis, level):
+    """Function to compute the value of each simulated point of the surface of one hypothesis and level
+         Arguments:
+           :param df_summary: Summary rows from summarize_posterior_estimates.py
+           :type df_summary: Pandas DataFrame
+
+           :param hypothesis: 'H1' or 'H3'
+           :type hypothesis: string
+
+           :param level: '05' or '01'
+           :type level: string
+
+         Returns:
+           :return: One row per point (AXES) with the weighted average proportion, its standard error and the
+                number of replicates. The standard error is the largest of the binomial error of all features and
+                the error of the mean of the replicates.
+           :rtype: Pandas DataFrame
+    """
+    df_points = pd.concat([pd.DataFrame({"num_bioreps": df_summary["num_bioreps"],
+                                         "num_allele_specific_reads_per_biorep": df_summary["num_allele_specific_reads_per_biorep"],
+                                         "delta_AI": df_summary[delta], "prop": df_summary[prop + "_LE" + level],
+                                         "nfeature": df_summary["nfeature"]})
+                           for delta, prop in HYPOTHESES[hypothesis]], ignore_index=True)
+    df_points["weighted"] = df_points["prop"]*df_points["nfeature"]
+    grouped = df_points.groupby(AXES)
+    df_cells = grouped.agg(weighted=("weighted", "sum"), nfeature=("nfeature", "sum"), replicates=("prop", "size"),
+                           sd=("prop", "std")).reset_index()
+    df_cells["prop"] = df_cells["weighted"]/df_cells["nfeature"]
+    binomial = np.sqrt(df_cells["prop"]*(1-df_cells["prop"])/df_cells["nfeature"])
+    between = (df_cells["sd"]/np.sqrt(df_cells["replicates"])).fillna(0)
+    df_cells["se"] = np.maximum(binomial, between)
+    return df_cells[AXES + ["prop", "se", "replicates"]]
+
+
+def build_surface(df_summary, sources=(), where=None):
+    """Function to build the power surface of summary rows
+         Arguments:
+           :param df_summary: Summary rows from summarize_posterior_estimates.py
+           :type df_summary: Pandas DataFrame
+
+           :param sources: Names of the summary files, saved in the header
+           :type sources: list
+
+           :param where: Selection applied to the rows, saved in the header
+           :type where: string
+
+         Returns:
+           :return: Header, axes and arrays of the surface
+           :rtype: tuple (dictionary, dictionary, dictionary)
+    """
+    fixed = {}
+    for column in FIXED_COLUMNS:
+        if column in df_summary.columns:
+            values = df_summary[column].dropna().unique()
+            if len(values) > 1:
+                raise ValueError("The summary mixes several values of " + column + " (" + ", ".join(str(value) for value in sorted(values)) +
+                                 "): select one, e.g. with --where \"" + column + " == " + str(sorted(values)[0]) + "\"")
+            if len(values) == 1:
+                fixed[column] = float(values[0])
+    points = {(hypothesis, level): surface_points(df_summary, hypothesis, level) for hypothesis in HYPOTHESES for level in LEVELS}
+    axes = {"num_bioreps": np.unique(df_summary["num_bioreps"].astype(float)),
+            "num_allele_specific_reads_per_biorep": np.unique(df_summary["num_allele_specific_reads_per_biorep"].astype(float))}
+    arrays = {}
+    for hypothesis in HYPOTHESES:
+        delta = np.unique(points[(hypothesis, LEVELS[0])]["delta_AI"].astype(float))
+        axes["delta_AI_" + hypothesis] = delta
+        for level in LEVELS:
+            df_cells = points[(hypothesis, level)]
+            shape = (len(axes["num_bioreps"]), len(axes["num_allele_specific_reads_per_biorep"]), len(delta))
+            index = (np.searchsorted(axes["num_bioreps"], df_cells["num_bioreps"]),
+                     np.searchsorted(axes["num_allele_specific_reads_per_biorep"], df_cells["num_allele_specific_reads_per_biorep"]),
+                     np.searchsorted(delta, df_cells["delta_AI"]))
+            for name, column in [("power", "prop"), ("se", "se"), ("replicates", "replicates")]:
+                array = np.full(shape, np.nan)
+                array[index] = df_cells[column]
+                arrays[name + "_" + hypothesis + "_LE" + level] = array
+    header = {"format": FORMAT_NAME, "version": FORMAT_VERSION, "date": datetime.datetime.now().isoformat(timespec="seconds"),
+              "sources": list(sources), "where": where, "fixed": fixed, "rows": int(df_summary.shape[0])}
+    return header, axes, arrays
+
+
+def save_surface(outfile, header, axes, arrays):
+    """Function to save a power surface
+         Arguments:
+           :param outfile: Output filename, ending in .npz
+           :type outfile: string
+
+           :param header: Header of the surface
+           :type header: dictionary
+
+           :param axes: Values of each axis
+           :type axes: dictionary
+
+           :param arrays: Power, standard error and number of replicates of each hypothesis and level
+           :type arrays: dictionary
+    """
+    with integrity.atomic_path(outfile) as temporary, open(temporary, "wb") as output:
+        np.savez(output, header=np.array(json.dumps(header)), **{"axis_" + name: values for name, values in axes.items()}, **arrays)
+
+
+def load_surface(infile):
+    """Function to read a power surface saved by save_surface
+         Arguments:
+           :param infile: Filename ending in .npz
+           :type infile: string
+
+         Returns:
+           :return: Header, axes and arrays of the surface
+           :rtype: tuple (dictionary, dictionary, dictionary)
+    """
+    with np.load(infile) as data:
+        header = json.loads(str(data["header"]))
+        if header.get("format") != FORMAT_NAME:
+            raise ValueError(infile + " is not a power surface")
+        axes = {name[len("axis_"):]: data[name] for name in data.files if name.startswith("axis_")}
+        arrays = {name: data[name] for name in data.files if name != "header" and not name.startswith("axis_")}
+    return header, axes, arrays
+
+
+def interpolate_points(points, value, log=False):
+    """Function to interpolate linearly between the points of one axis. Only the points that were themselves
+        surrounded by simulated points are used, if there are any; a value beyond them is moved to the nearest one.
+         Arguments:
+           :param points: (coordinate, estimate, standard error, surrounded) of each point, sorted by coordinate
+           :type points: list
+
+           :param value: Value to interpolate at
+           :type value: float
+
+           :param log: If True, interpolate on the log scale
+           :type log: bool
+
+         Returns:
+           :return: Estimate, standard error, and whether the value is surrounded by points that are themselves surrounded
+           :rtype: tuple (float, float, bool)
+    """
+    surrounded = [point for point in points if point[3]]
+    inside = bool(surrounded) and surrounded[0][0] <= value <= surrounded[-1][0]
+    if surrounded:
+        points = surrounded
+    coordinates = np.array([point[0] for point in points], dtype=float)
+    value = min(max(value, coordinates[0]), coordinates[-1])
+    if log:
+        coordinates, value = np.log(coordinates), np.log(value)
+    return (float(np.interp(value, coordinates, [point[1] for point in points])),
+            float(np.interp(value, coordinates, [point[2] for point in points])), inside)
+
+
+def query_surface(surface, num_bioreps, reads_per_biorep, delta_AI, hypothesis="H1", level="05", z=1.96):
+    """Function to interpolate the power surface at one point. The simulated points are scattered (designs with a
+        fixed total of reads lie on a diagonal of num_bioreps x reads per biorep), so the interpolation only uses
+        simulated points: along delta_AI for each simulated num_bioreps and reads per biorep, then along the reads per
+        biorep simulated with each num_bioreps (on the log scale), then along num_bioreps. The standard error is
+        interpolated the same way.
+         Arguments:
+           :param surface: Header, axes and arrays from load_surface or build_surface
+           :type surface: tuple
+
+           :param num_bioreps: Number of bioreps
+           :type num_bioreps: float
+
+           :param reads_per_biorep: Number of allele specific reads per biorep
+           :type reads_per_biorep: float
+
+           :param delta_AI: Level of AI, 0 for the Type I error
+           :type delta_AI: float
+
+           :param hypothesis: 'H1' or 'H3'
+           :type hypothesis: string
+
+           :param level: '05' or '01'
+           :type level: string
+
+           :param z: Number of standard errors of the band
+           :type z: float
+
+         Returns:
+           :return: Row of QUERY_COLUMNS. Flag is 'ok', 'outside' if the point is outside the simulated range of an
+                axis (the nearest end is used), or 'incomplete' if it is inside every range but not surrounded by
+                simulated points (the nearest ones are used); the band is then only indicative
+           :rtype: dictionary
+    """
+    header, axes, arrays = surface
+    power, se = arrays["power_" + hypothesis + "_LE" + level], arrays["se_" + hypothesis + "_LE" + level]
+    bioreps_axis, reads_axis, delta_axis = axes["num_bioreps"], axes["num_allele_specific_reads_per_biorep"], axes["delta_AI_" + hypothesis]
+    bioreps_points = []
+    for i, bioreps in enumerate(bioreps_axis):
+        reads_points = []
+        for j, reads in enumerate(reads_axis):
+            simulated = ~np.isnan(power[i, j])
+            if simulated.any():
+                delta_points = list(zip(delta_axis[simulated], power[i, j][simulated], se[i, j][simulated], [True]*int(simulated.sum())))
+                reads_points.append((reads,) + interpolate_points(delta_points, delta_AI))
+        if reads_points:
+            bioreps_points.append((bioreps,) + interpolate_points(reads_points, reads_per_biorep, log=True))
+    outside = any(value < axis[0] or value > axis[-1] for value, axis in
+                  [(num_bioreps, bioreps_axis), (reads_per_biorep, reads_axis), (delta_AI, delta_axis)])
+    if bioreps_points:
+        estimate, spread, inside = interpolate_points(bioreps_points, num_bioreps)
+    else:
+        estimate, spread, inside = np.nan, np.nan, False
+    flag = "outside" if outside else "ok" if inside else "incomplete"
+    return {"hypothesis": hypothesis, "level": "0." + level, "num_bioreps": num_bioreps,
+            "num_allele_specific_reads_per_biorep": reads_per_biorep, "delta_AI": delta_AI,
+            "measure": "type_I_error" if delta_AI == 0 else "power", "estimate": estimate, "se": spread,
+            "lower": max(estimate-z*spread, 0.0) if bioreps_points else np.nan,
+            "upper": min(estimate+z*spread, 1.0) if bioreps_points else np.nan, "flag": flag}
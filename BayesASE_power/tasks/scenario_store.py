@@ -0,0 +1,239 @@
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import pandas as pd
+from tasks import integrity
+
+## Local SQLite catalog of the datasets and fits produced by the pipeline. Each record holds the kind of
+## file ('simulated', 'merged' or 'fit'), its path, the SHA-256 hash and size of its content, the scenario
+## parameters, the seed, the options of the step that produced it, the hashes of its inputs and its wall
+## time. Parameters, options and inputs are stored as canonical JSON (sorted keys), so that a step can look
+## up an identical earlier run and reuse its output instead of doing the work again. Summary rows are
+## kept in their own table, one row per fit output, to query power and Type I error by any parameter.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    params TEXT NOT NULL,
+    seed TEXT,
+    options TEXT NOT NULL,
+    inputs TEXT NOT NULL,
+    wall_time_s REAL,
+    created TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS records_lookup ON records (kind, params, options, inputs, seed);
+CREATE INDEX IF NOT EXISTS records_sha256 ON records (sha256);
+"""
+RECORD_COLUMNS = ["id", "kind", "path", "sha256", "size", "params", "seed", "options", "inputs", "wall_time_s", "created"]
+
+
+def canonical(value):
+    """Function to serialize parameters, options or inputs so that equal values give equal strings
+         Arguments:
+           :param value: Dictionary or list of strings and numbers
+           :type value: dictionary or list
+
+         Returns:
+           :return: JSON with sorted keys and no whitespace
+           :rtype: string
+    """
+    return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+
+def name_parameters(name):
+    """Function to read the scenario parameters encoded in a dataset or comparison name
+         Arguments:
+           :param name: Filename without extension, e.g. theta1_0.5_theta2_0.6_rsim-g1_0.8_rsim-g2_0.8_nbiorep_3_allelicreads_960_simruns_5
+           :type name: string
+
+         Returns:
+           :return: Value of each parameter, as strings
+           :rtype: dictionary
+    """
+    fields = name.split("_")
+    return {key: value for key, value in zip(fields[::2], fields[1::2])}
+
+
+def file_hash(filename):
+    """Function to compute the SHA-256 hash of the content of a file
+         Arguments:
+           :param filename: Path of the file
+           :type filename: string
+
+         Returns:
+           :return: Hexadecimal hash
+           :rtype: string
+    """
+    sha256 = hashlib.sha256()
+    with open(filename, "rb") as data:
+        for block in iter(lambda: data.read(1 << 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def connect(store):
+    """Function to open the catalog, creating its tables if needed
+         Arguments:
+           :param store: Path of the SQLite file
+           :type store: string
+
+         Returns:
+           :return: Connection to the catalog
+           :rtype: sqlite3 Connection
+    """
+    connection = sqlite3.connect(store, timeout=60)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def record(store, kind, path, params, seed=None, options=None, inputs=None, wall_time_s=None, sha256=None):
+    """Function to add a file to the catalog
+         Arguments:
+           :param store: Path of the SQLite file
+           :type store: string
+
+           :param kind: 'simulated', 'merged' or 'fit'
+           :type kind: string
+
+           :param path: Path of the file
+           :type path: string
+
+           :param params: Scenario parameters, as strings
+           :type params: dictionary
+
+           :param seed: Seed of the random numbers used to produce the file, if any
+           :type seed: string
+
+           :param options: Options of the step that produced the file
+           :type options: dictionary
+
+           :param inputs: SHA-256 hashes of the input files of the step
+           :type inputs: list
+
+           :param wall_time_s: Wall time of the step, in seconds
+           :type wall_time_s: float
+
+           :param sha256: Hash of the file, computed if None
+           :type sha256: string
+
+         Returns:
+           :return: Hash of the file
+           :rtype: string
+    """
+    path = os.path.abspath(path)
+    sha256 = sha256 if sha256 else file_hash(path)
+    with connect(store) as connection:
+        connection.execute("INSERT INTO records (kind, path, sha256, size, params, seed, options, inputs, wall_time_s, created) "
+                           "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           (kind, path, sha256, os.path.getsize(path), canonical(params), seed, canonical(options or {}),
+                            canonical(inputs or []), wall_time_s, datetime.datetime.now().isoformat(timespec="seconds")))
+    connection.close()
+    return sha256
+
+
+def find(store, kind, params, seed=None, options=None, inputs=None):
+    """Function to find an earlier output of a step with the same parameters, seed, options and inputs
+        whose file still exists with the recorded content
+         Arguments:
+           :param store: Path of the SQLite file
+           :type store: string
+
+           :param kind: 'simulated', 'merged' or 'fit'
+           :type kind: string
+
+           :param params: Scenario parameters, as strings
+           :type params: dictionary
+
+           :param seed: Seed of the step, if any
+           :type seed: string
+
+           :param options: Options of the step
+           :type options: dictionary
+
+           :param inputs: SHA-256 hashes of the input files of the step
+           :type inputs: list
+
+         Returns:
+           :return: Path and hash of the most recent matching file, or None
+           :rtype: tuple (string, string)
+    """
+    with connect(store) as connection:
+        rows = connection.execute("SELECT path, sha256, size FROM records WHERE kind = ? AND params = ? AND options = ? "
+                                  "AND inputs = ? AND seed IS ? ORDER BY id DESC",
+                                  (kind, canonical(params), canonical(options or {}), canonical(inputs or []), seed)).fetchall()
+    connection.close()
+    for path, sha256, size in rows:
+        if os.path.isfile(path) and os.path.getsize(path) == size and file_hash(path) == sha256:
+            return path, sha256
+    return None
+
+
+def reuse(found, outfile):
+    """Function to place an earlier output at the path requested by the current step
+         Arguments:
+           :param found: Path and hash returned by find
+           :type found: tuple
+
+           :param outfile: Path requested by the current step
+           :type outfile: string
+    """
+    if os.path.abspath(found[0]) != os.path.abspath(outfile):
+        with integrity.atomic_path(outfile) as temporary:
+            shutil.copyfile(found[0], temporary)
+
+
+def record_summaries(store, df_summary):
+    """Function to save summary rows in the catalog, replacing earlier rows of the same fit outputs
+         Arguments:
+           :param store: Path of the SQLite file
+           :type store: string
+
+           :param df_summary: Summary rows with the path and sha256 of the fit output of each row
+           :type df_summary: Pandas DataFrame
+    """
+    with connect(store) as connection:
+        tables = [name for (name,) in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        if "summaries" in tables:
+            connection.executemany("DELETE FROM summaries WHERE path = ?", [(path,) for path in df_summary["path"].unique()])
+            ## Summary columns added since the table was created
+            existing = [row[1] for row in connection.execute("PRAGMA table_info(summaries)")]
+            for column in df_summary.columns:
+                if column not in existing:
+                    connection.execute('ALTER TABLE summaries ADD COLUMN "' + column + '"')
+        df_summary.to_sql("summaries", connection, if_exists="append", index=False)
+    connection.close()
+
+
+def query(store, table="summaries", where=None, columns=None):
+    """Function to select rows of the catalog
+         Arguments:
+           :param store: Path of the SQLite file
+           :type store: string
+
+           :param table: 'summaries' or 'records'
+           :type table: string
+
+           :param where: Optional SQL condition, e.g. "num_bioreps >= 4 AND delta_AI_3 = 0.2"
+           :type where: string
+
+           :param columns: Optional list of columns to select. Default - all
+           :type columns: list
+
+         Returns:
+           :return: Selected rows
+           :rtype: Pandas DataFrame
+    """
+    sql = "SELECT " + (", ".join('"' + column + '"' for column in columns) if columns else "*") + " FROM " + table
+    if where:
+        sql += " WHERE " + where
+    connection = connect(store)
+    try:
+        return pd.read_sql_query(sql, connection)
+    finally:
+        connection.close()
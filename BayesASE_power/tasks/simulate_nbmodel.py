@@ -0,0 +1,633 @@
+import contextlib
+import glob
+import json
+import os
+import socket
+import statistics
+import time
+import zlib
+import numpy as np
+from tasks import integrity
+
+## Parameters of the true model, as in tasks/simulate_read_counts_NBmodel.r
+Q_TEST = 0.8        ## Probability that a read from allele g1 maps better to g1 (rsim-g1)
+Q_LINE = 0.8        ## Probability that a read from allele g2 maps better to g2 (rsim-g2)
+TRUE_PHI = 0.02     ## Neg binomial dispersion parameter, variance = mu + phi*mu^2
+TRUE_TAU = 1        ## The current model assumes 1
+FLAG_ANALYZE = 1
+BIOREP_SD = 0       ## Standard deviation of the log biorep effects, the R model assumes equal effects
+## Streaming mode: features are drawn in blocks of STREAM_BLOCK, each from its own random stream derived from
+## the seed, so that the counts do not depend on the size of the chunks they are written in
+STREAM_BLOCK = 8192
+## Seconds between two checkpoints of a streamed simulation (see write_checkpointed)
+CHECKPOINT_SECONDS = 60
+## Common random numbers: datasets that differ only in theta or read depth are drawn from the same standard
+## gamma and uniform variates, transformed into counts by scaling and by the Poisson quantile function
+CRN_LABEL = "crn"
+
+
+def scenario_suffix(phi=TRUE_PHI, biorep_sd=BIOREP_SD):
+    """Function to build the end of the name of a dataset simulated with a dispersion or biorep effects other
+        than those of the R simulator, which are left out of the names of datasets that use them
+         Arguments:
+           :param phi: Negative binomial dispersion parameter
+           :type phi: string or float
+
+           :param biorep_sd: Standard deviation of the log biorep effects
+           :type biorep_sd: string or float
+
+         Returns:
+           :return: Empty string, or _phi_<phi>_biorepsd_<biorep_sd>
+           :rtype: string
+    """
+    if float(phi) == TRUE_PHI and float(biorep_sd) == BIOREP_SD:
+        return ""
+    return "_phi_" + str(phi) + "_biorepsd_" + str(biorep_sd)
+
+
+def simulation_filename(outprefix, theta, simruns, nbiorep, n_allele_specific_reads, q_test=Q_TEST, q_line=Q_LINE, extension=".tsv",
+                        phi=TRUE_PHI, biorep_sd=BIOREP_SD):
+    """Function to build the name of a simulated dataset the same way the R simulator does
+         Arguments:
+           :param outprefix: Path and prefix of the output file (e.g. outdir/H1_null/out_set_1)
+           :type outprefix: string
+
+           :param theta: Level of allelic imbalance, as given in the design file
+           :type theta: string
+
+           :param simruns: Number of simulated features, as given in the design file
+           :type simruns: string
+
+           :param nbiorep: Number of biological replicates, as given in the design file
+           :type nbiorep: string
+
+           :param n_allele_specific_reads: Sum of allele specific reads across all bioreps, as given in the design file
+           :type n_allele_specific_reads: string
+
+           :param extension: File extension, ".tsv" or ".npz"
+           :type extension: string
+
+           :param phi: Negative binomial dispersion parameter, named only if not TRUE_PHI
+           :type phi: string
+
+           :param biorep_sd: Standard deviation of the log biorep effects, named only if phi or biorep_sd is not the default
+           :type biorep_sd: string
+
+         Returns:
+           :return: Filename ending in extension
+           :rtype: string
+    """
+    return "_".join([outprefix, "theta", str(theta), "rsim-g1", str(q_test), "rsim-g2", str(q_line),
+                     "nbiorep", str(nbiorep), "allelicreads", str(n_allele_specific_reads),
+                     "simruns", str(simruns)]) + scenario_suffix(phi, biorep_sd) + extension
+
+
+def count_column_names(nbiorep, condition="c1"):
+    """Function to create the header of a simulated dataset for one condition
+         Arguments:
+           :param nbiorep: Number of biological replicates
+           :type nbiorep: int
+
+           :param condition: Name of the condition used as column prefix
+           :type condition: string
+
+         Returns:
+           :return: Column names, in the order written by the R simulator
+           :rtype: list
+    """
+    counts = []
+    for rep in range(1, nbiorep + 1):
+        counts.extend(["counts_{}_{}_total_rep{}".format(condition, allele, rep) for allele in ["g1", "g2", "both"]])
+    return (["FEATURE_ID", condition + "_num_reps"] + counts +
+            ["prior_{}_g1".format(condition), "prior_{}_g2".format(condition), condition + "_flag_analyze"])
+
+
+def biorep_effects(nbiorep, biorep_sd=BIOREP_SD):
+    """Function to compute heterogeneous biorep effects: evenly spaced quantiles of a log-normal distribution,
+        scaled to an average of 1 so that the expected number of allele specific reads does not change
+         Arguments:
+           :param nbiorep: Number of biological replicates
+           :type nbiorep: int
+
+           :param biorep_sd: Standard deviation of the log biorep effects, 0 for equal effects
+           :type biorep_sd: float
+
+         Returns:
+           :return: Relative effect of each biorep
+           :rtype: numpy array
+    """
+    if biorep_sd == 0:
+        return np.ones(nbiorep)
+    normal = statistics.NormalDist()
+    effects = np.exp(biorep_sd*np.array([normal.inv_cdf((i+0.5)/nbiorep) for i in range(nbiorep)]))
+    return effects/effects.mean()
+
+
+def nb_means(theta, nbiorep, n_allele_specific_reads, q_test=Q_TEST, q_line=Q_LINE, biorep_sd=BIOREP_SD):
+    """Function to compute the negative binomial means of the g1, g2 and both counts in each biorep
+         Arguments:
+           :param theta: Level of allelic imbalance
+           :type theta: float
+
+           :param nbiorep: Number of biological replicates
+           :type nbiorep: int
+
+           :param n_allele_specific_reads: Sum of allele specific reads across all bioreps
+           :type n_allele_specific_reads: float
+
+           :param biorep_sd: Standard deviation of the log biorep effects, see biorep_effects
+           :type biorep_sd: float
+
+         Returns:
+           :return: Array of shape (nbiorep, 3) with the means of the g1, g2 and both counts
+           :rtype: numpy array
+    """
+    myreads = n_allele_specific_reads/2/nbiorep/np.mean([q_test, q_line]) ## This is coverage from the G3 paper
+    alpha = np.sqrt((1/theta)-1) ## In the stan2 model, theta = 1/(alpha[i]^2+1)
+    betas = biorep_effects(nbiorep, biorep_sd)*myreads ## These are the biorep effects, the beta_i s
+    means = np.array([q_test/alpha, q_line*alpha, ((1-q_test)/alpha+(1-q_line)*alpha)*TRUE_TAU])
+    return betas[:, np.newaxis]*means[np.newaxis, :]
+
+
+def simulate_read_counts(theta, simruns, nbiorep, n_allele_specific_reads, rng=None, phi=TRUE_PHI, crn=False):
+    """Function to simulate read counts under the negative binomial model of the G3 paper.
+        All counts are drawn at once as a gamma-Poisson mixture, NB(size=1/phi, mu) = Poisson(Gamma(1/phi, mu*phi)).
+         Arguments:
+           :param theta: Level of allelic imbalance
+           :type theta: float
+
+           :param simruns: Number of simulated features
+           :type simruns: int
+
+           :param nbiorep: Number of biological replicates
+           :type nbiorep: int
+
+           :param n_allele_specific_reads: Sum of allele specific reads across all bioreps
+           :type n_allele_specific_reads: float
+
+           :param rng: If not None, random number generator to draw from
+           :type rng: numpy Generator
+
+           :param phi: Negative binomial dispersion parameter
+           :type phi: float
+
+           :param crn: If True, counts are a deterministic transform of common random numbers (see crn_counts)
+           :type crn: bool
+
+         Returns:
+           :return: Array of shape (simruns, nbiorep, 3) with the g1, g2 and both counts
+           :rtype: numpy array
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    means = nb_means(theta, nbiorep, n_allele_specific_reads)
+    if crn:
+        return crn_counts(rng, means, simruns, phi)
+    lam = rng.gamma(1/phi, means*phi, size=(simruns, nbiorep, 3))
+    return rng.poisson(lam)
+
+
+def poisson_quantile(u, lam):
+    """Function to compute the Poisson quantile function, the smallest k such that P(X <= k) >= u.
+        The Cornish-Fisher approximation is corrected one step at a time with the exact distribution function.
+         Arguments:
+           :param u: Probabilities, in [0, 1)
+           :type u: numpy array
+
+           :param lam: Poisson means, of the same shape as u
+           :type lam: numpy array
+
+         Returns:
+           :return: Quantiles, of the same shape as u
+           :rtype: numpy array
+    """
+    from scipy.special import ndtri, pdtr ## Only needed by the common random numbers mode
+    z = ndtri(u)
+    k = np.maximum(np.floor(lam + np.sqrt(lam)*z + (z*z-1)/6), 0).ravel()
+    lam, u = lam.ravel(), u.ravel()
+    todo = np.arange(k.size)
+    while todo.size > 0:
+        k_todo, lam_todo, u_todo = k[todo], lam[todo], u[todo]
+        higher = pdtr(k_todo, lam_todo) < u_todo
+        lower = ~higher & (k_todo > 0) & (pdtr(k_todo-1, lam_todo) >= u_todo)
+        k[todo] = k_todo + higher - lower
+        todo = todo[higher | lower]
+    return k.reshape(z.shape).astype(np.int64)
+
+
+def crn_counts(rng, means, simruns, phi=TRUE_PHI):
+    """Function to draw negative binomial counts as a deterministic, increasing transform of common random
+        numbers: lam = means*phi*G with G ~ Gamma(1/phi, 1), and counts = Poisson quantile of U ~ Uniform(0, 1)
+        given lam. Generators in the same state give positively correlated counts for any means.
+         Arguments:
+           :param rng: Random number generator to draw from
+           :type rng: numpy Generator
+
+           :param means: Array of shape (nbiorep, 3) with the means of the g1, g2 and both counts
+           :type means: numpy array
+
+           :param simruns: Number of simulated features
+           :type simruns: int
+
+           :param phi: Negative binomial dispersion parameter
+           :type phi: float
+
+         Returns:
+           :return: Array of shape (simruns, nbiorep, 3) with the g1, g2 and both counts
+           :rtype: numpy array
+    """
+    size = (simruns,) + means.shape
+    gammas = rng.standard_gamma(1/phi, size=size)
+    return poisson_quantile(rng.random(size=size), gammas*means*phi)
+
+
+def crn_seed(entropy, set_number, nbiorep, simruns):
+    """Function to compute the seed of a dataset in the common random numbers mode. It depends on the set,
+        number of bioreps and number of features only, so that every theta and read depth shares it.
+         Arguments:
+           :param entropy: Master seed
+           :type entropy: int
+
+           :param set_number: Set of the dataset
+           :type set_number: int
+
+           :param nbiorep: Number of biological replicates
+           :type nbiorep: int
+
+           :param simruns: Number of simulated features
+           :type simruns: int
+
+         Returns:
+           :return: Seed sequence of the dataset
+           :rtype: numpy SeedSequence
+    """
+    label = "{}_nbiorep_{}_simruns_{}".format(CRN_LABEL, int(float(nbiorep)), int(float(simruns)))
+    return np.random.SeedSequence(entropy, spawn_key=(int(set_number), zlib.crc32(label.encode())))
+
+
+def iter_blocks(theta, simruns, nbiorep, n_allele_specific_reads, entropy, start_block=0, phi=TRUE_PHI, crn=False):
+    """Function to simulate the blocks of STREAM_BLOCK features of a streamed dataset, from a given block on.
+        Each block is drawn from its own random stream, so the entropy and the number of the next block are
+        the whole state of the simulation.
+         Arguments:
+           :param theta: Level of allelic imbalance
+           :type theta: float
+
+           :param simruns: Number of simulated features
+           :type simruns: int
+
+           :param nbiorep: Number of biological replicates
+           :type nbiorep: int
+
+           :param n_allele_specific_reads: Sum of allele specific reads across all bioreps
+           :type n_allele_specific_reads: float
+
+           :param entropy: Seed of the streams of the blocks
+           :type entropy: int
+
+           :param start_block: Number of the first block to simulate
+           :type start_block: int
+
+           :param phi: Negative binomial dispersion parameter
+           :type phi: float
+
+           :param crn: If True, counts are a deterministic transform of common random numbers (see crn_counts)
+           :type crn: bool
+
+         Returns:
+           :return: Number of each block and array of shape (n, nbiorep, 3) with its g1, g2 and both counts
+           :rtype: generator
+    """
+    means = nb_means(theta, nbiorep, n_allele_specific_reads)
+    for block in range(start_block, -(-simruns//STREAM_BLOCK)):
+        size = min(STREAM_BLOCK, simruns-block*STREAM_BLOCK)
+        block_rng = np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(block,)))
+        if crn:
+            yield block, crn_counts(block_rng, means, size, phi)
+        else:
+            lam = block_rng.gamma(1/phi, means*phi, size=(size, nbiorep, 3))
+            yield block, block_rng.poisson(lam)
+
+
+def iter_read_counts(theta, simruns, nbiorep, n_allele_specific_reads, rng=None, chunk_size=STREAM_BLOCK, phi=TRUE_PHI, crn=False):
+    """Function to simulate read counts under the negative binomial model of the G3 paper, chunk by chunk.
+        Only one block of STREAM_BLOCK features and one chunk are held in memory, whatever simruns. For a given
+        rng state the counts are the same for any chunk_size, but differ from those of simulate_read_counts.
+         Arguments:
+           :param theta: Level of allelic imbalance
+           :type theta: float
+
+           :param simruns: Number of simulated features
+           :type simruns: int
+
+           :param nbiorep: Number of biological replicates
+           :type nbiorep: int
+
+           :param n_allele_specific_reads: Sum of allele specific reads across all bioreps
+           :type n_allele_specific_reads: float
+
+           :param rng: If not None, random number generator from which the seed of the blocks is drawn
+           :type rng: numpy Generator
+
+           :param chunk_size: Number of features of each chunk (the last one may be smaller)
+           :type chunk_size: int
+
+           :param phi: Negative binomial dispersion parameter
+           :type phi: float
+
+           :param crn: If True, counts are a deterministic transform of common random numbers (see crn_counts)
+           :type crn: bool
+
+         Returns:
+           :return: Arrays of shape (chunk_size, nbiorep, 3) with the g1, g2 and both counts
+           :rtype: generator
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be a positive number of features")
+    if rng is None:
+        rng = np.random.default_rng()
+    entropy = int(rng.integers(2**63))
+    return iter_chunks(theta, simruns, nbiorep, n_allele_specific_reads, entropy, chunk_size, phi=phi, crn=crn)
+
+
+def iter_chunks(theta, simruns, nbiorep, n_allele_specific_reads, entropy, chunk_size, start=0, phi=TRUE_PHI, crn=False):
+    """Function to regroup the blocks of a streamed dataset into chunks of chunk_size features, from a given feature on
+         Arguments:
+           :param entropy: Seed of the streams of the blocks
+           :type entropy: int
+
+           :param chunk_size: Number of features of each chunk (the last one may be smaller)
+           :type chunk_size: int
+
+           :param start: Number of the first feature to simulate
+           :type start: int
+
+         Returns:
+           :return: Arrays of shape (chunk_size, nbiorep, 3) with the g1, g2 and both counts
+           :rtype: generator
+    """
+    pending, npending = [], 0
+    for block, counts in iter_blocks(theta, simruns, nbiorep, n_allele_specific_reads, entropy, start//STREAM_BLOCK, phi, crn):
+        if block == start//STREAM_BLOCK:
+            counts = counts[start % STREAM_BLOCK:]
+        pending.append(counts)
+        npending += pending[-1].shape[0]
+        while npending >= chunk_size:
+            counts = np.concatenate(pending) if len(pending) > 1 else pending[0]
+            yield counts[:chunk_size]
+            pending, npending = [counts[chunk_size:]], npending-chunk_size
+    if npending > 0:
+        yield np.concatenate(pending)
+
+
+def write_simulation(outfile, counts, q_test=Q_TEST, q_line=Q_LINE):
+    """Function to write simulated counts with the column layout of the R simulator
+         Arguments:
+           :param outfile: Output filename
+           :type outfile: string
+
+           :param counts: Array of shape (simruns, nbiorep, 3) with the g1, g2 and both counts
+           :type counts: numpy array
+    """
+    write_simulation_chunks(outfile, [counts], counts.shape[1], q_test, q_line)
+
+
+def write_simulation_chunks(outfile, chunks, nbiorep, q_test=Q_TEST, q_line=Q_LINE):
+    """Function to write simulated counts with the column layout of the R simulator, one chunk at a time
+         Arguments:
+           :param outfile: Output filename
+           :type outfile: string
+
+           :param chunks: Arrays of shape (n, nbiorep, 3) with the g1, g2 and both counts, e.g. from iter_read_counts
+           :type chunks: iterable
+
+           :param nbiorep: Number of biological replicates
+           :type nbiorep: int
+    """
+    ## One format string for the whole line: feature id and number of reps, counts, priors and flag
+    row_format = "\t".join(["fusion_id", str(nbiorep)] + ["%d"]*(nbiorep*3) +
+                           [str(q_test), str(q_line), str(FLAG_ANALYZE)])
+    with integrity.atomic_path(outfile) as temporary:
+        with open(temporary, "w") as output:
+            output.write("\t".join(count_column_names(nbiorep)) + "\n")
+            for counts in chunks:
+                if counts.shape[0] > 0:
+                    np.savetxt(output, counts.reshape(counts.shape[0], nbiorep*3), fmt=row_format)
+
+
+def checkpoint_paths(outfile, owner="*"):
+    """Function to name the hidden files of a checkpointed simulation. Each process writes its own files, so that a
+        process that is still running (e.g. a paused worker whose task was taken over) never writes to the files of
+        the process that resumed its work.
+         Arguments:
+           :param outfile: Output filename
+           :type outfile: string
+
+           :param owner: Name of the process writing the files, <host>_<pid>, or '*' for a glob pattern matching
+                the files of every process
+           :type owner: string
+
+         Returns:
+           :return: Partial output (<folder>/.<filename>.<owner>.partial) and checkpoint
+                (<folder>/.<filename>.<owner>.checkpoint)
+           :rtype: tuple (string, string)
+    """
+    hidden = os.path.join(os.path.dirname(outfile), "." + os.path.basename(outfile))
+    if owner == "*":
+        hidden = glob.escape(hidden)
+    return hidden + "." + owner + ".partial", hidden + "." + owner + ".checkpoint"
+
+
+def find_checkpoint(outfile, state):
+    """Function to find the most advanced checkpoint of a dataset, written by any process
+         Arguments:
+           :param outfile: Output filename
+           :type outfile: string
+
+           :param state: Seed of the blocks and parameters of the simulation, which the checkpoint must match
+           :type state: dictionary
+
+         Returns:
+           :return: Checkpoint (with 'features', 'bytes' and for npz 'data_start') and its partial output, or None if
+                there is none
+           :rtype: tuple (dictionary, string)
+    """
+    found = None
+    for checkpoint in glob.glob(checkpoint_paths(outfile)[1]):
+        partial = checkpoint[:-len(".checkpoint")] + ".partial"
+        try:
+            with open(checkpoint) as saved:
+                saved = json.load(saved)
+            if ({key: saved.get(key) for key in state} == state and os.path.getsize(partial) >= saved["bytes"] and
+                    (found is None or saved["features"] > found[0]["features"])):
+                found = (saved, partial)
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+    return found
+
+
+def write_checkpointed(outfile, theta, simruns, nbiorep, n_allele_specific_reads, rng=None, file_format="tsv", crn=False,
+                       interval=CHECKPOINT_SECONDS, header=None, chunk_size=STREAM_BLOCK):
+    """Function to simulate and write a streamed dataset chunk by chunk, so that a job killed partway through
+        resumes where it stopped. The chunks are appended to a hidden partial file of this process, which is the output
+        being built (TSV, or npz archive with the counts entry left open), and after the first chunk written once
+        interval seconds have passed since the last checkpoint, the partial file is synced and a checkpoint records the
+        seed of the blocks, the parameters, the number of features written and the size of the partial file. A new run
+        with the same parameters and seed copies the data of the partial file of the most advanced checkpoint, up to its
+        size at that checkpoint, and carries on with the next feature, so the dataset is the one an uninterrupted run
+        writes (write_simulation_chunks of iter_read_counts, or count_store.write_counts_chunks). The dataset is
+        published under outfile when complete, and the hidden files of every process are removed.
+         Arguments:
+           :param outfile: Output filename
+           :type outfile: string
+
+           :param theta: Level of allelic imbalance
+           :type theta: float
+
+           :param simruns: Number of simulated features
+           :type simruns: int
+
+           :param nbiorep: Number of biological replicates
+           :type nbiorep: int
+
+           :param n_allele_specific_reads: Sum of allele specific reads across all bioreps
+           :type n_allele_specific_reads: float
+
+           :param rng: Random number generator to draw the seed of the blocks from
+           :type rng: numpy Generator
+
+           :param file_format: Either "tsv" or "npz"
+           :type file_format: string
+
+           :param crn: If True, counts are a deterministic transform of common random numbers (see crn_counts)
+           :type crn: bool
+
+           :param interval: Seconds between two checkpoints
+           :type interval: float
+
+           :param header: Header of the npz file, from count_store.scenario_header
+           :type header: dictionary
+
+           :param chunk_size: Number of features simulated and written at a time
+           :type chunk_size: int
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be a positive number of features")
+    if rng is None:
+        rng = np.random.default_rng()
+    partial, checkpoint = checkpoint_paths(outfile, socket.gethostname() + "_" + str(os.getpid()))
+    state = {"entropy": int(rng.integers(2**63)), "theta": theta, "simruns": simruns, "nbiorep": nbiorep,
+             "n_allele_specific_reads": n_allele_specific_reads, "format": file_format, "crn": bool(crn)}
+    found = find_checkpoint(outfile, state)
+    row_format = "\t".join(["fusion_id", str(nbiorep)] + ["%d"]*(nbiorep*3) + [str(Q_TEST), str(Q_LINE), str(FLAG_ANALYZE)])
+    with open(partial, "wb") as output, contextlib.ExitStack() as stack:
+        if file_format == "npz":
+            from tasks import count_store ## count_store imports this module
+            entry = stack.enter_context(count_store.counts_entry(output, header, simruns, nbiorep))
+            data_start = output.tell()
+        else:
+            entry, data_start = output, 0
+            output.write(("\t".join(count_column_names(nbiorep)) + "\n").encode())
+        start = 0
+        if found is not None:
+            saved, saved_partial = found
+            ## Only the part written before the checkpoint is copied: its owner may still be appending to it
+            with open(saved_partial, "rb") as previous:
+                previous.seek(saved.get("data_start", 0) if file_format == "npz" else output.tell())
+                while previous.tell() < saved["bytes"]:
+                    data = previous.read(min(1 << 20, saved["bytes"]-previous.tell()))
+                    if not data:
+                        raise ValueError(saved_partial + " is shorter than recorded in its checkpoint")
+                    entry.write(data)
+            start = saved["features"]
+            print(outfile + ": resuming at feature " + str(start) + " of " + str(simruns))
+        written = start
+        saved_at = time.monotonic()
+        for counts in iter_chunks(theta, simruns, nbiorep, n_allele_specific_reads, state["entropy"], chunk_size, start, crn=crn):
+            if file_format == "npz":
+                entry.write(np.ascontiguousarray(counts, dtype=np.int32).tobytes())
+            else:
+                np.savetxt(output, counts.reshape(counts.shape[0], nbiorep*3), fmt=row_format)
+            written += counts.shape[0]
+            if time.monotonic()-saved_at >= interval and written < simruns:
+                if not os.path.exists(partial):
+                    raise RuntimeError(outfile + " was completed by another process, which removed the partial file of this one")
+                output.flush()
+                os.fsync(output.fileno())
+                integrity.replace_file(checkpoint, json.dumps(dict(state, features=written, bytes=output.tell(),
+                                                                   data_start=data_start)) + "\n")
+                saved_at = time.monotonic()
+    integrity.publish(partial, outfile)
+    ## The dataset is complete: the files of other processes, e.g. of a worker whose task was taken over, are stale
+    for stale in glob.glob(checkpoint_paths(outfile)[0]) + glob.glob(checkpoint_paths(outfile)[1]):
+        try:
+            os.remove(stale)
+        except FileNotFoundError:
+            pass
+
+
+def run_simulation(theta, simruns, nbiorep, n_allele_specific_reads, outprefix, rng=None, file_format="tsv", chunk_size=None,
+                   crn=False, checkpoint=None):
+    """Function to simulate one dataset for one condition and save it under outprefix
+         Arguments:
+           :param theta: Level of allelic imbalance, as given in the design file
+           :type theta: string
+
+           :param simruns: Number of simulated features, as given in the design file
+           :type simruns: string
+
+           :param nbiorep: Number of biological replicates, as given in the design file
+           :type nbiorep: string
+
+           :param n_allele_specific_reads: Sum of allele specific reads across all bioreps, as given in the design file
+           :type n_allele_specific_reads: string
+
+           :param outprefix: Path and prefix of the output file (e.g. outdir/H1_null/out_set_1)
+           :type outprefix: string
+
+           :param rng: If not None, random number generator to draw from
+           :type rng: numpy Generator
+
+           :param file_format: Either "tsv" or "npz" for the binary format of tasks/count_store.py
+           :type file_format: string
+
+           :param chunk_size: If not None, features are simulated and written chunk_size at a time with iter_read_counts
+           :type chunk_size: int
+
+           :param crn: If True, counts are a deterministic transform of common random numbers, so that datasets
+                simulated from generators in the same state (e.g. seeded with crn_seed) are positively correlated
+           :type crn: bool
+
+           :param checkpoint: If not None and chunk_size is set, seconds between two checkpoints, from which an
+                interrupted simulation resumes (see write_checkpointed)
+           :type checkpoint: float
+
+         Returns:
+           :return: Name of the file written
+           :rtype: string
+    """
+    outfile = simulation_filename(outprefix, theta, simruns, nbiorep, n_allele_specific_reads, extension="."+file_format)
+    if chunk_size and checkpoint is not None:
+        header = None
+        if file_format == "npz":
+            from tasks import count_store
+            header = count_store.scenario_header(theta, simruns, nbiorep, n_allele_specific_reads)
+        write_checkpointed(outfile, float(theta), int(float(simruns)), int(float(nbiorep)), float(n_allele_specific_reads),
+                           rng, file_format, crn, checkpoint, header, chunk_size)
+        return outfile
+    if chunk_size:
+        chunks = iter_read_counts(float(theta), int(float(simruns)), int(float(nbiorep)), float(n_allele_specific_reads),
+                                  rng, chunk_size, crn=crn)
+    else:
+        chunks = [simulate_read_counts(float(theta), int(float(simruns)), int(float(nbiorep)),
+                                       float(n_allele_specific_reads), rng, crn=crn)]
+    if file_format == "npz":
+        from tasks import count_store ## count_store imports this module
+        header = count_store.scenario_header(theta, simruns, nbiorep, n_allele_specific_reads)
+        if chunk_size:
+            count_store.write_counts_chunks(outfile, header, chunks, int(float(simruns)), int(float(nbiorep)))
+        else:
+            count_store.write_counts(outfile, header, {"c1": chunks[0]})
+    else:
+        write_simulation_chunks(outfile, chunks, int(float(nbiorep)))
+    return outfile
@@ -16,6 +16,8 @@ out.file <- paste0(paste(out.file, 'theta', my.theta, 'rsim-g1', my.qtest, 'rsim
 
 #Removed set.seed(0) because always gave the same result!!!!!
 #set.seed(0)
+## Optional seed of this simulation, derived by run_read_count_simul.py from its master seed
+if (length(args) >= 6) set.seed(as.numeric(args[6]))
 
 seqcond <- "c1"
 
@@ -0,0 +1,195 @@
+import math
+import numpy as np
+
+## Statistics of a column that is read one chunk at a time, in memory that does not grow with the number of
+## values: count, mean and variance are updated with the formulas of Chan et al. for merging the moments of two
+## samples, and quantiles are estimated with a mergeable compactor sketch. The sketch keeps up to `capacity`
+## values per level, a value of level h standing for 2^h of the original values. A full level is sorted and
+## every other value is moved to the next level, starting alternately with the first and the second one. Each
+## such compaction moves the rank of any value by at most 2^h, and consumes at least `capacity` values of
+## level h, so that the rank error of a sketch of n values is at most n/capacity per level. With
+## capacity = SKETCH_LEVELS/error the rank error is at most error*n for up to capacity*2^SKETCH_LEVELS values
+## (over 10^9 values for error = 0.001). The bound actually reached is kept in the sketch; as long as fewer
+## than `capacity` values were added, the sketch holds all of them and its quantiles are exact.
+SKETCH_LEVELS = 16
+QUANTILE_ERROR = 0.001
+
+
+def new_moments():
+    """Function to start the moments of an empty sample
+         Returns:
+           :return: 'n', 'mean' and 'm2' (sum of the squared deviations from the mean)
+           :rtype: dictionary
+    """
+    return {"n": 0, "mean": 0.0, "m2": 0.0}
+
+
+def merge_moments(moments, other):
+    """Function to merge the moments of two samples
+         Arguments:
+           :param moments: Moments of the first sample, updated
+           :type moments: dictionary
+
+           :param other: Moments of the second sample
+           :type other: dictionary
+
+         Returns:
+           :return: Moments of both samples
+           :rtype: dictionary
+    """
+    n = moments["n"] + other["n"]
+    if other["n"] == 0:
+        return moments
+    delta = other["mean"] - moments["mean"]
+    moments["m2"] += other["m2"] + delta*delta*moments["n"]*other["n"]/n
+    moments["mean"] += delta*other["n"]/n
+    moments["n"] = n
+    return moments
+
+
+def update_moments(moments, values):
+    """Function to add values to the moments of a sample. NaN values are ignored.
+         Arguments:
+           :param moments: Moments of the sample, updated
+           :type moments: dictionary
+
+           :param values: Values to add
+           :type values: numpy array
+
+         Returns:
+           :return: Moments of the sample with the values
+           :rtype: dictionary
+    """
+    values = values[~np.isnan(values)]
+    if values.size == 0:
+        return moments
+    mean = values.mean()
+    return merge_moments(moments, {"n": values.size, "mean": float(mean), "m2": float(((values-mean)**2).sum())})
+
+
+def moments_variance(moments, ddof=0):
+    """Function to compute the variance of a sample from its moments
+         Arguments:
+           :param moments: Moments of the sample
+           :type moments: dictionary
+
+           :param ddof: Delta degrees of freedom, the divisor being n - ddof
+           :type ddof: int
+
+         Returns:
+           :return: Variance, NaN if n <= ddof
+           :rtype: float
+    """
+    return moments["m2"]/(moments["n"]-ddof) if moments["n"] > ddof else np.nan
+
+
+def new_sketch(error=QUANTILE_ERROR):
+    """Function to start the quantile sketch of an empty sample
+         Arguments:
+           :param error: Bound on the rank error of the quantiles, as a fraction of the number of values
+           :type error: float
+
+         Returns:
+           :return: 'capacity' of each level, 'levels' (arrays of values, level h standing for 2^h values each),
+                'offsets' (next starting value of each level), 'n' and 'bound' (largest rank error of a quantile)
+           :rtype: dictionary
+    """
+    if not 0 < error < 1:
+        raise ValueError("The rank error of the quantile sketch must be between 0 and 1, not " + str(error))
+    return {"capacity": int(math.ceil(SKETCH_LEVELS/error)), "levels": [], "offsets": [], "n": 0, "bound": 0}
+
+
+def compact(sketch):
+    """Function to compact the full levels of a quantile sketch, from the lowest one up
+         Arguments:
+           :param sketch: Quantile sketch, updated
+           :type sketch: dictionary
+    """
+    level = 0
+    while level < len(sketch["levels"]):
+        values = sketch["levels"][level]
+        if values.size > sketch["capacity"]:
+            values = np.sort(values)
+            ## With an odd number of values the largest one stays, so that the total weight does not change
+            kept = values[values.size - values.size % 2:]
+            offset = sketch["offsets"][level]
+            sketch["offsets"][level] = 1 - offset
+            promoted = values[offset:values.size - values.size % 2:2]
+            sketch["levels"][level] = kept
+            if level + 1 == len(sketch["levels"]):
+                sketch["levels"].append(promoted)
+                sketch["offsets"].append(0)
+            else:
+                sketch["levels"][level+1] = np.concatenate([sketch["levels"][level+1], promoted])
+            sketch["bound"] += 2**level
+        level += 1
+
+
+def update_sketch(sketch, values):
+    """Function to add values to a quantile sketch. NaN values are ignored.
+         Arguments:
+           :param sketch: Quantile sketch, updated
+           :type sketch: dictionary
+
+           :param values: Values to add
+           :type values: numpy array
+
+         Returns:
+           :return: Quantile sketch with the values
+           :rtype: dictionary
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    return merge_sketch(sketch, {"capacity": sketch["capacity"], "levels": [values], "offsets": [0], "n": values.size, "bound": 0})
+
+
+def merge_sketch(sketch, other):
+    """Function to merge the quantile sketches of two samples. The rank error bounds add up.
+         Arguments:
+           :param sketch: Quantile sketch of the first sample, updated
+           :type sketch: dictionary
+
+           :param other: Quantile sketch of the second sample, with the same capacity
+           :type other: dictionary
+
+         Returns:
+           :return: Quantile sketch of both samples
+           :rtype: dictionary
+    """
+    if other["capacity"] != sketch["capacity"]:
+        raise ValueError("Only sketches with the same error bound can be merged")
+    for level, values in enumerate(other["levels"]):
+        if level == len(sketch["levels"]):
+            sketch["levels"].append(values)
+            sketch["offsets"].append(other["offsets"][level])
+        else:
+            sketch["levels"][level] = np.concatenate([sketch["levels"][level], values])
+    sketch["n"] += other["n"]
+    sketch["bound"] += other["bound"]
+    compact(sketch)
+    return sketch
+
+
+def sketch_quantile(sketch, q):
+    """Function to estimate a quantile from a quantile sketch, interpolating between the two values around
+        position q*(n-1) as numpy.quantile does. When the sketch holds all the values, the quantile is exact.
+         Arguments:
+           :param sketch: Quantile sketch
+           :type sketch: dictionary
+
+           :param q: Probability of the quantile, 0.5 for the median
+           :type q: float
+
+         Returns:
+           :return: Quantile, NaN for an empty sketch
+           :rtype: float
+    """
+    if sketch["n"] == 0:
+        return np.nan
+    values = np.concatenate(sketch["levels"])
+    weights = np.concatenate([np.full(level_values.size, 2**level) for level, level_values in enumerate(sketch["levels"])])
+    order = np.argsort(values, kind="stable")
+    values, ends = values[order], np.cumsum(weights[order])
+    position = q*(sketch["n"]-1)
+    below, above = values[np.searchsorted(ends, [math.floor(position), math.ceil(position)], side="right")]
+    return below + (above-below)*(position-math.floor(position))
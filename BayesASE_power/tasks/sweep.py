@@ -0,0 +1,293 @@
+import configparser
+import itertools
+import os
+import zlib
+import numpy as np
+import pandas as pd
+from tasks import count_store
+from tasks import merge_catalog
+from tasks import simulate_nbmodel
+from tasks import telemetry
+
+## Parameter sweeps. A sweep file is an INI file whose [sweep] section gives each simulation parameter as a
+## list of values ("0.5 0.6 0.7"), an inclusive range ("0.6:0.9:0.1") or a Latin-hypercube interval
+## ("lhs 0.01 0.1"). The scenarios are every combination of the lists and ranges, crossed with lhs_samples
+## Latin-hypercube points of the intervals. q sets both rsim-g1 and rsim-g2 (map bias), phi is the negative
+## binomial dispersion and biorepsd the standard deviation of the log biorep effects. Parameters left out
+## take the values of the R simulator.
+SCENARIO_COLUMNS = ["theta", "rsim-g1", "rsim-g2", "phi", "biorepsd", "nbiorep", "n_allele_specific_reads", "simruns"]
+PARAMETER_DEFAULTS = {"theta": None, "q": None, "rsim-g1": str(simulate_nbmodel.Q_TEST), "rsim-g2": str(simulate_nbmodel.Q_LINE),
+                      "phi": str(simulate_nbmodel.TRUE_PHI), "biorepsd": str(simulate_nbmodel.BIOREP_SD),
+                      "nbiorep": None, "n_allele_specific_reads": None, "simruns": None}
+INTEGER_PARAMETERS = ["nbiorep", "n_allele_specific_reads", "simruns"]
+## Bounds of each parameter, (lower, upper, lower bound included)
+PARAMETER_BOUNDS = {"theta": (0, 1, False), "q": (0, 1, False), "rsim-g1": (0, 1, False), "rsim-g2": (0, 1, False),
+                    "phi": (0, np.inf, False), "biorepsd": (0, np.inf, True), "nbiorep": (1, np.inf, True),
+                    "n_allele_specific_reads": (1, np.inf, True), "simruns": (1, np.inf, True)}
+SWEEP_OPTIONS = {"sets": "2", "lhs_samples": "10"}
+## Largest number of counts held at once. Scenarios with the same nbiorep and simruns are drawn together in
+## batches of at most this size (at least one dataset per batch). Each dataset is drawn from its own random
+## stream, keyed on its set and filename, so that its counts do not depend on the other scenarios of the sweep
+## or on the batch size.
+MAX_BATCH_VALUES = 2**24
+
+
+def format_value(value, integer=False):
+    """Function to write a value of a parameter the way it appears in the filenames
+         Arguments:
+           :param value: Value of the parameter
+           :type value: float
+
+           :param integer: If True, the value is rounded to an integer
+           :type integer: bool
+
+         Returns:
+           :return: Shortest representation with up to 6 significant digits, e.g. '0.6' or '960'
+           :rtype: string
+    """
+    if integer:
+        return str(int(round(value)))
+    return "{:.6g}".format(value)
+
+
+def parse_values(spec, integer=False):
+    """Function to read the specification of one parameter of a sweep
+         Arguments:
+           :param spec: Values separated by spaces, start:stop:step, or lhs low high
+           :type spec: string
+
+           :param integer: If True, values are rounded to integers
+           :type integer: bool
+
+         Returns:
+           :return: ('values', list of values as strings) or ('lhs', (low, high))
+           :rtype: tuple
+    """
+    fields = spec.split()
+    if fields and fields[0] == "lhs":
+        if len(fields) != 3 or float(fields[1]) >= float(fields[2]):
+            raise ValueError("A Latin-hypercube interval is 'lhs low high' with low < high, not '" + spec + "'")
+        return "lhs", (float(fields[1]), float(fields[2]))
+    if len(fields) == 1 and ":" in fields[0]:
+        start, stop, step = [float(value) for value in fields[0].split(":")]
+        if step <= 0 or stop < start:
+            raise ValueError("A range is 'start:stop:step' with start <= stop and step > 0, not '" + spec + "'")
+        values = np.arange(round((stop-start)/step) + 1)*step + start
+        return "values", [format_value(value, integer) for value in values]
+    if not fields:
+        raise ValueError("No values given")
+    return "values", [format_value(float(value), integer) if integer else value for value in fields]
+
+
+def latin_hypercube(nsample, ndim, rng):
+    """Function to draw a Latin-hypercube sample of the unit cube: each dimension is cut into nsample strata
+        and each stratum holds exactly one point
+         Arguments:
+           :param nsample: Number of points
+           :type nsample: int
+
+           :param ndim: Number of dimensions
+           :type ndim: int
+
+           :param rngs: Random number generator of each dataset
+           :type rngs: list
+
+         Returns:
+           :return: Array of shape (nsample, ndim) with values in [0, 1)
+           :rtype: numpy array
+    """
+    strata = np.column_stack([rng.permutation(nsample) for dim in range(ndim)]) if ndim > 0 else np.zeros((nsample, 0))
+    return (strata + rng.random((nsample, ndim)))/nsample
+
+
+def read_sweep(sweep_file):
+    """Function to read a sweep file
+         Arguments:
+           :param sweep_file: INI file with a [sweep] section
+           :type sweep_file: string
+
+         Returns:
+           :return: Specification of each parameter given in the file, and the options sets and lhs_samples
+           :rtype: tuple (dictionary, dictionary)
+    """
+    config = configparser.ConfigParser(inline_comment_prefixes=("#", ";"))
+    config.optionxform = str ## Keep rsim-g1 and rsim-g2 as written
+    if not config.read(sweep_file):
+        raise ValueError("Cannot read " + sweep_file)
+    if not config.has_section("sweep"):
+        raise ValueError(sweep_file + " has no [sweep] section")
+    section = dict(config["sweep"])
+    unknown = sorted(set(section) - set(PARAMETER_DEFAULTS) - set(SWEEP_OPTIONS))
+    if unknown:
+        raise ValueError("Unknown sweep parameter(s): " + ", ".join(unknown))
+    options = {option: int(section.get(option, default)) for option, default in SWEEP_OPTIONS.items()}
+    specs = {name: section[name] for name in PARAMETER_DEFAULTS if name in section}
+    return specs, options
+
+
+def expand_sweep(specs, lhs_samples=10, rng=None):
+    """Function to expand the specification of a sweep into scenarios
+         Arguments:
+           :param specs: Specification of each parameter, as in parse_values. theta, nbiorep,
+                n_allele_specific_reads and simruns are required.
+           :type specs: dictionary
+
+           :param lhs_samples: Number of Latin-hypercube points, if a parameter is given as an interval
+           :type lhs_samples: int
+
+           :param rng: Random number generator of the Latin-hypercube sample
+           :type rng: numpy Generator
+
+         Returns:
+           :return: One row per scenario with the SCENARIO_COLUMNS, as strings
+           :rtype: Pandas DataFrame
+    """
+    missing = [name for name, default in PARAMETER_DEFAULTS.items() if default is None and name != "q" and name not in specs]
+    if missing:
+        raise ValueError("Missing sweep parameter(s): " + ", ".join(missing))
+    if "q" in specs and ("rsim-g1" in specs or "rsim-g2" in specs):
+        raise ValueError("Give the map bias either as q or as rsim-g1 and rsim-g2")
+    if rng is None:
+        rng = np.random.default_rng()
+    names = [name for name in PARAMETER_DEFAULTS if name in specs or PARAMETER_DEFAULTS[name] is not None]
+    if "q" in specs:
+        names = [name for name in names if name not in ["rsim-g1", "rsim-g2"]]
+    grid, intervals = {}, {}
+    for name in names:
+        kind, values = parse_values(specs.get(name, PARAMETER_DEFAULTS[name]), name in INTEGER_PARAMETERS)
+        (intervals if kind == "lhs" else grid)[name] = values
+
+    df_grid = pd.DataFrame(list(itertools.product(*grid.values())), columns=list(grid))
+    if intervals:
+        sample = latin_hypercube(lhs_samples, len(intervals), rng)
+        df_lhs = pd.DataFrame({name: [format_value(low + (high-low)*value, name in INTEGER_PARAMETERS) for value in sample[:, dim]]
+                               for dim, (name, (low, high)) in enumerate(intervals.items())})
+        df_grid = df_grid.merge(df_lhs, how="cross")
+    if "q" in df_grid.columns:
+        df_grid["rsim-g1"] = df_grid["rsim-g2"] = df_grid.pop("q")
+
+    for name in SCENARIO_COLUMNS:
+        lower, upper, closed = PARAMETER_BOUNDS[name]
+        values = df_grid[name].astype(float)
+        if ((values < lower) if closed else (values <= lower)).any() or (values >= upper).any():
+            raise ValueError(name + " must be in " + ("[" if closed else "(") + str(lower) + ", " + str(upper) + ")")
+    return df_grid[SCENARIO_COLUMNS].drop_duplicates().reset_index(drop=True)
+
+
+def sweep_batches(df_scenarios, sets, max_values=MAX_BATCH_VALUES):
+    """Function to group the datasets of a sweep into batches drawn in one array computation
+         Arguments:
+           :param df_scenarios: Scenarios from expand_sweep
+           :type df_scenarios: Pandas DataFrame
+
+           :param sets: Number of datasets (sets) per scenario
+           :type sets: int
+
+           :param max_values: Largest number of counts of a batch (at least one dataset per batch)
+           :type max_values: int
+
+         Returns:
+           :return: Group index, batch index and list of (scenario index, set) of each batch
+           :rtype: list
+    """
+    batches = []
+    groups = df_scenarios.groupby([df_scenarios["nbiorep"].astype(int), df_scenarios["simruns"].astype(int)], sort=True)
+    for group, ((nbiorep, simruns), df_group) in enumerate(groups):
+        datasets = [(index, set_number) for index in df_group.index for set_number in range(1, sets+1)]
+        size = max(1, max_values//(simruns*nbiorep*3))
+        for batch, start in enumerate(range(0, len(datasets), size)):
+            batches.append((group, batch, datasets[start:start+size]))
+    return batches
+
+
+def dataset_seed(entropy, set_number, filename):
+    """Function to derive the seed of a sweep dataset from the master seed, independently of the other datasets
+         Returns:
+           :return: Seed sequence of the dataset
+           :rtype: numpy SeedSequence
+    """
+    return np.random.SeedSequence(entropy, spawn_key=(1, int(set_number), zlib.crc32(os.path.basename(filename).encode())))
+
+
+def simulate_batch(df_scenarios, datasets, rngs):
+    """Function to draw the gamma-Poisson counts of a batch of datasets with the same nbiorep and simruns into
+        one array, each dataset with its own theta, map bias, dispersion, biorep effects, depth and random stream
+         Arguments:
+           :param df_scenarios: Scenarios from expand_sweep
+           :type df_scenarios: Pandas DataFrame
+
+           :param datasets: (Scenario index, set) of each dataset of the batch
+           :type datasets: list
+
+           :param rngs: Random number generator of each dataset
+           :type rngs: list
+
+         Returns:
+           :return: Array of shape (datasets, simruns, nbiorep, 3) with the g1, g2 and both counts
+           :rtype: numpy array
+    """
+    rows = df_scenarios.loc[[index for index, set_number in datasets]]
+    nbiorep, simruns = int(rows["nbiorep"].iloc[0]), int(rows["simruns"].iloc[0])
+    means = np.stack([simulate_nbmodel.nb_means(float(row["theta"]), nbiorep, float(row["n_allele_specific_reads"]),
+                                                float(row["rsim-g1"]), float(row["rsim-g2"]), float(row["biorepsd"]))
+                      for row in rows.to_dict("records")])
+    phi = rows["phi"].astype(float).to_numpy()
+    counts = np.empty((len(datasets), simruns, nbiorep, 3), dtype=np.int64)
+    for i, rng in enumerate(rngs):
+        counts[i] = rng.poisson(rng.gamma(1/phi[i], means[i]*phi[i], size=(simruns, nbiorep, 3)))
+    return counts
+
+
+def run_sweep(df_scenarios, sets, outdir, entropy, file_format="tsv", max_values=MAX_BATCH_VALUES):
+    """Function to simulate every dataset of a sweep and save them as run_read_count_simul.py does, under
+        outdir/H1_null and outdir/H1_not_null
+         Arguments:
+           :param df_scenarios: Scenarios from expand_sweep
+           :type df_scenarios: Pandas DataFrame
+
+           :param sets: Number of datasets (sets) per scenario
+           :type sets: int
+
+           :param outdir: Output directory
+           :type outdir: string
+
+           :param entropy: Master seed. Each dataset is drawn from SeedSequence(entropy, spawn_key=(1, set, crc32 of its filename))
+           :type entropy: int
+
+           :param file_format: Either "tsv" or "npz"
+           :type file_format: string
+
+           :param max_values: Largest number of counts of a batch
+           :type max_values: int
+
+         Returns:
+           :return: One row per dataset with its scenario, set and path
+           :rtype: Pandas DataFrame
+    """
+    rows = []
+    for group, batch, datasets in sweep_batches(df_scenarios, sets, max_values):
+        first = df_scenarios.loc[datasets[0][0]]
+        params = {"nbiorep": first["nbiorep"], "simruns": first["simruns"], "datasets": len(datasets), "format": file_format}
+        with telemetry.stage("sweep", params):
+            outfiles = []
+            for index, set_number in datasets:
+                row = df_scenarios.loc[index]
+                hypothesis = "H1_null" if float(row["theta"]) == merge_catalog.NULL_THETA else "H1_not_null"
+                os.makedirs(os.path.join(outdir, hypothesis), exist_ok=True)
+                outfiles.append(simulate_nbmodel.simulation_filename(os.path.join(outdir, hypothesis, "out_set_" + str(set_number)),
+                                                                     row["theta"], row["simruns"], row["nbiorep"],
+                                                                     row["n_allele_specific_reads"], row["rsim-g1"], row["rsim-g2"],
+                                                                     "." + file_format, row["phi"], row["biorepsd"]))
+            rngs = [np.random.default_rng(dataset_seed(entropy, set_number, outfile))
+                    for (index, set_number), outfile in zip(datasets, outfiles)]
+            counts = simulate_batch(df_scenarios, datasets, rngs)
+            for (index, set_number), outfile, dataset in zip(datasets, outfiles, counts):
+                row = df_scenarios.loc[index]
+                if file_format == "npz":
+                    header = count_store.scenario_header(row["theta"], row["simruns"], row["nbiorep"], row["n_allele_specific_reads"],
+                                                         row["rsim-g1"], row["rsim-g2"], row["phi"], row["biorepsd"])
+                    count_store.write_counts(outfile, header, {"c1": dataset})
+                else:
+                    simulate_nbmodel.write_simulation(outfile, dataset, float(row["rsim-g1"]), float(row["rsim-g2"]))
+                rows.append(dict(row, set=set_number, path=outfile))
+    return pd.DataFrame(rows, columns=SCENARIO_COLUMNS + ["set", "path"])
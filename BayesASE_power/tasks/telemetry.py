@@ -0,0 +1,176 @@
+import contextlib
+import datetime
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+## Optional instrumentation of the pipeline. It is switched on by setting BAYESASE_TELEMETRY to the path of a
+## JSON-lines log, which the --telemetry option of the scripts does, so that worker and child processes inherit
+## it. Each stage of a script and each child command appends one record with its wall time, CPU time, peak
+## resident memory and bytes read and written, tagged with the scenario parameters. When the variable is not
+## set, stage() and call() only run the work.
+## The scope of a record says what its resources cover. 'process': a stage run while its process had no other
+## thread, whose CPU time includes the children it waited for. 'thread': a stage run next to other threads (e.g.
+## the approximate fits of run_nbmodel_fits.py or the reads of summarize_posterior_estimates.py), whose CPU time
+## is that of its own thread only, while its peak memory and bytes read and written are those of the whole
+## process. 'command': a child command, measured on its own. Peak memory is the high-water mark of the process,
+## so it is only the peak of a stage in processes that run one task at a time.
+ENVIRONMENT_VARIABLE = "BAYESASE_TELEMETRY"
+RECORD_COLUMNS = ["time", "script", "pid", "kind", "stage", "params", "status", "wall_s", "cpu_s", "peak_rss_mb",
+                  "read_bytes", "written_bytes", "scope"]
+
+
+def enable(logfile):
+    """Function to switch telemetry on for this process and the processes it starts
+         Arguments:
+           :param logfile: JSON-lines log to which to append the records
+           :type logfile: string
+    """
+    os.environ[ENVIRONMENT_VARIABLE] = os.path.abspath(logfile)
+
+
+def log_path():
+    """Function to read the log of the records
+         Returns:
+           :return: Path of the log, or None if telemetry is off
+           :rtype: string
+    """
+    return os.environ.get(ENVIRONMENT_VARIABLE) or None
+
+
+def peak_rss_kb():
+    """Function to read the peak resident memory of the current process
+         Returns:
+           :return: Peak resident set size in kB
+           :rtype: int
+    """
+    ## On Linux, ru_maxrss survives exec, so a new process would report the peak of the process that started
+    ## it; VmHWM only covers the current process image
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak//1024 if sys.platform == "darwin" else peak ## ru_maxrss is in bytes on macOS and in kB on Linux
+
+
+def io_bytes():
+    """Function to read the bytes read and written so far by the current process
+         Returns:
+           :return: Bytes read and written through system calls (rchar and wchar of /proc/self/io), or
+                estimated from the blocks of the file system on systems without /proc
+           :rtype: tuple (int, int)
+    """
+    if os.path.exists("/proc/self/io"):
+        counters = {}
+        with open("/proc/self/io") as io:
+            for line in io:
+                name, value = line.split(":")
+                counters[name] = int(value)
+        return counters["rchar"], counters["wchar"]
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_inblock*512, usage.ru_oublock*512
+
+
+def write_record(kind, stage, params, status, wall_s, cpu_s, peak_rss_mb, read_bytes, written_bytes, scope):
+    """Function to append one record to the log, as a single write so that processes can share the log"""
+    record = dict(zip(RECORD_COLUMNS, [datetime.datetime.now().isoformat(timespec="milliseconds"),
+                                       os.path.basename(sys.argv[0]), os.getpid(), kind, stage, params or {}, status,
+                                       round(wall_s, 4), round(cpu_s, 4), round(peak_rss_mb, 1), read_bytes, written_bytes,
+                                       scope]))
+    line = (json.dumps(record, default=str) + "\n").encode()
+    descriptor = os.open(log_path(), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(descriptor, line)
+    finally:
+        os.close(descriptor)
+
+
+@contextlib.contextmanager
+def stage(name, params=None):
+    """Function to record the resources used by a block of code, e.g. with telemetry.stage("merge", params):
+         Arguments:
+           :param name: Name of the stage, e.g. 'simulate', 'merge', 'fit' or 'summarize'
+           :type name: string
+
+           :param params: Scenario parameters of the stage
+           :type params: dictionary
+    """
+    if log_path() is None:
+        yield
+        return
+    start_wall = time.perf_counter()
+    start_times = os.times()
+    start_thread = time.thread_time()
+    start_threads = threading.active_count()
+    start_read, start_written = io_bytes()
+    status = "error"
+    try:
+        yield
+        status = "ok"
+    finally:
+        if start_threads == 1 and threading.active_count() == 1:
+            times = os.times()
+            scope, cpu_s = "process", sum(times[:4]) - sum(start_times[:4]) ## Own and waited-for children user and system time
+        else:
+            scope, cpu_s = "thread", time.thread_time() - start_thread
+        read, written = io_bytes()
+        write_record("stage", name, params, status, time.perf_counter()-start_wall, cpu_s, peak_rss_kb()/1024,
+                     read-start_read, written-start_written, scope)
+
+
+def call(cmd, name, params=None, **kwargs):
+    """Function to run a command like subprocess.call, recording the resources of the child process
+         Arguments:
+           :param cmd: Command line
+           :type cmd: list
+
+           :param name: Name of the stage the command belongs to
+           :type name: string
+
+           :param params: Scenario parameters of the command
+           :type params: dictionary
+
+           :param kwargs: Other arguments of subprocess.Popen (cwd, stdout, stderr...)
+           :type kwargs: dictionary
+
+         Returns:
+           :return: Return code of the command
+           :rtype: int
+    """
+    if log_path() is None:
+        return subprocess.call(cmd, **kwargs)
+    start_wall = time.perf_counter()
+    with subprocess.Popen(cmd, **kwargs) as process:
+        ## wait4 gives the resources of this child only, even when other threads run commands
+        pid, wait_status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(wait_status)
+    scale = 1 if sys.platform == "darwin" else 1024
+    write_record("command", name, dict(params or {}, command=os.path.basename(str(cmd[0]))),
+                 "ok" if process.returncode == 0 else "error", time.perf_counter()-start_wall,
+                 usage.ru_utime+usage.ru_stime, usage.ru_maxrss*scale/2**20, usage.ru_inblock*512, usage.ru_oublock*512,
+                 "command")
+    return process.returncode
+
+
+def read_log(logfile):
+    """Function to read the records of a log, one row per record with the parameters as a string
+         Arguments:
+           :param logfile: JSON-lines log
+           :type logfile: string
+
+         Returns:
+           :return: Records of the log
+           :rtype: list
+    """
+    records = []
+    with open(logfile) as log:
+        for line in log:
+            if line.strip():
+                records.append(json.loads(line))
+    return records
@@ -0,0 +1,450 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import socket
+import time
+import traceback
+import zlib
+from tasks import pipeline
+
+## File-based work queue, to drain the tasks of a pipeline graph from any number of worker processes on any
+## number of hosts sharing a filesystem (e.g. NFS). Every worker builds the same task graph and keeps its state
+## in the queue directory:
+##   leases/<key>.<generation>   lease of a task, created atomically (hard link of a private file, which is
+##                               atomic on NFS too). Its modification time is renewed while the task runs.
+##   done/<key>                  JSON marker written when the task succeeded, with its signature
+##   failed/<key>                JSON marker with the error of a task that failed, to remove to retry it
+##   clock/<worker>              file touched to read the time of the file server, so that the lease times of
+##                               hosts with different clocks can be compared
+## A lease older than the lease time belongs to a dead worker: it is taken over by creating the next
+## generation, which only one worker can do. A worker that finds a newer generation of its lease stops its task.
+## The signature of a task is the hash of its parameters and of the signatures of the tasks it depends on, so
+## a task whose parameters, or whose upstream parameters, changed is run again.
+LEASE_SECONDS = 300      ## Age after which a lease that was not renewed is taken over
+POLL_SECONDS = 5         ## Wait between two scans of the queue when no task is ready
+
+
+def task_key(name):
+    """Function to name the files of a task in the queue directory
+         Arguments:
+           :param name: Unique name of the task
+           :type name: string
+
+         Returns:
+           :return: First 20 characters of the SHA-1 hash of the name
+           :rtype: string
+    """
+    return hashlib.sha1(name.encode()).hexdigest()[:20]
+
+
+def worker_name(index=0):
+    """Function to name a worker uniquely across hosts
+         Arguments:
+           :param index: Number of the worker on this host
+           :type index: int
+
+         Returns:
+           :return: <host>_<pid>_<index>
+           :rtype: string
+    """
+    return socket.gethostname() + "_" + str(os.getpid()) + "_" + str(index)
+
+
+def make_queue(queue_dir):
+    """Function to create the folders of a queue, which may already exist
+         Arguments:
+           :param queue_dir: Directory of the queue, on the shared filesystem
+           :type queue_dir: string
+    """
+    for folder in ["leases", "done", "failed", "clock"]:
+        os.makedirs(os.path.join(queue_dir, folder), exist_ok=True)
+
+
+def create_exclusive(path, content):
+    """Function to create a file only if it does not exist, atomically even on NFS, by hard linking a private file
+         Arguments:
+           :param path: File to create
+           :type path: string
+
+           :param content: Content of the file
+           :type content: string
+
+         Returns:
+           :return: True if this call created the file
+           :rtype: bool
+    """
+    private = os.path.join(os.path.dirname(path), "." + os.path.basename(path) + "." + worker_name() + ".tmp")
+    with open(private, "w") as output:
+        output.write(content)
+    try:
+        os.link(private, path)
+        return True
+    except FileExistsError:
+        ## A retransmitted link request may fail although the link was made: the link count tells
+        return os.stat(private).st_nlink == 2
+    finally:
+        os.remove(private)
+
+
+def write_marker(path, record):
+    """Function to write a done or failed marker, replacing the previous one in a single step
+         Arguments:
+           :param path: Marker file
+           :type path: string
+
+           :param record: Content of the marker
+           :type record: dictionary
+    """
+    temporary = os.path.join(os.path.dirname(path), "." + os.path.basename(path) + "." + worker_name() + ".tmp")
+    with open(temporary, "w") as output:
+        json.dump(record, output, sort_keys=True)
+    os.replace(temporary, path)
+
+
+def read_markers(folder, known=None):
+    """Function to read the done or failed markers of a queue
+         Arguments:
+           :param folder: done or failed folder of the queue
+           :type folder: string
+
+           :param known: Markers read at a previous scan, which are not read again if their file is still there
+           :type known: dictionary
+
+         Returns:
+           :return: Content of each marker, by task key
+           :rtype: dictionary
+    """
+    known = known or {}
+    markers = {}
+    for filename in os.listdir(folder):
+        if filename.startswith("."):
+            continue
+        if filename in known:
+            markers[filename] = known[filename]
+            continue
+        try:
+            with open(os.path.join(folder, filename)) as marker:
+                markers[filename] = json.load(marker)
+        except (FileNotFoundError, ValueError):
+            continue ## Removed or replaced meanwhile, read again at the next scan
+    return markers
+
+
+def server_time(queue_dir, worker):
+    """Function to read the current time of the shared filesystem, as the modification time of a touched file
+         Arguments:
+           :param queue_dir: Directory of the queue
+           :type queue_dir: string
+
+           :param worker: Name of the worker
+           :type worker: string
+
+         Returns:
+           :return: Time in seconds since the epoch
+           :rtype: float
+    """
+    clock = os.path.join(queue_dir, "clock", worker)
+    with open(clock, "a"):
+        pass
+    os.utime(clock, None)
+    return os.stat(clock).st_mtime
+
+
+def lease_generations(queue_dir):
+    """Function to list the leases of a queue
+         Arguments:
+           :param queue_dir: Directory of the queue
+           :type queue_dir: string
+
+         Returns:
+           :return: Generations of the leases of each task key, in increasing order
+           :rtype: dictionary
+    """
+    generations = {}
+    for filename in os.listdir(os.path.join(queue_dir, "leases")):
+        key, separator, generation = filename.rpartition(".")
+        if filename.startswith(".") or not separator or not generation.isdigit():
+            continue
+        generations.setdefault(key, []).append(int(generation))
+    return {key: sorted(values) for key, values in generations.items()}
+
+
+def lease_path(queue_dir, key, generation):
+    """Function to name the lease file of one generation of a task
+         Arguments:
+           :param queue_dir: Directory of the queue
+           :type queue_dir: string
+
+           :param key: Key of the task
+           :type key: string
+
+           :param generation: Generation of the lease
+           :type generation: int
+
+         Returns:
+           :return: Path of the lease file
+           :rtype: string
+    """
+    return os.path.join(queue_dir, "leases", key + "." + str(generation))
+
+
+def claim(queue_dir, key, name, worker, generations, lease_seconds=LEASE_SECONDS):
+    """Function to claim a task that is not leased, or whose lease expired
+         Arguments:
+           :param queue_dir: Directory of the queue
+           :type queue_dir: string
+
+           :param key: Key of the task
+           :type key: string
+
+           :param name: Name of the task, saved in the lease
+           :type name: string
+
+           :param worker: Name of the worker
+           :type worker: string
+
+           :param generations: Generations of the leases of the task found at the last scan
+           :type generations: list
+
+           :param lease_seconds: Age after which a lease that was not renewed is taken over
+           :type lease_seconds: float
+
+         Returns:
+           :return: Generation of the new lease, or None if the task is leased by another worker
+           :rtype: int
+    """
+    generation = 0
+    if generations:
+        try:
+            age = server_time(queue_dir, worker) - os.stat(lease_path(queue_dir, key, generations[-1])).st_mtime
+        except FileNotFoundError:
+            return None ## Released or taken over since the scan
+        if age < lease_seconds:
+            return None
+        generation = generations[-1]+1
+    content = json.dumps({"task": name, "worker": worker, "claimed": time.time()})
+    if not create_exclusive(lease_path(queue_dir, key, generation), content):
+        return None
+    for previous in generations:
+        try:
+            os.remove(lease_path(queue_dir, key, previous))
+        except FileNotFoundError:
+            pass
+    return generation
+
+
+def lost(queue_dir, key, generation):
+    """Function to tell whether another worker took over a lease
+         Arguments:
+           :param queue_dir: Directory of the queue
+           :type queue_dir: string
+
+           :param key: Key of the task
+           :type key: string
+
+           :param generation: Generation of the lease held
+           :type generation: int
+
+         Returns:
+           :return: True if the lease was taken over or removed
+           :rtype: bool
+    """
+    return (os.path.exists(lease_path(queue_dir, key, generation+1)) or
+            not os.path.exists(lease_path(queue_dir, key, generation)))
+
+
+def task_signatures(tasks, depends_on):
+    """Function to compute the signature of each task, from its parameters and those of the tasks it depends on
+         Arguments:
+           :param tasks: Tasks of the graph
+           :type tasks: list
+
+           :param depends_on: Names of the tasks each task depends on
+           :type depends_on: dictionary
+
+         Returns:
+           :return: Signature of each task, by name
+           :rtype: dictionary
+    """
+    by_name = {task["name"]: task for task in tasks}
+    signatures = {}
+
+    def signature(name, path=()):
+        if name not in signatures:
+            if name in path:
+                raise ValueError("The task graph has a cycle through " + name)
+            signatures[name] = pipeline.params_hash({"params": by_name[name]["params"],
+                                                     "inputs": [signature(dependency, path + (name,)) for dependency in depends_on[name]]})
+        return signatures[name]
+
+    for task in tasks:
+        signature(task["name"])
+    return signatures
+
+
+def run_child(task, error_file):
+    """Function to run a task in a child process of a worker, saving its error if it fails
+         Arguments:
+           :param task: Task of the graph
+           :type task: dictionary
+
+           :param error_file: File to which to write the traceback of an error
+           :type error_file: string
+    """
+    try:
+        pipeline.run_task(task)
+    except BaseException:
+        with open(error_file, "w") as output:
+            output.write(traceback.format_exc())
+        raise SystemExit(1)
+
+
+def run_leased(task, queue_dir, key, generation, lease_seconds=LEASE_SECONDS):
+    """Function to run a claimed task in a child process, renewing its lease until it ends. The child is stopped
+        if the lease is taken over.
+         Arguments:
+           :param task: Task of the graph
+           :type task: dictionary
+
+           :param queue_dir: Directory of the queue
+           :type queue_dir: string
+
+           :param key: Key of the task
+           :type key: string
+
+           :param generation: Generation of the lease held
+           :type generation: int
+
+           :param lease_seconds: Age after which a lease that was not renewed is taken over
+           :type lease_seconds: float
+
+         Returns:
+           :return: 'done', 'failed' or 'lost', and the error of a failed task
+           :rtype: tuple (string, string)
+    """
+    error_file = os.path.join(queue_dir, "leases", "." + key + "." + str(generation) + ".error")
+    child = multiprocessing.get_context("fork").Process(target=run_child, args=(task, error_file))
+    child.start()
+    while True:
+        child.join(lease_seconds/5)
+        if child.exitcode is not None:
+            break
+        if lost(queue_dir, key, generation):
+            child.terminate()
+            child.join()
+            return "lost", ""
+        try:
+            os.utime(lease_path(queue_dir, key, generation), None)
+        except FileNotFoundError:
+            pass ## Noticed as lost at the next renewal
+    if child.exitcode == 0:
+        return "done", ""
+    error = "Exit code " + str(child.exitcode)
+    if os.path.exists(error_file):
+        with open(error_file) as errors:
+            error = errors.read()
+        os.remove(error_file)
+    return "failed", error
+
+
+def drain(tasks, queue_dir, worker, lease_seconds=LEASE_SECONDS, poll_seconds=POLL_SECONDS, state_file=None):
+    """Function to run the tasks of a graph from a shared queue until none is left to run. Several workers may
+        drain the same graph at the same time, on the same or other hosts.
+         Arguments:
+           :param tasks: Tasks of the graph, the same for every worker
+           :type tasks: list
+
+           :param queue_dir: Directory of the queue, on the shared filesystem
+           :type queue_dir: string
+
+           :param worker: Name of the worker, unique across hosts
+           :type worker: string
+
+           :param lease_seconds: Age after which a lease that was not renewed is taken over
+           :type lease_seconds: float
+
+           :param poll_seconds: Wait between two scans of the queue when no task is ready
+           :type poll_seconds: float
+
+           :param state_file: Optional state file of pipeline.run_tasks. Tasks it records as up to date are
+                marked done instead of being run again.
+           :type state_file: string
+
+         Returns:
+           :return: Names of the tasks this worker ran, and names of the tasks that failed or were skipped
+           :rtype: tuple (list, list)
+    """
+    make_queue(queue_dir)
+    depends_on = pipeline.dependencies(tasks)
+    signatures = task_signatures(tasks, depends_on)
+    keys = {task["name"]: task_key(task["name"]) for task in tasks}
+    expected = {keys[name]: signature for name, signature in signatures.items()}
+    ## Workers start scanning at different tasks, to claim different ones
+    start = zlib.crc32(worker.encode()) % max(len(tasks), 1)
+    order = tasks[start:] + tasks[:start]
+    state = pipeline.load_state(state_file) if state_file else None
+    ran, confirmed, done = [], set(), {}
+
+    def finished(task, done):
+        if task["name"] in confirmed:
+            return True
+        record = done.get(keys[task["name"]])
+        if (record is not None and record.get("signature") == signatures[task["name"]] and
+                all(os.path.exists(output) for output in task["outputs"])):
+            confirmed.add(task["name"])
+        return task["name"] in confirmed
+
+    while True:
+        ## Markers of another signature (an earlier config) are read again, as they may be replaced meanwhile
+        done = read_markers(os.path.join(queue_dir, "done"), {key: record for key, record in done.items()
+                                                              if record.get("signature") == expected.get(key)})
+        failed = read_markers(os.path.join(queue_dir, "failed"))
+        blocked = {task["name"] for task in tasks if failed.get(keys[task["name"]], {}).get("signature") == signatures[task["name"]]}
+        ## Tasks depending on a failed task are skipped, in the order of the graph
+        for task in tasks:
+            if any(dependency in blocked for dependency in depends_on[task["name"]]):
+                blocked.add(task["name"])
+        confirmed.difference_update(name for name in list(confirmed) if keys[name] not in done)
+        pending = [task for task in order if task["name"] not in blocked and not finished(task, done)]
+        if not pending:
+            return ran, sorted(blocked)
+        generations = lease_generations(queue_dir)
+        progressed = False
+        for task in pending:
+            name, key = task["name"], keys[task["name"]]
+            if not all(dependency in confirmed for dependency in depends_on[name]):
+                continue
+            if state is not None and pipeline.outdated(task, state) is None:
+                write_marker(os.path.join(queue_dir, "done", key), {"name": name, "signature": signatures[name], "worker": worker,
+                                                                    "status": "up to date"})
+                progressed = True
+                break
+            generation = claim(queue_dir, key, name, worker, generations.get(key, []), lease_seconds)
+            if generation is None:
+                continue
+            ## The task may have been finished and released between the scan and the claim
+            if finished(task, read_markers(os.path.join(queue_dir, "done"), done)):
+                os.remove(lease_path(queue_dir, key, generation))
+                progressed = True
+                break
+            print(name + ": claimed by " + worker)
+            begin = time.time()
+            status, error = run_leased(task, queue_dir, key, generation, lease_seconds)
+            if status == "lost":
+                print(name + ": lease taken over, stopped")
+            elif lost(queue_dir, key, generation):
+                print(name + ": lease taken over before the end, left to the new owner")
+            else:
+                record = {"name": name, "signature": signatures[name], "worker": worker, "wall_s": round(time.time()-begin, 3)}
+                if status == "done":
+                    write_marker(os.path.join(queue_dir, "done", key), record)
+                    ran.append(name)
+                else:
+                    write_marker(os.path.join(queue_dir, "failed", key), dict(record, error=error))
+                    print(name + ": failed\n" + error)
+                os.remove(lease_path(queue_dir, key, generation))
+            progressed = True
+            break
+        if not progressed:
+            time.sleep(poll_seconds)
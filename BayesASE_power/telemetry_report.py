@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import argparse
+import pandas as pd
+from tasks import telemetry
+
+## Scenario parameters identifying a scenario across stages, in the order they are reported
+SCENARIO_KEYS = ["theta", "theta1", "theta2", "nbiorep", "allelicreads", "simruns", "set", "sets", "format", "engine",
+                 "param", "task"]
+
+def getOptions():
+    parser = argparse.ArgumentParser(description="Rank the slowest stages and scenarios of a telemetry log")
+    parser.add_argument(
+        "-i",
+        "--infile",
+        action="store",
+        nargs='*',
+        help="(List of) JSON-lines log(s) written with --telemetry or BAYESASE_TELEMETRY",
+    )
+    parser.add_argument(
+        "-n",
+        "--top",
+        action="store",
+        type=int,
+        default=10,
+        help="Number of slowest scenarios to report (default: 10)",
+    )
+    parser.add_argument(
+        "-s",
+        "--stage",
+        action="store",
+        required=False,
+        help="Optional stage to which to restrict the ranking of scenarios, e.g. 'fit'. Default - every stage",
+    )
+    parser.add_argument(
+        "-o",
+        "--outfile",
+        action="store",
+        required=False,
+        help="Optional CSV file to which to save the totals per stage",
+    )
+    args = parser.parse_args()
+    return args
+
+
+def scenario_label(params):
+    """Function to write the scenario parameters of a record on one line
+         Arguments:
+           :param params: Parameters of the record
+           :type params: dictionary
+
+         Returns:
+           :return: key_value pairs, scenario keys first
+           :rtype: string
+    """
+    keys = [key for key in SCENARIO_KEYS if key in params] + sorted(key for key in params if key not in SCENARIO_KEYS)
+    return "_".join(str(key) + "_" + str(params[key]) for key in keys)
+
+
+def stage_totals(df_log):
+    """Function to add up the records of each stage
+         Arguments:
+           :param df_log: Records of the log
+           :type df_log: Pandas DataFrame
+
+         Returns:
+           :return: Number of records, total and mean wall time, total CPU time, largest peak memory and total
+                bytes read and written of each stage and kind of record, slowest first
+           :rtype: Pandas DataFrame
+    """
+    df_totals = df_log.groupby(["stage", "kind"]).agg(records=("wall_s", "size"), errors=("status", lambda status: (status != "ok").sum()),
+                                                      wall_s=("wall_s", "sum"), mean_wall_s=("wall_s", "mean"),
+                                                      cpu_s=("cpu_s", "sum"), peak_rss_mb=("peak_rss_mb", "max"),
+                                                      read_mb=("read_bytes", "sum"), written_mb=("written_bytes", "sum"))
+    df_totals["read_mb"] = df_totals["read_mb"]/2**20
+    df_totals["written_mb"] = df_totals["written_mb"]/2**20
+    return df_totals.sort_values("wall_s", ascending=False).reset_index().round(3)
+
+
+def main():
+    args = getOptions()
+    records = [record for infile in args.infile for record in telemetry.read_log(infile)]
+    if not records:
+        raise SystemExit("No records in " + ", ".join(args.infile))
+    df_log = pd.DataFrame(records, columns=telemetry.RECORD_COLUMNS)
+    df_log["scenario"] = [scenario_label(params) for params in df_log["params"]]
+
+    df_totals = stage_totals(df_log)
+    with pd.option_context("display.max_rows", None, "display.max_colwidth", None, "display.width", 250):
+        print("Stages, slowest first (" + str(df_log.shape[0]) + " records):")
+        print(df_totals.to_string(index=False))
+        df_slowest = df_log if args.stage is None else df_log[df_log["stage"] == args.stage]
+        df_slowest = df_slowest.sort_values("wall_s", ascending=False).head(args.top)
+        print("\nSlowest " + str(df_slowest.shape[0]) + " scenarios" + ("" if args.stage is None else " of stage " + args.stage) + ":")
+        print(df_slowest[["stage", "kind", "scope", "scenario", "status", "wall_s", "cpu_s", "peak_rss_mb"]].to_string(index=False))
+    if args.outfile:
+        df_totals.to_csv(args.outfile, index=False)
+        print("Totals per stage saved to " + args.outfile)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tasks import work_queue
+
+## Multi-process checks of the lease logic of tasks/work_queue.py, on a local directory:
+##   python -m pytest -q tests/test_work_queue.py
+## Every check starts several processes at once, so that they race for the same lease files.
+WORKERS = 8
+CONTEXT = multiprocessing.get_context("fork")
+
+
+def claim_at_once(queue_dir, key, generations, lease_seconds, barrier, results, index):
+    """Function to claim a task as soon as every process is ready, saving the generation won (-1 if none)"""
+    barrier.wait()
+    generation = work_queue.claim(queue_dir, key, "task", work_queue.worker_name(index), generations, lease_seconds)
+    results[index] = -1 if generation is None else generation
+
+
+def race(queue_dir, key, generations, lease_seconds=work_queue.LEASE_SECONDS):
+    """Function to let WORKERS processes claim the same task at the same time, returning the generations won"""
+    barrier, results = CONTEXT.Barrier(WORKERS), CONTEXT.Array("i", WORKERS)
+    processes = [CONTEXT.Process(target=claim_at_once, args=(queue_dir, key, generations, lease_seconds, barrier, results, index))
+                 for index in range(WORKERS)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return list(results)
+
+
+def test_claim_is_exclusive(tmp_path):
+    queue_dir = str(tmp_path)
+    work_queue.make_queue(queue_dir)
+    for task in range(10):
+        key = work_queue.task_key("task " + str(task))
+        results = race(queue_dir, key, [])
+        assert sorted(results) == [-1]*(WORKERS-1) + [0]
+        assert os.listdir(os.path.join(queue_dir, "leases")).count(key + ".0") == 1
+        ## A lease that is renewed is not taken over
+        assert race(queue_dir, key, [0]) == [-1]*WORKERS
+
+
+def test_expired_lease_is_taken_over_once(tmp_path):
+    queue_dir = str(tmp_path)
+    work_queue.make_queue(queue_dir)
+    key = work_queue.task_key("task")
+    assert work_queue.claim(queue_dir, key, "task", "dead_worker", []) == 0
+    ## The worker died: its lease is not renewed any more
+    old = time.time() - 2*work_queue.LEASE_SECONDS
+    os.utime(work_queue.lease_path(queue_dir, key, 0), (old, old))
+    results = race(queue_dir, key, [0])
+    assert sorted(results) == [-1]*(WORKERS-1) + [1]
+    assert not os.path.exists(work_queue.lease_path(queue_dir, key, 0))
+    assert work_queue.lost(queue_dir, key, 0)
+    assert not work_queue.lost(queue_dir, key, 1)
+
+
+def sleep_then_write(outfile):
+    """Function of a task that takes a while, then writes its output"""
+    time.sleep(10)
+    with open(outfile, "w") as output:
+        output.write("done\n")
+
+
+def take_over(queue_dir, key, generation, delay):
+    """Function to take over a lease after a delay, as a worker that found it expired would"""
+    time.sleep(delay)
+    work_queue.claim(queue_dir, key, "task", "new_owner", [generation], lease_seconds=0)
+
+
+def test_lost_lease_stops_old_owner(tmp_path):
+    queue_dir = str(tmp_path)
+    work_queue.make_queue(queue_dir)
+    key = work_queue.task_key("task")
+    outfile = str(tmp_path/"output")
+    generation = work_queue.claim(queue_dir, key, "task", work_queue.worker_name(), [])
+    usurper = CONTEXT.Process(target=take_over, args=(queue_dir, key, generation, 1))
+    usurper.start()
+    task = {"name": "task", "function": sleep_then_write, "args": (outfile,), "inputs": [], "outputs": [], "params": {}}
+    start = time.time()
+    status, error = work_queue.run_leased(task, queue_dir, key, generation, lease_seconds=1)
+    usurper.join()
+    assert status == "lost"
+    assert time.time() - start < 5
+    assert work_queue.lost(queue_dir, key, generation)
+    ## The task was stopped, not left running next to the new owner
+    assert not multiprocessing.active_children()
+    assert not os.path.exists(outfile)
+
+
+def append_line(logfile, name, outfile):
+    """Function of a task that records each of its runs, then writes its output"""
+    descriptor = os.open(logfile, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(descriptor, (name + "\n").encode())
+    finally:
+        os.close(descriptor)
+    time.sleep(0.05)
+    with open(outfile, "w") as output:
+        output.write(name + "\n")
+
+
+def drain_worker(tasks, queue_dir, index):
+    work_queue.drain(tasks, queue_dir, work_queue.worker_name(index), lease_seconds=60, poll_seconds=0.05)
+
+
+def test_drain_runs_each_task_once(tmp_path):
+    queue_dir, logfile = str(tmp_path/"queue"), str(tmp_path/"runs.log")
+    outputs = [str(tmp_path/("output_" + str(index))) for index in range(12)]
+    tasks = [{"name": "task " + str(index), "function": append_line, "args": (logfile, "task " + str(index), outfile),
+              "inputs": [], "outputs": [outfile], "params": {"index": index}} for index, outfile in enumerate(outputs)]
+    final = str(tmp_path/"final")
+    tasks.append({"name": "final", "function": append_line, "args": (logfile, "final", final), "inputs": outputs,
+                  "outputs": [final], "params": {}})
+    processes = [CONTEXT.Process(target=drain_worker, args=(tasks, queue_dir, index)) for index in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    with open(logfile) as log:
+        runs = log.read().split("\n")[:-1]
+    assert sorted(runs) == sorted(task["name"] for task in tasks)
+    ## The final task ran after every task it depends on
+    assert runs[-1] == "final"
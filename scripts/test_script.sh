@@ -28,9 +28,42 @@ python3 -m pip install BayesASE
 
 Rscript -e 'install.packages("here")'
 
+#####################################
+#run_pipeline.py runs every step below (simulate, merge, fit, summarize, plot) from one config file as a 
+#task graph: a task only runs if its outputs are missing, its inputs are newer or its parameters changed, 
+#and independent tasks run in parallel. After adding a theta to a design file, only its datasets, merges, 
+#fits and the summary and plots are redone. -n prints what would run. Outputs go to example_in/pipeline_out 
+#([pipeline] outdir), not to the reference outputs in example_out. 
+###############################################################
+#python3 ${Python_Programs}/run_pipeline.py -c ${Input}/pipeline.ini
+
+#####################################
+#sweep_simul.py replaces the two simulation steps below for parameter sweeps: theta, map bias (q, or 
+#rsim-g1 and rsim-g2), dispersion (phi), biorep effect heterogeneity (biorepsd), nbiorep and depth are 
+#given as lists, ranges or Latin-hypercube intervals in an INI file, and the datasets of all scenarios 
+#with the same nbiorep and simruns are drawn together in batches. Each dataset has its own random stream, so 
+#adding a scenario leaves the other datasets of the same --seed unchanged. Merge them as below, without -d1/-d2. 
+###############################################################
+#python3 ${Python_Programs}/sweep_simul.py -c ${Input}/sweep.ini -o ${Output} --seed 1
+
 #####################################
 #Simulate read counts according to negative binomial model as described in G3 paper 
 #using the user specified simulation parameters in the CSV desing file.  
+#Add -f npz to this step and the merge step below to store datasets in the binary npz format, 
+#and convert them to TSV with export_counts.py right before fitting the model. 
+#For very large simruns, add -c 100000 to simulate and write 100000 features at a time 
+#in constant memory; for a given --seed the datasets do not depend on the chunk size. 
+#Streamed datasets are checkpointed every 60 seconds (--checkpoint): run the same command 
+#with the same --seed after a crash and each dataset resumes from its last checkpoint. 
+#Each dataset draws from a stream keyed on its set and file name, so running both design files 
+#with the same --seed gives independent datasets unless --crn is added. 
+#Every output is written under a hidden name and renamed when complete, next to a .check 
+#file with its size and hash; the steps reading it stop on a truncated or modified file. 
+#Add --crn with the same --seed (e.g. --crn --seed 1) to both simulation steps, and --crn to 
+#the merge step, to share random draws between scenarios that differ only in theta or read 
+#depth (common random numbers, needs scipy), and -p theta2 allelicreads to the summary step 
+#to report paired differences of power. --crn without --seed is refused: each step would draw 
+#its own seed and share nothing with the other. 
 ###############################################################
 cd $Python_Programs
 python3 ${Python_Programs}/run_read_count_simul.py -d ${Input}/design_H1_null.csv -o ${Output}
@@ -40,11 +73,19 @@ python3 ${Python_Programs}/run_read_count_simul.py -d ${Input}/design_H1_not_nul
 #Merges pairs of datasets based on the design files that were used to simulate them. 
 #Datasets are merged if they all have the same parameters except for theta. 
 #User can now specify a different output directory. 
+#Without -d1/-d2, every simulated dataset under -i is cataloged and all pairs are merged in one run 
+#(theta1 = 0.5 or theta1 = theta2; add -a for every pair of levels of AI). 
 ###############################################################
 
 python3 ${Python_Programs}/merge_simul_conditions.py -d1 $Input/design_H1_null.csv -d2 $Input/design_H1_null.csv -i $Output
 python3 ${Python_Programs}/merge_simul_conditions.py -d1 $Input/design_H1_null.csv -d2 $Input/design_H1_not_null.csv -i $Output
 python3 ${Python_Programs}/merge_simul_conditions.py -d1 $Input/design_H1_not_null.csv -d2 $Input/design_H1_not_null.csv -i $Output
+#python3 ${Python_Programs}/merge_simul_conditions.py -i $Output
+#With more than 2 sets simulated (run_read_count_simul.py --sets S), -k K builds up to K merged replicates 
+#per scenario from distinct pairings of the sets (--resample completes them by resampling features). 
+#The source sets are in the filenames (_sets_<c1>-<c2>) and in merged_sources.csv; the summary keeps them 
+#in source_c1/source_c2 and plot_power.py accounts for shared sets in the error bars. 
+#python3 ${Python_Programs}/merge_simul_conditions.py -i $Output -k 6
 
 
 ###############################################################
@@ -65,6 +106,55 @@ python3 ${Python_Programs}/create_nbmodel_design_file.py -i ${input_file} -o $In
 nbmodel_stan2.py -d $Input/condition_design_file.tsv -i ${input_file} -c 2 -t 6000 -w 3000 
 done
 
+###############################################################
+#Alternatively, run_nbmodel_fits.py finds every dataset in the H1_<>_H2_<>_H3_<> folders and fits them 
+#in parallel, each with its own design file and working directory (under ${Output}/ase_bayesian_out_fits). 
+#Datasets with a complete bayesian_out_*.tabular are skipped, so an interrupted run resumes where it stopped. 
+###############################################################
+
+#python3 ${Python_Programs}/run_nbmodel_fits.py -i $Output -o $Output/ase_bayesian_out -c 2 -t 6000 -w 3000
+
+###############################################################
+#With --warm, the fits run in long-lived worker processes that load nbmodel_stan2.py once and then take 
+#datasets from a queue, so that interpreter startup, imports and model loading are paid once per worker 
+#rather than once per dataset. Each dataset still gets its own bayesian_out_<compID>.tabular file. 
+#create_nbmodel_design_file.py also lists several datasets (or the datasets of a folder) in one design 
+#file, one compID row each, for a single invocation of nbmodel_stan2.py. 
+###############################################################
+
+#python3 ${Python_Programs}/run_nbmodel_fits.py -i $Output -o $Output/ase_bayesian_out -c 2 -t 6000 -w 3000 --warm
+#python3 ${Python_Programs}/create_nbmodel_design_file.py -i $Output/H1_*_H2_*_H3_* -o $Input/batch_design_file.tsv
+
+
+###############################################################
+#For screening large design grids, fit_approx_nbmodel.py fits a grid approximation of the same 
+#NB model to all features of each dataset in seconds and writes the same bayesian_out_*.tabular files. 
+#calibrate_approx_nbmodel.py compares its Type I error and power with MCMC fits of a reference grid. 
+###############################################################
+
+#python3 ${Python_Programs}/fit_approx_nbmodel.py -i $Output/H1_*_H2_*_H3_*/*.tsv -o $Output/ase_approx_out
+#python3 ${Python_Programs}/calibrate_approx_nbmodel.py -m $Output/ase_bayesian_out -a $Output/ase_approx_out -o $Output/approx_calibration.csv
+
+###############################################################
+#Instead of a fixed simruns, run_adaptive_power.py simulates and fits each two-condition scenario 
+#(theta1, theta2, nbiorep, n_allele_specific_reads[, simruns cap]) in batches and stops once the 
+#confidence intervals of prop_H1_LE05, prop_H2_LE05 and prop_H3_LE05 are narrower than -w. 
+#The number of features used by each scenario is in <outdir>_adaptive_summary.csv.
+###############################################################
+
+#python3 ${Python_Programs}/run_adaptive_power.py -d $Output/adaptive_design.csv -o $Output/ase_adaptive_out -b 1000 -w 0.02 --seed 1
+
+###############################################################
+#search_design.py finds the cheapest design (bioreps x allele specific reads per biorep) that reaches 
+#a target power for H1 or H3 at a given delta AI with a Type I error below -a. For each number of 
+#bioreps, the read depth is found by bisection, and only the design points the search needs are 
+#simulated and fit. A point is feasible when the lower bound of its power is at least -p and the upper 
+#bound of its Type I error at most -a, so -w must be narrow enough to tell them apart from the thresholds. 
+#The search path with the cost of each point is saved to -o.
+###############################################################
+
+#python3 ${Python_Programs}/search_design.py -H H3 -d 0.4 -p 0.8 -a 0.05 -n 2 10 -r 10 1000 --cost_biorep 1 --cost_read 0.001 -o $Output/design_search.csv --seed 1
+
 
 ###############################################################
 #Compute summary statistics of posterior estimates and include simulation parameter information 
@@ -72,6 +162,19 @@ done
 #More than one directory can be given to the argument -i.
 ###############################################################
 python ${Python_Programs}/summarize_posterior_estimates.py -o $Output/ase_bayesian_out_posterior_estimates_summary.csv -i $Output/ase_bayesian_out
+#For fits of millions of features, add --chunk_size 100000 to read 100000 rows at a time in bounded memory: 
+#averages, variances and proportions stay exact, and medians are estimated within a rank error of 
+#--quantile_error (default 0.001) times the number of features. 
+#python ${Python_Programs}/summarize_posterior_estimates.py -o $Output/ase_bayesian_out_posterior_estimates_summary.csv -i $Output/ase_bayesian_out --chunk_size 100000
+
+###############################################################
+#With --store, run_read_count_simul.py, merge_simul_conditions.py, run_nbmodel_fits.py and summarize_posterior_estimates.py 
+#record their outputs in a SQLite scenario store. Datasets simulated with the same parameters and seed, and datasets 
+#with the same content fit with the same options, are copied from the store instead of computed again. 
+#query_scenario_store.py selects summary rows (or records) by any parameter.
+###############################################################
+#python3 ${Python_Programs}/summarize_posterior_estimates.py -o $Output/ase_bayesian_out_posterior_estimates_summary.csv -i $Output/ase_bayesian_out --store $Output/scenarios.db
+#python3 ${Python_Programs}/query_scenario_store.py -s $Output/scenarios.db -w "num_bioreps >= 4 AND delta_AI_3 = 0.2" -o $Output/query.csv
 
 
 ###############################################################
@@ -91,6 +194,56 @@ python ${Python_Programs}/plot_power.py -p nfeature -o $Output/data_visualizatio
 
 python ${Python_Programs}/plot_power.py -p delta_AI -o $Output/data_visualization -i $Output/posterior_estimates_summary.csv
 
+###############################################################
+#build_power_surface.py turns summary CSV files into a small binary lookup surface of power and Type I error 
+#over num_bioreps, reads per biorep and delta_AI (H1 and H3, levels 0.05 and 0.01). query_power_surface.py 
+#interpolates between the simulated points in milliseconds with an uncertainty band, and flags points 
+#outside the simulated region or not surrounded by simulated points. 
+###############################################################
+#python3 ${Python_Programs}/build_power_surface.py -i $Output/posterior_estimates_summary.csv -o $Output/power_surface.npz
+#python3 ${Python_Programs}/query_power_surface.py -s $Output/power_surface.npz -b 4 -r 500 -d 0.2
+
 
 
  
+
+
+###############################################################
+#benchmark_pipeline.py times every stage (simulate, merge, fit with a stand-in for nbmodel_stan2.py, 
+#summarize, plot setup) on synthetic inputs and records the peak memory of each case in a JSON file. 
+#--scale large goes up to simruns 1e6 and 5000 .tabular files. -c compares with the JSON file of another 
+#commit and exits with status 1 if a case got slower or bigger than --threshold.
+###############################################################
+#python3 ${Python_Programs}/benchmark_pipeline.py --scale medium -o $Output/benchmark_results.json
+#python3 ${Python_Programs}/benchmark_pipeline.py -c baseline_results.json $Output/benchmark_results.json
+
+###############################################################
+#--telemetry LOG (or the BAYESASE_TELEMETRY=LOG environment variable) makes the scripts append one JSON line per 
+#stage and per child process (Rscript, nbmodel_stan2.py) to LOG with its wall time, CPU time, peak memory and bytes 
+#read and written, tagged with the scenario parameters. telemetry_report.py ranks the slowest stages and scenarios. 
+#Records of stages run in threads (scope 'thread') have the CPU time of their thread, but the peak memory and 
+#bytes of the whole process. 
+###############################################################
+#export BAYESASE_TELEMETRY=$Output/telemetry.jsonl
+#python3 ${Python_Programs}/telemetry_report.py -i $Output/telemetry.jsonl -n 20
+
+###############################################################
+#bayesase_power.py runs the simulate, merge, design, fit, summarize and plot steps as subcommands in one 
+#process, with the options of the corresponding scripts. A script, and the libraries it needs, is only 
+#imported when its subcommand runs, which saves interpreter and import time when a workflow manager 
+#runs the steps many times. 
+###############################################################
+#python3 ${Python_Programs}/bayesase_power.py simulate -d ${Input}/design_H1_null.csv -o ${Output}
+#python3 ${Python_Programs}/bayesase_power.py merge -d1 $Input/design_H1_null.csv -d2 $Input/design_H1_null.csv -i $Output
+#python3 ${Python_Programs}/bayesase_power.py summarize -i $Output/ase_bayesian_out -o $Output/posterior_estimates_summary.csv
+#python3 ${Python_Programs}/bayesase_power.py plot -p num_bioreps -o $Output/data_visualization -i $Output/posterior_estimates_summary.csv
+
+###############################################################
+#With --queue DIR on a filesystem shared by several hosts (e.g. NFS), run_pipeline.py drains the task 
+#graph together with every other run_pipeline.py started with the same config and DIR, on any host. 
+#Each task is claimed with a lease file, renewed while it runs, and marked done in DIR; the tasks of a 
+#worker that died are taken over once its lease is older than --lease seconds. -j is the number of 
+#workers on this host. Failed tasks are recorded in DIR/failed; remove their markers to retry them. 
+#tests/test_work_queue.py races several processes for the same leases (python -m pytest -q tests). 
+###############################################################
+#python3 ${Python_Programs}/run_pipeline.py -c ${Input}/pipeline.ini -q ${Input}/pipeline_out/queue -j 4